@@ -11,20 +11,42 @@
 
 import arcpy
 from arcpy.sa import *
+import numpy as np
 import os
 import sys
 import datetime
 import time
+import shutil
+import tempfile
 import FindBraidedNetwork
 import BRAT_Braid_Handler
-from SupportingFunctions import make_layer, make_folder, getUUID, find_relative_path, write_xml_element_with_path
+from SupportingFunctions import make_layer, make_folder, getUUID, find_relative_path, write_xml_element_with_path, \
+    write_arrays_to_fields
 import XMLBuilder
+import Zonal_Stats
+reload(Zonal_Stats)
+import Focal_Stats
+reload(Focal_Stats)
+import Hydrology_Cache
+reload(Hydrology_Cache)
+import Distance_Stats
+reload(Distance_Stats)
+import Crossing_Index
+reload(Crossing_Index)
+import Stage_Scheduler
+reload(Stage_Scheduler)
 reload(XMLBuilder)
 XMLBuilder = XMLBuilder.XMLBuilder
 
 reload(FindBraidedNetwork)
 reload(BRAT_Braid_Handler)
 
+# fields each attribute stage writes to the network
+IGEO_FIELDS = ["iGeo_ElMax", "iGeo_ElMin", "iGeo_Len", "iGeo_Slope", "iGeo_DA"]
+IVEG_FIELDS = ["iVeg_100EX", "iVeg_30EX", "iVeg_100PT", "iVeg_30PT"]
+IPC_FIELDS = ["iPC_RoadX", "iPC_Road", "iPC_RoadVB", "iPC_Rail", "iPC_RailVB", "iPC_Canal", "iPC_LU", "iPC_VLowLU",
+              "iPC_LowLU", "iPC_ModLU", "iPC_HighLU", "oPC_Dist"]
+
 
 def main(
     proj_path,
@@ -42,11 +64,23 @@ def main(
     description,
     find_clusters,
     should_segment_network,
-    is_verbose):
+    is_verbose,
+    zonal_engine='arcpy',
+    distance_engine='raster',
+    workers=None,
+    lazy_buffers=None,
+    crossing_engine='arcpy'):
 
     find_clusters = parse_input_bool(find_clusters)
     should_segment_network = parse_input_bool(should_segment_network)
     is_verbose = parse_input_bool(is_verbose)
+    lazy_buffers = parse_input_bool(lazy_buffers)
+    if zonal_engine is None:
+        zonal_engine = 'arcpy'
+    if distance_engine is None:
+        distance_engine = 'raster'
+    if crossing_engine is None:
+        crossing_engine = 'arcpy'
 
     scratch = 'in_memory'
     #arcpy.env.workspace = scratch
@@ -58,7 +92,8 @@ def main(
 
     # name and create output folder
     new_output_folder, intermediate_folder, seg_network_copy = build_output_folder(proj_path, out_name, seg_network, road,
-                                                                                  should_segment_network, is_verbose)
+                                                                                  should_segment_network, is_verbose,
+                                                                                  crossing_engine)
 
     # --check input network fields--
     # add flowline reach id field ('ReachID') if it doens't already exist
@@ -75,43 +110,68 @@ def main(
     # create 'Buffers' folder if it doesn't exist
     buffers_folder = make_folder(intermediate_folder, "01_Buffers")
 
-    # create network segment midpoints
-    if is_verbose:
-        arcpy.AddMessage("Finding network segment midpoints...")
-    midpoints = arcpy.FeatureVerticesToPoints_management(seg_network_copy, scratch + "/midpoints", "MID")
-    # remove unwanted fields from midpoints
-    fields = arcpy.ListFields(midpoints)
-    keep = ['ReachID']
-    drop = []
-    for field in fields:
-        if not field.required and field.name not in keep and field.type != 'Geometry':
-            drop.append(field.name)
-    if len(drop) > 0:
-        arcpy.DeleteField_management(midpoints, drop)
+    buf_30m_path = os.path.join(buffers_folder, "buffer_30m.shp")
+    buf_100m_path = os.path.join(buffers_folder, "buffer_100m.shp")
+    if lazy_buffers and zonal_engine != 'numpy':
+        arcpy.AddWarning("Buffers are only made as they are needed with the numpy zonal statistics engine, so they " +
+                         "are made with the Buffer tool")
+        lazy_buffers = False
+    if lazy_buffers and arcpy.Describe(seg_network_copy).spatialReference.type != 'Projected':
+        arcpy.AddWarning("The network is not in a projected coordinate system, so buffers are made with the Buffer " +
+                         "tool")
+        lazy_buffers = False
+
+    if lazy_buffers:
+        # the cells in each buffer are found straight from the reaches as they are summarized, and the buffer
+        # shapefiles are only written if the layer package needs them
+        midpoint_buffer = LazyBuffer(seg_network_copy, 100, scratch + "/midpoint_buffer", midpoints=True)
+        buf_30m = LazyBuffer(seg_network_copy, 30, buf_30m_path)
+        buf_100m = LazyBuffer(seg_network_copy, 100, buf_100m_path)
+    else:
+        # create network segment midpoints
+        if is_verbose:
+            arcpy.AddMessage("Finding network segment midpoints...")
+        midpoints = arcpy.FeatureVerticesToPoints_management(seg_network_copy, scratch + "/midpoints", "MID")
+        # remove unwanted fields from midpoints
+        fields = arcpy.ListFields(midpoints)
+        keep = ['ReachID']
+        drop = []
+        for field in fields:
+            if not field.required and field.name not in keep and field.type != 'Geometry':
+                drop.append(field.name)
+        if len(drop) > 0:
+            arcpy.DeleteField_management(midpoints, drop)
 
-    if is_verbose:
-        arcpy.AddMessage("Making buffers...")
-    # create midpoint 100 m buffer
-    midpoint_buffer = arcpy.Buffer_analysis(midpoints, scratch + "/midpoint_buffer", "100 Meters")
-    # create network 30 m buffer
-    buf_30m = os.path.join(buffers_folder, "buffer_30m.shp")
-    arcpy.Buffer_analysis(seg_network_copy, buf_30m, "30 Meters", "", "ROUND")
-    # create network 100 m buffer
-    buf_100m = os.path.join(buffers_folder, "buffer_100m.shp")
-    arcpy.Buffer_analysis(seg_network_copy, buf_100m, "100 Meters", "", "ROUND")
-
-    # run geo attributes function
-    arcpy.AddMessage('Adding "iGeo" attributes to network...')
-    igeo_attributes(seg_network_copy, in_DEM, flow_acc, midpoint_buffer, scratch, is_verbose)
-
-    # run vegetation attributes function
-    arcpy.AddMessage('Adding "iVeg" attributes to network...')
-    iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, seg_network_copy, scratch, is_verbose)
-
-    # run ipc attributes function if conflict layers are defined by user
-    if road is not None and valley_bottom is not None:
-        arcpy.AddMessage('Adding "iPC" attributes to network...')
-        ipc_attributes(seg_network_copy, road, railroad, canal, valley_bottom, buf_30m, buf_100m, landuse, scratch, proj_path, is_verbose)
+        if is_verbose:
+            arcpy.AddMessage("Making buffers...")
+        # create midpoint 100 m buffer
+        midpoint_buffer = arcpy.Buffer_analysis(midpoints, scratch + "/midpoint_buffer", "100 Meters")
+        # create network 30 m buffer
+        buf_30m = buf_30m_path
+        arcpy.Buffer_analysis(seg_network_copy, buf_30m, "30 Meters", "", "ROUND")
+        # create network 100 m buffer
+        buf_100m = buf_100m_path
+        arcpy.Buffer_analysis(seg_network_copy, buf_100m, "100 Meters", "", "ROUND")
+
+    if workers is not None and int(workers) > 1:
+        # the iGeo, iVeg and iPC attributes come from different inputs and go to different fields, so run them at once
+        run_attribute_stages(seg_network_copy, in_DEM, flow_acc, midpoint_buffer, coded_veg, coded_hist, buf_100m,
+                             buf_30m, road, railroad, canal, valley_bottom, landuse, scratch, proj_path, is_verbose,
+                             zonal_engine, distance_engine, int(workers), crossing_engine)
+    else:
+        # run geo attributes function
+        arcpy.AddMessage('Adding "iGeo" attributes to network...')
+        igeo_attributes(seg_network_copy, in_DEM, flow_acc, midpoint_buffer, scratch, is_verbose, zonal_engine)
+
+        # run vegetation attributes function
+        arcpy.AddMessage('Adding "iVeg" attributes to network...')
+        iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, seg_network_copy, scratch, is_verbose, zonal_engine)
+
+        # run ipc attributes function if conflict layers are defined by user
+        if road is not None and valley_bottom is not None:
+            arcpy.AddMessage('Adding "iPC" attributes to network...')
+            ipc_attributes(seg_network_copy, road, railroad, canal, valley_bottom, buf_30m, buf_100m, landuse, scratch, proj_path, is_verbose,
+                           zonal_engine, distance_engine, crossing_engine)
 
     handle_braids(seg_network_copy, canal, proj_path, find_clusters, is_verbose)
 
@@ -126,13 +186,48 @@ def main(
 
     make_layers(seg_network_copy)
     write_xml(new_output_folder, coded_veg, coded_hist, seg_network, in_DEM, valley_bottom, landuse, DrAr,
-              road, railroad, canal, buf_30m, buf_100m, seg_network_copy, description)
+              road, railroad, canal, buf_30m_path, buf_100m_path, seg_network_copy, description)
 
     run_tests(seg_network_copy, is_verbose)
 
     arcpy.CheckInExtension("spatial")
 
 
+def run_attribute_stages(seg_network_copy, in_DEM, flow_acc, midpoint_buffer, coded_veg, coded_hist, buf_100m, buf_30m,
+                         road, railroad, canal, valley_bottom, landuse, scratch, proj_path, is_verbose, zonal_engine,
+                         distance_engine, workers, crossing_engine='arcpy'):
+    """
+    Runs the iGeo, iVeg and iPC attribute functions in separate processes, each on its own copy of the network, and
+    writes all of their fields to the network at the end. The buffer coverage and hydrology caches are on disk, so
+    every process shares them
+    :param workers: Number of processes to run the stages in
+    :return:
+    """
+    arcpy.AddMessage('Adding "iGeo", "iVeg" and "iPC" attributes to network in ' + str(workers) + ' processes...')
+    # the midpoint buffer is in memory, which the other processes can't see. A LazyBuffer is only made in the stage
+    stage_folder = tempfile.mkdtemp(prefix="BRAT_Table_")
+    midpoint_buffer_copy = midpoint_buffer
+    if not isinstance(midpoint_buffer, LazyBuffer):
+        midpoint_buffer_copy = os.path.join(stage_folder, "midpoint_buffer.shp")
+        arcpy.CopyFeatures_management(midpoint_buffer, midpoint_buffer_copy)
+
+    network = Stage_Scheduler.NETWORK
+    stages = [Stage_Scheduler.Stage('iGeo', igeo_attributes, [network, in_DEM, flow_acc, midpoint_buffer_copy, scratch,
+                                                              is_verbose, zonal_engine], IGEO_FIELDS),
+              Stage_Scheduler.Stage('iVeg', iveg_attributes, [coded_veg, coded_hist, buf_100m, buf_30m, network,
+                                                              scratch, is_verbose, zonal_engine], IVEG_FIELDS)]
+    if road is not None and valley_bottom is not None:
+        stages.append(Stage_Scheduler.Stage('iPC', ipc_attributes, [network, road, railroad, canal, valley_bottom,
+                                                                    buf_30m, buf_100m, landuse, scratch, proj_path,
+                                                                    is_verbose, zonal_engine, distance_engine,
+                                                                    crossing_engine],
+                                            IPC_FIELDS))
+    Stage_Scheduler.run_stages(seg_network_copy, stages, workers)
+    if not isinstance(midpoint_buffer_copy, LazyBuffer):
+        delete_with_arcpy([midpoint_buffer_copy])
+    shutil.rmtree(stage_folder, ignore_errors=True)
+
+
 def test_xml(proj_path, coded_veg, coded_hist, seg_network, in_DEM, valley_bottom, landuse, flow_acc, road, railroad, canal):
     new_output_folder = os.path.join(proj_path, "Output_1")
     DrAr = find_dr_ar(flow_acc, in_DEM)
@@ -154,7 +249,8 @@ def find_dr_ar(flow_acc, in_DEM):
     return DrArea
 
 
-def build_output_folder(proj_path, out_name, seg_network, road, should_segment_network, is_verbose):
+def build_output_folder(proj_path, out_name, seg_network, road, should_segment_network, is_verbose,
+                        crossing_engine='arcpy'):
     if is_verbose:
         arcpy.AddMessage("Building folder structure...")
     master_outputs_folder = os.path.join(proj_path, "Outputs")
@@ -183,7 +279,7 @@ def build_output_folder(proj_path, out_name, seg_network, road, should_segment_n
         seg_network_copy = os.path.join(intermediate_folder, out_name + ".shp")
 
     if should_segment_network:
-        segment_by_roads(seg_network, seg_network_copy, road, is_verbose)
+        segment_by_roads(seg_network, seg_network_copy, road, is_verbose, crossing_engine)
     else:
         arcpy.CopyFeatures_management(seg_network, seg_network_copy)
 
@@ -191,32 +287,96 @@ def build_output_folder(proj_path, out_name, seg_network, road, should_segment_n
 
 
 
-def segment_by_roads(seg_network, seg_network_copy, roads, is_verbose):
+def segment_by_roads(seg_network, seg_network_copy, roads, is_verbose, crossing_engine='arcpy'):
     """
     Segments the seg_network by roads, and puts segmented network at seg_network_copy
     :param seg_network: Path to the seg_network that we want to segment further
     :param seg_network_copy: Path to where we want the new network to go
     :param roads: The shape file we use to segment
+    :param crossing_engine: 'arcpy' to split with FeatureToLine, or 'rtree' to split each reach only where roads cross
+    it, found with Crossing_Index
     :return:
     """
     arcpy.AddMessage("Segmenting network by roads...")
 
-    temp_network = os.path.join(os.path.dirname(seg_network_copy), "temp.shp")
-    temp_layer = "temp_lyr"
-    temp_seg_network_layer = "seg_network_lyr"
+    if crossing_engine != 'rtree':
+        temp_network = os.path.join(os.path.dirname(seg_network_copy), "temp.shp")
+        temp_layer = "temp_lyr"
+        temp_seg_network_layer = "seg_network_lyr"
+
+        arcpy.FeatureToLine_management([seg_network, roads], temp_network)
+
+        arcpy.MakeFeatureLayer_management(temp_network, temp_layer)
+        arcpy.MakeFeatureLayer_management(seg_network, temp_seg_network_layer)
 
-    arcpy.FeatureToLine_management([seg_network, roads], temp_network)
+        arcpy.SelectLayerByLocation_management(temp_layer, "WITHIN", temp_seg_network_layer)
+        arcpy.CopyFeatures_management(temp_layer, seg_network_copy)
 
-    arcpy.MakeFeatureLayer_management(temp_network, temp_layer)
-    arcpy.MakeFeatureLayer_management(seg_network, temp_seg_network_layer)
+        delete_with_arcpy([temp_layer, temp_seg_network_layer, temp_network])
+        add_reach_dist(seg_network, seg_network_copy, is_verbose)
+        return
 
-    arcpy.SelectLayerByLocation_management(temp_layer, "WITHIN", temp_seg_network_layer)
-    arcpy.CopyFeatures_management(temp_layer, seg_network_copy)
+    # read every reach with its attributes, so each piece can be written with the attributes of its reach
+    fields = [f.name for f in arcpy.ListFields(seg_network) if f.type not in ['OID', 'Geometry'] and not f.required]
+    with arcpy.da.SearchCursor(seg_network, ['SHAPE@'] + fields) as cursor:
+        rows = [row for row in cursor]
+    reaches = [polyline_parts(row[0]) for row in rows]
+    crossing_index = Crossing_Index.CrossingIndex(reaches, read_polylines(roads))
+    splits = crossing_index.split_distances()
+
+    # split each reach at the distances along it where roads cross it
+    arcpy.CreateFeatureclass_management(os.path.dirname(seg_network_copy), os.path.basename(seg_network_copy),
+                                        "POLYLINE", seg_network,
+                                        spatial_reference=arcpy.Describe(seg_network).spatialReference)
+    with arcpy.da.InsertCursor(seg_network_copy, ['SHAPE@'] + fields) as cursor:
+        for row, reach_splits in zip(rows, splits):
+            if row[0] is None or not reach_splits:
+                cursor.insertRow(row)
+                continue
+            breaks = [0.0] + reach_splits + [row[0].length]
+            for start, end in zip(breaks[:-1], breaks[1:]):
+                cursor.insertRow([row[0].segmentAlongLine(start, end)] + list(row[1:]))
 
-    delete_with_arcpy([temp_layer, temp_seg_network_layer, temp_network])
     add_reach_dist(seg_network, seg_network_copy, is_verbose)
 
 
+def polyline_parts(polyline):
+    """
+    :param polyline: arcpy Polyline, or None
+    :return: List of the parts of the polyline, each a list of x, y vertices
+    """
+    if polyline is None:
+        return []
+    return [[(point.X, point.Y) for point in part if point is not None] for part in polyline]
+
+
+def read_polylines(feature):
+    """
+    Reads the vertices of every polyline in a feature class, for Crossing_Index.CrossingIndex
+    :param feature: Line features
+    :return: List with the parts of each polyline
+    """
+    with arcpy.da.SearchCursor(feature, ['SHAPE@']) as cursor:
+        return [polyline_parts(row[0]) for row in cursor]
+
+
+def write_crossing_points(out_network, road, road_crossings):
+    """
+    Makes a point at every place a reach crosses or touches a road. Places where a road runs along a reach, overlapping
+    it, are not crossings, so unlike Intersect no point is made there
+    :param out_network: The stream network
+    :param road: The road lines
+    :param road_crossings: Path of the point shapefile to make
+    :return:
+    """
+    crossing_index = Crossing_Index.CrossingIndex(read_polylines(out_network), read_polylines(road))
+    arcpy.CreateFeatureclass_management(os.path.dirname(road_crossings), os.path.basename(road_crossings), "POINT",
+                                        spatial_reference=arcpy.Describe(out_network).spatialReference)
+    with arcpy.da.InsertCursor(road_crossings, ['SHAPE@XY']) as cursor:
+        for point in crossing_index.points.tolist():
+            cursor.insertRow([tuple(point)])
+
+
 def add_reach_dist(seg_network, seg_network_copy, is_verbose):
     if is_verbose:
         arcpy.AddMessage("Calculating ReachDist...")
@@ -267,7 +427,13 @@ def add_reach_dist(seg_network, seg_network_copy, is_verbose):
 
 # zonal statistics within buffer function
 # dictionary join field function
-def zonalStatsWithinBuffer(buffer, ras, stat_type, stat_field, out_fc, out_FC_field, scratch):
+def zonalStatsWithinBuffer(buffer, ras, stat_type, stat_field, out_fc, out_FC_field, scratch, zonal_engine='arcpy'):
+    # the numpy engine handles overlapping buffers itself, so it doesn't need the reruns below
+    if zonal_engine == 'numpy':
+        numpy_zonal_stats_within_buffer(buffer, [(ras, stat_type, out_FC_field)], out_fc)
+        return
+
+    buffer = buffer_feature_class(buffer)
     # get input raster stat value within each buffer
     # note: zonal stats as table does not support overlapping polygons so we will check which
     #       reach buffers output was produced for and which we need to run tool on again
@@ -350,9 +516,277 @@ def zonalStatsWithinBuffer(buffer, ras, stat_type, stat_field, out_fc, out_FC_fi
         if item is not None:
             arcpy.Delete_management(item)
 
+def numpy_zonal_stats_within_buffer(buffer, jobs, out_fc):
+    """
+    Gets raster stat values within each buffer with the NumPy zonal statistics engine. Each buffer is rasterized on
+    its own, so overlapping buffers all get values without reruns. Rasters on the same grid are read together a window
+    at a time, so any number of rasters and stats only take one pass over the buffers' cells, and every field is
+    written in one sweep. The rasterized buffers are cached, so later rasters on the same grid reuse them
+    :param buffer: The reach buffer polygons, with a ReachID field, or a LazyBuffer
+    :param jobs: List of (raster, stat type, output field) tuples, with stat types from 'MINIMUM', 'MAXIMUM' and
+    'MEAN'. The rasters should be in the same coordinate system as the buffers
+    :param out_fc: The network to write the values to
+    :return:
+    """
+    if isinstance(buffer, LazyBuffer):
+        rings = None
+        reach_ids = buffer.reach_ids()
+        buffer_sr = buffer.spatial_reference()
+    else:
+        rings = read_buffer_rings(buffer)
+        reach_ids = np.asarray(rings[0])
+        buffer_sr = arcpy.Describe(buffer).spatialReference
+    reach_index = dict(zip(reach_ids.tolist(), range(len(reach_ids))))
+
+    # group the jobs by the grid of their raster, so rasters on the same grid share a coverage and a pass
+    grids = []
+    grid_jobs = []
+    sources = {}
+    for ras, stat_type, out_field in jobs:
+        raster = ras if isinstance(ras, arcpy.Raster) else arcpy.Raster(ras)
+        if not same_spatial_reference(raster.spatialReference, buffer_sr):
+            raise Exception("The buffers used for " + out_field + " are in " + buffer_sr.name + ", but the raster " +
+                            "is in " + raster.spatialReference.name + ". The NumPy zonal statistics engine does not " +
+                            "project on the fly, so project the raster or use the arcpy engine")
+        if str(ras) not in sources:
+            sources[str(ras)] = ArcpyRasterSource(raster)
+        grid = Zonal_Stats.RasterGrid(raster.extent.XMin, raster.extent.YMax, raster.meanCellWidth,
+                                      raster.meanCellHeight, raster.height, raster.width)
+        grid_keys = [known_grid.key() for known_grid in grids]
+        if grid.key() in grid_keys:
+            grid_jobs[grid_keys.index(grid.key())].append((sources[str(ras)], stat_type, out_field))
+        else:
+            grids.append(grid)
+            grid_jobs.append([(sources[str(ras)], stat_type, out_field)])
+
+    field_arrays = []
+    for grid, same_grid_jobs in zip(grids, grid_jobs):
+        coverage = buffer_coverage(buffer, grid, rings)
+        positions = np.asarray([reach_index[reach_id] for reach_id in coverage.reach_ids.tolist()], np.int64)
+        stats = Zonal_Stats.fused_zonal_statistics(coverage, [(source, stat_type)
+                                                              for source, stat_type, out_field in same_grid_jobs])
+        for (source, stat_type, out_field), coverage_stat in zip(same_grid_jobs, stats):
+            stat = np.full(len(reach_ids), np.nan)
+            stat[positions] = coverage_stat
+
+            # buffers without any raster data are left empty, rather than given a value they don't have
+            missing = np.isnan(stat)
+            if missing.any():
+                warning_message = "While calculating " + out_field + ", no raster cells with data fell within the "
+                warning_message += "buffers of the following ReachIDs, so they were left empty:\n"
+                warning_message += ", ".join([str(reach_id) for reach_id in reach_ids[missing].tolist()])
+                arcpy.AddWarning(warning_message + "\n")
+                stat = stat.astype(object)
+                stat[missing] = None
+            field_arrays.append((out_field, stat))
+
+    if field_arrays:
+        write_arrays_to_fields(out_fc, reach_ids, field_arrays, replace_fields=False)
+
+
+def same_spatial_reference(first, second):
+    """
+    :param first: An arcpy.SpatialReference
+    :param second: An arcpy.SpatialReference
+    :return: True if both are the same coordinate system, by their WKIDs, or by their names and units if either
+    doesn't have one
+    """
+    if first.factoryCode and second.factoryCode:
+        return first.factoryCode == second.factoryCode
+    return first.name == second.name and first.GCS.name == second.GCS.name and \
+        first.linearUnitName == second.linearUnitName
+
+
+def read_buffer_rings(buffer):
+    """
+    Reads the rings of each buffer polygon, as taken by Zonal_Stats.RasterGrid.polygon_cells
+    :param buffer: The reach buffer polygons, with a ReachID field
+    :return: Tuple of the list of ReachIDs and the list with the rings of each buffer
+    """
+    # arcpy separates the rings of a part with a None point
+    reach_ids = []
+    polygons = []
+    with arcpy.da.SearchCursor(buffer, ['ReachID', 'SHAPE@']) as cursor:
+        for row in cursor:
+            rings = []
+            if row[1] is not None:
+                for part in row[1]:
+                    ring = []
+                    for point in part:
+                        if point is None:
+                            rings.append(ring)
+                            ring = []
+                        else:
+                            ring.append((point.X, point.Y))
+                    rings.append(ring)
+            reach_ids.append(row[0])
+            polygons.append(rings)
+    return reach_ids, polygons
+
+
+def read_feature_vertices(feature):
+    """
+    Reads the vertices of line or point features, for Distance_Stats.FeatureDistanceIndex
+    :param feature: Line or point features
+    :return: Tuple of the list of line parts and the list of points, or None if the features are not lines or points
+    """
+    shape_type = arcpy.Describe(feature).shapeType
+    lines = []
+    points = []
+    if shape_type == 'Polyline':
+        with arcpy.da.SearchCursor(feature, ['SHAPE@']) as cursor:
+            for row in cursor:
+                if row[0] is None:
+                    continue
+                for part in row[0]:
+                    lines.append([(point.X, point.Y) for point in part if point is not None])
+    elif shape_type in ['Point', 'Multipoint']:
+        with arcpy.da.SearchCursor(feature, ['SHAPE@XY'], explode_to_points=True) as cursor:
+            for row in cursor:
+                if row[0] is not None and row[0][0] is not None:
+                    points.append(row[0])
+    else:
+        return None
+    return lines, points
+
+
+class ArcpyRasterSource(object):
+    """
+    Reads an arcpy raster a block at a time, for Zonal_Stats.fused_zonal_statistics
+    """
+    def __init__(self, raster):
+        """
+        :param raster: arcpy Raster object
+        """
+        self.raster = raster
+        self.nodata = raster.noDataValue
+        self.shape = (raster.height, raster.width)
+
+    def read_window(self, first_row, first_col, num_rows, num_cols):
+        """
+        :param first_row: The first row of the window
+        :param first_col: The first column of the window
+        :param num_rows: The number of rows in the window
+        :param num_cols: The number of columns in the window
+        :return: 2D array of the window
+        """
+        # the corner is put in the middle of the window's lower left cell, so it can't snap to a neighbouring cell
+        lower_left = arcpy.Point(self.raster.extent.XMin + (first_col + 0.5) * self.raster.meanCellWidth,
+                                 self.raster.extent.YMax - (first_row + num_rows - 0.5) * self.raster.meanCellHeight)
+        return arcpy.RasterToNumPyArray(self.raster, lower_left, num_cols, num_rows)
+
+
+class LazyBuffer(object):
+    """
+    A buffer around every reach, or around the midpoint of every reach, that is only made as it is needed. The NumPy
+    zonal statistics engine gets the cells it covers straight from the reach lines, and it is only written out with
+    the Buffer tool if something needs the feature class. It holds only paths and numbers, so it can be passed to the
+    attribute stages
+    """
+    def __init__(self, network, distance_meters, path, midpoints=False):
+        """
+        :param network: The network, in a projected coordinate system, with a ReachID field
+        :param distance_meters: The buffer distance, in meters
+        :param path: Where the buffer is written if its feature class is needed
+        :param midpoints: If True, the buffer is around the midpoint of each reach instead of the whole reach
+        """
+        self.network = network
+        self.distance_meters = distance_meters
+        self.path = path
+        self.midpoints = midpoints
+        self.coverages = {}
+
+    def spatial_reference(self):
+        """
+        :return: The spatial reference of the network
+        """
+        return arcpy.Describe(self.network).spatialReference
+
+    def radius(self):
+        """
+        :return: The buffer distance in the units of the network
+        """
+        return self.distance_meters / self.spatial_reference().metersPerUnit
+
+    def coverage(self, grid):
+        """
+        Finds the cells whose centers are within the buffer distance of each reach, or of its midpoint, the cells the
+        buffer polygons would cover. Coverages are kept for each grid, so rasters on the same grid reuse them
+        :param grid: The Zonal_Stats.RasterGrid of the raster the statistics will be found for
+        :return: Zonal_Stats.BufferCoverage
+        """
+        if grid.key() in self.coverages:
+            return self.coverages[grid.key()]
+        reach_ids = []
+        shapes = []
+        with arcpy.da.SearchCursor(self.network, ['ReachID', 'SHAPE@']) as cursor:
+            for row in cursor:
+                if row[1] is None:
+                    continue
+                reach_ids.append(row[0])
+                if self.midpoints:
+                    # the same point FeatureVerticesToPoints gives for MID
+                    midpoint = row[1].positionAlongLine(0.5, True).firstPoint
+                    shapes.append((midpoint.X, midpoint.Y))
+                else:
+                    shapes.append(polyline_parts(row[1]))
+        if self.midpoints:
+            points = np.asarray(shapes, np.float64).reshape(-1, 2)
+            coverage = Zonal_Stats.BufferCoverage.from_points(reach_ids, points[:, 0], points[:, 1], self.radius(),
+                                                              grid)
+        else:
+            coverage = Zonal_Stats.BufferCoverage.from_lines(reach_ids, shapes, self.radius(), grid)
+        self.coverages[grid.key()] = coverage
+        return coverage
+
+    def reach_ids(self):
+        """
+        :return: Array of the ReachID of every reach with a shape, in the order the coverages list them
+        """
+        with arcpy.da.SearchCursor(self.network, ['ReachID', 'SHAPE@']) as cursor:
+            return np.asarray([row[0] for row in cursor if row[1] is not None])
+
+    def feature_class(self):
+        """
+        Writes the buffer with the Buffer tool, as BRAT Table always used to, if it hasn't been written yet
+        :return: Path to the buffer polygons
+        """
+        if not arcpy.Exists(self.path):
+            if self.midpoints:
+                midpoints = arcpy.FeatureVerticesToPoints_management(self.network, 'in_memory/lazy_midpoints', "MID")
+                arcpy.Buffer_analysis(midpoints, self.path, str(self.distance_meters) + " Meters")
+                arcpy.Delete_management(midpoints)
+            else:
+                arcpy.Buffer_analysis(self.network, self.path, str(self.distance_meters) + " Meters", "", "ROUND")
+        return self.path
+
+
+def buffer_feature_class(buffer):
+    """
+    :param buffer: The reach buffer polygons, or a LazyBuffer
+    :return: Path to the buffer polygons, writing them first if they are a LazyBuffer
+    """
+    if isinstance(buffer, LazyBuffer):
+        return buffer.feature_class()
+    return buffer
+
+
+def buffer_coverage(buffer, grid, rings=None):
+    """
+    :param buffer: The reach buffer polygons, with a ReachID field, or a LazyBuffer
+    :param grid: The Zonal_Stats.RasterGrid of the raster the statistics will be found for
+    :param rings: The ReachIDs and rings of the buffer polygons from read_buffer_rings, if they have been read already
+    :return: Zonal_Stats.BufferCoverage of the buffer on the grid
+    """
+    if isinstance(buffer, LazyBuffer):
+        return buffer.coverage(grid)
+    reach_ids, polygons = rings if rings is not None else read_buffer_rings(buffer)
+    return Zonal_Stats.load_coverage(reach_ids, polygons, grid)
+
+
 # geo attributes function
 # calculates min and max elevation, length, slope, and drainage area for each flowline segment
-def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_verbose):
+def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_verbose, zonal_engine='arcpy'):
     # if fields already exist, delete them
     fields = [f.name for f in arcpy.ListFields(out_network)]
     drop = ["iGeo_ElMax", "iGeo_ElMin", "iGeo_Len", "iGeo_Slope", "iGeo_DA"]
@@ -375,11 +809,15 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
     arcpy.env.extent = desc.Extent
     arcpy.env.outputCoordinateSystem = desc.SpatialReference
     arcpy.env.cellSize = desc.meanCellWidth
-    # calculate mean z over 3x3 cell window
-    neighborhood = NbrRectangle(3, 3, "CELL")
-    tmp_dem = FocalStatistics(in_DEM, neighborhood, 'MEAN')
-    # clip smoothed dem to input dem
-    DEM = ExtractByMask(tmp_dem, in_DEM)
+    if zonal_engine == 'numpy':
+        # the DEM is only smoothed around the reach ends as they are read, unless the whole smoothed DEM is needed
+        DEM = None
+    else:
+        # calculate mean z over 3x3 cell window
+        neighborhood = NbrRectangle(3, 3, "CELL")
+        tmp_dem = FocalStatistics(in_DEM, neighborhood, 'MEAN')
+        # clip smoothed dem to input dem
+        DEM = ExtractByMask(tmp_dem, in_DEM)
 
     # function to attribute start/end elevation (dem z) to each flowline segment
     def zSeg(vertex_type, out_field):
@@ -393,7 +831,7 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
         arcpy.Buffer_analysis(tmp_pts, tmp_buff, '30 Meters')
         # get min dem z value within each buffer
         arcpy.AddField_management(out_network, out_field, "DOUBLE")
-        zonalStatsWithinBuffer(tmp_buff, DEM, 'MINIMUM', 'MIN', out_network, out_field, scratch)
+        zonalStatsWithinBuffer(tmp_buff, DEM, 'MINIMUM', 'MIN', out_network, out_field, scratch, zonal_engine)
 
         # delete temp fcs, tbls, etc.
         items = [tmp_pts, tmp_buff]
@@ -401,8 +839,18 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
             arcpy.Delete_management(item)
 
     # run zSeg function for start/end of each network segment
-    zSeg('START', 'iGeo_ElMax')
-    zSeg('END', 'iGeo_ElMin')
+    if zonal_engine == 'numpy' and arcpy.Describe(out_network).spatialReference.type == 'Projected':
+        if is_verbose:
+            arcpy.AddMessage("Calculating values for iGeo_ElMax and iGeo_ElMin...")
+        numpy_endpoint_elevations(out_network, in_DEM, 'iGeo_ElMax', 'iGeo_ElMin')
+    else:
+        if zonal_engine == 'numpy':
+            arcpy.AddWarning("The network is not in a projected coordinate system, so reach end elevations are found " +
+                             "with buffers")
+        if DEM is None:
+            DEM = Hydrology_Cache.smooth_dem(in_DEM, True)
+        zSeg('START', 'iGeo_ElMax')
+        zSeg('END', 'iGeo_ElMin')
 
     # calculate network reach slope
     arcpy.AddField_management(out_network, "iGeo_Len", "DOUBLE")
@@ -420,7 +868,7 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
     # get DA values
     if flow_acc is None:
         arcpy.AddMessage("Calculating drainage area...")
-        calc_drain_area(DEM, in_DEM)
+        calc_drain_area(DEM, in_DEM, zonal_engine == 'numpy')
     elif not os.path.exists(os.path.dirname(in_DEM) + "/Flow"): # if there's no folder for the flow accumulation, make one
         os.mkdir(os.path.dirname(in_DEM) + "/Flow")
         if is_verbose:
@@ -435,7 +883,7 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
     # get max drainage area within 100 m midpoint buffer
     if is_verbose:
         arcpy.AddMessage("Calculating iGeo_DA...")
-    zonalStatsWithinBuffer(midpoint_buffer, DrArea, "MAXIMUM", 'MAX', out_network, "iGeo_DA", scratch)
+    zonalStatsWithinBuffer(midpoint_buffer, DrArea, "MAXIMUM", 'MAX', out_network, "iGeo_DA", scratch, zonal_engine)
 
     # replace '0' drainage area values with tiny value
     with arcpy.da.UpdateCursor(out_network, ["iGeo_DA"]) as cursor:
@@ -447,9 +895,65 @@ def igeo_attributes(out_network, in_DEM, flow_acc, midpoint_buffer, scratch, is_
     return DrArea
 
 
+def numpy_endpoint_elevations(out_network, in_DEM, start_field, end_field, radius_meters=30.0):
+    """
+    Finds the minimum smoothed DEM value within a radius of the start and end of every reach in one pass over the DEM.
+    The cells around each end are found from the same disk of cell offsets instead of buffering points, so no point or
+    buffer feature classes are made. The DEM is smoothed with a 3x3 mean as it is read, so only the blocks around the
+    reach ends are ever smoothed
+    :param out_network: The network, in a projected coordinate system, with a ReachID field
+    :param in_DEM: The unsmoothed DEM, in the same coordinate system as the network
+    :param start_field: The field the minimum around the start of each reach is written to
+    :param end_field: The field the minimum around the end of each reach is written to
+    :param radius_meters: The radius around each end, in meters
+    :return:
+    """
+    # read the first and last vertex of each reach, which are what FeatureVerticesToPoints gives for START and END
+    reach_ids = []
+    starts = []
+    ends = []
+    with arcpy.da.SearchCursor(out_network, ['ReachID', 'SHAPE@']) as cursor:
+        for row in cursor:
+            if row[1] is None:
+                continue
+            reach_ids.append(row[0])
+            starts.append((row[1].firstPoint.X, row[1].firstPoint.Y))
+            ends.append((row[1].lastPoint.X, row[1].lastPoint.Y))
+    spatial_reference = arcpy.Describe(out_network).spatialReference
+
+    raster = in_DEM if isinstance(in_DEM, arcpy.Raster) else arcpy.Raster(in_DEM)
+    if not same_spatial_reference(raster.spatialReference, spatial_reference):
+        raise Exception("The network is in " + spatial_reference.name + ", but the DEM is in " +
+                        raster.spatialReference.name + ". The NumPy zonal statistics engine does not project on the " +
+                        "fly, so project the DEM or use the arcpy engine")
+    grid = Zonal_Stats.RasterGrid(raster.extent.XMin, raster.extent.YMax, raster.meanCellWidth,
+                                  raster.meanCellHeight, raster.height, raster.width)
+
+    # the starts and ends are summarized together, so the DEM is only read once
+    points = np.asarray(starts + ends, np.float64).reshape(-1, 2)
+    num_reaches = len(reach_ids)
+    coverage = Zonal_Stats.BufferCoverage.from_points(reach_ids + reach_ids, points[:, 0], points[:, 1],
+                                                      radius_meters / spatial_reference.metersPerUnit, grid)
+    smoothed_dem = Focal_Stats.FocalMeanSource(ArcpyRasterSource(raster))
+    elevations = Zonal_Stats.fused_zonal_statistics(coverage, [(smoothed_dem, 'MINIMUM')])[0]
+
+    # ends without any DEM data get 0, as the buffer engines give them
+    missing = np.isnan(elevations)
+    if missing.any():
+        warning_message = "No DEM cells with data fell within " + str(radius_meters) + " meters of an end of the "
+        warning_message += "following ReachIDs, so iGeo_ElMax or iGeo_ElMin was set to 0:\n"
+        warning_message += ", ".join([str(reach_id) for reach_id in sorted(set(coverage.reach_ids[missing].tolist()))])
+        arcpy.AddWarning(warning_message + "\n")
+        elevations[missing] = 0
+
+    write_arrays_to_fields(out_network, np.asarray(reach_ids, np.int64),
+                           [(start_field, elevations[:num_reaches]), (end_field, elevations[num_reaches:])],
+                           replace_fields=False)
+
+
 # vegetation attributes function
 # calculates both existing and potential mean vegetation value within 30 m and 100 m buffer of each stream segment
-def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scratch, is_verbose):
+def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scratch, is_verbose, zonal_engine='arcpy'):
 
     # if fields already exist, delete them
     fields = [f.name for f in arcpy.ListFields(out_network)]
@@ -458,6 +962,27 @@ def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scrat
         if field in drop:
             arcpy.DeleteField_management(out_network, field)
 
+    # the numpy engine gets the existing and historic values together, with one pass over each buffer
+    if zonal_engine == 'numpy':
+        if is_verbose:
+            arcpy.AddMessage("Creating current and historic veg lookup rasters...")
+        veg_lookup = Lookup(coded_veg, "VEG_CODE")
+        hist_veg_lookup = Lookup(coded_hist, "VEG_CODE")
+        if is_verbose:
+            arcpy.AddMessage("Calculating iVeg_100EX and iVeg_100PT...")
+        numpy_zonal_stats_within_buffer(buf_100m, [(veg_lookup, 'MEAN', "iVeg_100EX"),
+                                                   (hist_veg_lookup, 'MEAN', "iVeg_100PT")], out_network)
+        if is_verbose:
+            arcpy.AddMessage("Calculating iVeg_30EX and iVeg_30PT...")
+        numpy_zonal_stats_within_buffer(buf_30m, [(veg_lookup, 'MEAN', "iVeg_30EX"),
+                                                  (hist_veg_lookup, 'MEAN', "iVeg_30PT")], out_network)
+
+        # delete temp fcs, tbls, etc.
+        items = [veg_lookup, hist_veg_lookup]
+        for item in items:
+            arcpy.Delete_management(item)
+        return
+
     # --existing vegetation values--
     if is_verbose:
         arcpy.AddMessage("Creating current veg lookup raster...")
@@ -467,14 +992,14 @@ def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scrat
     # get mean existing veg value within 100 m buffer
     if is_verbose:
         arcpy.AddMessage("Calculating iVeg_100EX...")
-    zonalStatsWithinBuffer(buf_100m, veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_100EX", scratch)
+    zonalStatsWithinBuffer(buf_100m, veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_100EX", scratch, zonal_engine)
 
     # add mean veg value 'iVeg_VT30EX' field to flowline network
     arcpy.AddField_management(out_network, "iVeg_30EX", "DOUBLE")
     # get mean existing veg value within 30 m buffer
     if is_verbose:
         arcpy.AddMessage("Calculating iVeg_30EX...")
-    zonalStatsWithinBuffer(buf_30m, veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_30EX", scratch)
+    zonalStatsWithinBuffer(buf_30m, veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_30EX", scratch, zonal_engine)
 
     # delete temp fcs, tbls, etc.
     items = [veg_lookup]
@@ -491,14 +1016,14 @@ def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scrat
     # get mean potential veg value within 100 m buffer
     if is_verbose:
         arcpy.AddMessage("Calculating iVeg_100PT...")
-    zonalStatsWithinBuffer(buf_100m, hist_veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_100PT", scratch)
+    zonalStatsWithinBuffer(buf_100m, hist_veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_100PT", scratch, zonal_engine)
 
     # add mean veg value 'iVeg_30PT' field to flowline network
     arcpy.AddField_management(out_network, "iVeg_30PT", "DOUBLE")
     # get mean potential veg value within 30 m buffer
     if is_verbose:
         arcpy.AddMessage("Calculating iVeg_30PT...")
-    zonalStatsWithinBuffer(buf_30m, hist_veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_30PT", scratch)
+    zonalStatsWithinBuffer(buf_30m, hist_veg_lookup, 'MEAN', 'MEAN', out_network, "iVeg_30PT", scratch, zonal_engine)
 
     # delete temp fcs, tbls, etc.
     items = [hist_veg_lookup]
@@ -508,7 +1033,8 @@ def iveg_attributes(coded_veg, coded_hist, buf_100m, buf_30m, out_network, scrat
 
 # conflict potential function
 # calculates distances from road intersections, adjacent roads, railroads and canals for each flowline segment
-def ipc_attributes(out_network, road, railroad, canal, valley_bottom, buf_30m, buf_100m, landuse, scratch, projPath, is_verbose):
+def ipc_attributes(out_network, road, railroad, canal, valley_bottom, buf_30m, buf_100m, landuse, scratch, projPath, is_verbose,
+                   zonal_engine='arcpy', distance_engine='raster', crossing_engine='arcpy'):
     # create temp directory
     if is_verbose:
         arcpy.AddMessage("Deleting and remaking temp dir...")
@@ -525,27 +1051,48 @@ def ipc_attributes(out_network, road, railroad, canal, valley_bottom, buf_30m, b
         if field in drop:
             arcpy.DeleteField_management(out_network, field)
 
+    # the numpy engine collects the distance rasters and finds all of their values in one pass over the 30 m buffer
+    zonal_jobs = [] if zonal_engine == 'numpy' else None
+
+    # the vector engine samples the 30 m buffer at the cell centers of the distance rasters it replaces, and measures
+    # from them straight to the features. The distances are all written in one sweep at the end
+    distance_samples = None
+    distance_fields = []
+    if distance_engine == 'vector':
+        distance_samples = distance_sample_coverage(out_network, buf_30m)
+
     # calculate mean distance from road-stream crossings ('iPC_RoadX'), roads ('iPC_Road') and roads clipped to the valley bottom ('iPC_RoadVB')
     if road is not None:
         road_crossings = temp_dir + "\\roadx.shp"
         # create points at road-stream intersections
-        arcpy.Intersect_analysis([out_network, road], road_crossings, "", "", "POINT")
-        find_distance_from_feature(out_network, road_crossings, valley_bottom, temp_dir, buf_30m, "roadx", "iPC_RoadX", scratch, is_verbose, clip_feature = False)
+        if crossing_engine == 'rtree':
+            write_crossing_points(out_network, road, road_crossings)
+        else:
+            arcpy.Intersect_analysis([out_network, road], road_crossings, "", "", "POINT")
+        find_distance_from_feature(out_network, road_crossings, valley_bottom, temp_dir, buf_30m, "roadx", "iPC_RoadX", scratch, is_verbose, clip_feature = False, zonal_engine=zonal_engine, zonal_jobs=zonal_jobs, distance_samples=distance_samples, distance_fields=distance_fields)
 
     if road is not None:
-        find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "roadvb", "iPC_RoadVB", scratch, is_verbose, clip_feature = True)
-        find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "road", "iPC_Road", scratch, is_verbose, clip_feature = False)
+        find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "roadvb", "iPC_RoadVB", scratch, is_verbose, clip_feature = True, zonal_engine=zonal_engine, zonal_jobs=zonal_jobs, distance_samples=distance_samples, distance_fields=distance_fields)
+        find_distance_from_feature(out_network, road, valley_bottom, temp_dir, buf_30m, "road", "iPC_Road", scratch, is_verbose, clip_feature = False, zonal_engine=zonal_engine, zonal_jobs=zonal_jobs, distance_samples=distance_samples, distance_fields=distance_fields)
 
     if railroad is not None:
-        find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroadvb", "iPC_RailVB", scratch, is_verbose, clip_feature = True)
-        find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroad", "iPC_Rail", scratch, is_verbose, clip_feature = False)
+        find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroadvb", "iPC_RailVB", scratch, is_verbose, clip_feature = True, zonal_engine=zonal_engine, zonal_jobs=zonal_jobs, distance_samples=distance_samples, distance_fields=distance_fields)
+        find_distance_from_feature(out_network, railroad, valley_bottom, temp_dir, buf_30m, "railroad", "iPC_Rail", scratch, is_verbose, clip_feature = False, zonal_engine=zonal_engine, zonal_jobs=zonal_jobs, distance_samples=distance_samples, distance_fields=distance_fields)
 
     if canal is not None:
-        find_distance_from_feature(out_network, canal, valley_bottom, temp_dir, buf_30m, "canal", "iPC_Canal", scratch, is_verbose, clip_feature=False)
+        find_distance_from_feature(out_network, canal, valley_bottom, temp_dir, buf_30m, "canal", "iPC_Canal", scratch, is_verbose, clip_feature=False, zonal_engine=zonal_engine, zonal_jobs=zonal_jobs, distance_samples=distance_samples, distance_fields=distance_fields)
 
     # calculate mean landuse value ('iPC_LU')
     if landuse is not None:
-        add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose)
+        add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose, zonal_engine)
+
+    if zonal_jobs:
+        if is_verbose:
+            arcpy.AddMessage("Calculating " + ", ".join([job[2] for job in zonal_jobs]) + " values...")
+        numpy_zonal_stats_within_buffer(buf_30m, zonal_jobs, out_network)
+
+    if distance_fields:
+        write_arrays_to_fields(out_network, distance_samples[0].reach_ids, distance_fields, replace_fields=False)
 
     add_min_distance(out_network)
 
@@ -553,6 +1100,22 @@ def ipc_attributes(out_network, road, railroad, canal, valley_bottom, buf_30m, b
     arcpy.ClearEnvironment("extent")
 
 
+def distance_sample_coverage(out_network, buf):
+    """
+    Finds the cells of the buffers on the grid the Euclidean distance rasters would have been made on, which the vector
+    distance engine samples distances at. The coverage is cached like any other
+    :param out_network: The network, whose extent the distance rasters cover
+    :param buf: The buffer polygons, with a ReachID field, or a LazyBuffer
+    :return: Tuple of the Zonal_Stats.BufferCoverage and Zonal_Stats.RasterGrid
+    """
+    extent = arcpy.Describe(out_network).extent
+    spacing = Distance_Stats.DEFAULT_SAMPLE_SPACING
+    rows = int(np.ceil((extent.YMax - extent.YMin) / spacing))
+    cols = int(np.ceil((extent.XMax - extent.XMin) / spacing))
+    grid = Zonal_Stats.RasterGrid(extent.XMin, extent.YMin + rows * spacing, spacing, spacing, rows, cols)
+    return buffer_coverage(buf, grid), grid
+
+
 def add_min_distance(out_network):
     arcpy.AddField_management(out_network, "oPC_Dist", 'DOUBLE')
     fields = [f.name for f in arcpy.ListFields(out_network)]
@@ -567,14 +1130,17 @@ def add_min_distance(out_network):
             cursor.updateRow(row)
 
 
-def add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose):
+def add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose, zonal_engine='arcpy'):
     if is_verbose:
         arcpy.AddMessage("Calculating iPC_LU values...")
+    if zonal_engine == 'numpy':
+        numpy_landuse_to_table(out_network, landuse, buf_100m)
+        return
     arcpy.AddField_management(out_network, "iPC_LU", "DOUBLE")
     # create raster with just landuse code values
     lu_ras = Lookup(landuse, "LU_CODE")
     # calculate mean landuse value within 100 m buffer of each network segment
-    zonalStatsWithinBuffer(buf_100m, lu_ras, 'MEAN', 'MEAN', out_network, "iPC_LU", scratch)
+    zonalStatsWithinBuffer(buf_100m, lu_ras, 'MEAN', 'MEAN', out_network, "iPC_LU", scratch, zonal_engine)
     # get percentage of each land use class in 100 m buffer of stream segment
     fields = [f.name.upper() for f in arcpy.ListFields(landuse)]
 
@@ -583,6 +1149,7 @@ def add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose):
                          " with no typos if you wish to use the data from the land use raster")
         return
 
+    buf_100m = buffer_feature_class(buf_100m)
     buf_fields = [f.name for f in arcpy.ListFields(buf_100m)]
     if 'oArea' not in buf_fields:
         arcpy.AddField_management(buf_100m, 'oArea', 'DOUBLE')
@@ -630,6 +1197,69 @@ def add_landuse_to_table(out_network, landuse, buf_100m, scratch, is_verbose):
     arcpy.Delete_management(lu_ras)
 
 
+def numpy_landuse_to_table(out_network, landuse, buf_100m):
+    """
+    Finds iPC_LU and the percentage of each land use class in the 100 m buffer of each reach from one histogram of the
+    land use raster's values in each buffer, without converting the raster to polygons
+    :param out_network: The network to write the values to
+    :param landuse: The land use raster, with LU_CODE and LUI_Class fields in its attribute table
+    :param buf_100m: The 100 m buffer polygons, with a ReachID field, or a LazyBuffer
+    :return:
+    """
+    # read the land use code and class of each raster value from the attribute table
+    field_names = dict((f.name.upper(), f.name) for f in arcpy.ListFields(landuse))
+    for field_name in ["VALUE", "LU_CODE"]:
+        if field_name not in field_names:
+            raise Exception("The land use raster has no " + field_name + " field in its attribute table. The NumPy " +
+                            "zonal statistics engine needs the VALUE and LU_CODE fields to find iPC_LU")
+    has_classes = "LUI_CLASS" in field_names
+    read_fields = [field_names["VALUE"], field_names["LU_CODE"]]
+    if has_classes:
+        read_fields.append(field_names["LUI_CLASS"])
+    with arcpy.da.SearchCursor(landuse, read_fields) as cursor:
+        table_rows = [row for row in cursor]
+    class_values = [row[0] for row in table_rows]
+    codes = np.array([np.nan if row[1] is None else row[1] for row in table_rows], np.float64)
+
+    # count the cells of each raster value in each buffer
+    raster = arcpy.Raster(landuse)
+    grid = Zonal_Stats.RasterGrid(raster.extent.XMin, raster.extent.YMax, raster.meanCellWidth,
+                                  raster.meanCellHeight, raster.height, raster.width)
+    coverage = buffer_coverage(buf_100m, grid)
+    counts = Zonal_Stats.zonal_histogram(coverage, ArcpyRasterSource(raster), class_values)
+
+    # iPC_LU is the mean land use code of the cells, leaving out values without a code as Lookup does
+    has_code = ~np.isnan(codes)
+    code_counts = counts[:, has_code].sum(axis=1)
+    landuse_values = np.zeros(len(coverage.reach_ids))
+    occupied = code_counts > 0
+    landuse_values[occupied] = counts[occupied][:, has_code].dot(codes[has_code]) / code_counts[occupied]
+    if not occupied.all():
+        warning_message = "While calculating iPC_LU, no raster cells with data fell within the buffers of the "
+        warning_message += "following ReachIDs, so they were set to 0:\n"
+        warning_message += ", ".join([str(reach_id) for reach_id in coverage.reach_ids[~occupied].tolist()])
+        arcpy.AddWarning(warning_message + "\n")
+    write_arrays_to_fields(out_network, coverage.reach_ids, [("iPC_LU", landuse_values)])
+
+    if not has_classes:
+        arcpy.AddWarning("No field named \"LU_CLASS\" in the land use raster. Make sure that this field exists" +
+                         " with no typos if you wish to use the data from the land use raster")
+        return
+
+    # the percentage of each class is its share of the land use cells in the buffer, so the classes never add up to
+    # more than 100%. Reaches whose buffers don't cover any land use cells are left empty, as the pivot table leaves
+    # them
+    classes = np.array([str(row[2]).replace(" ", "") for row in table_rows])
+    cell_counts = counts.sum(axis=1)
+    covered = cell_counts > 0
+    field_arrays = []
+    for class_name, field_name in [('VeryLow', 'iPC_VLowLU'), ('Low', 'iPC_LowLU'), ('Moderate', 'iPC_ModLU'),
+                                   ('High', 'iPC_HighLU')]:
+        class_counts = counts[covered][:, classes == class_name].sum(axis=1)
+        field_arrays.append((field_name, np.round(100.0 * class_counts / cell_counts[covered], 2)))
+    write_arrays_to_fields(out_network, coverage.reach_ids[covered], field_arrays)
+
+
 def sanitize_area_piv_tbl(area_piv_tbl):
     """
     Makes sure that the areaPivTbl has all the fields we need. If it doesn't, we'll add it.
@@ -656,7 +1286,8 @@ def check_and_add_zero_fields(table, fields, field_name):
         arcpy.CalculateField_management(table, field_name, 0, "PYTHON")
 
 
-def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, buf, temp_name, new_field_name, scratch, is_verbose, clip_feature = False):
+def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, buf, temp_name, new_field_name, scratch, is_verbose, clip_feature = False,
+                               zonal_engine='arcpy', zonal_jobs=None, distance_samples=None, distance_fields=None):
     if is_verbose:
         arcpy.AddMessage("Calculating " + new_field_name + " values...")
     arcpy.AddField_management(out_network, new_field_name, "DOUBLE")
@@ -680,15 +1311,42 @@ def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, bu
                 cursor.updateRow(row)
     # if there are features, calculate distance
     else:
+        stat_type = 'MINIMUM' if new_field_name == 'iPC_RoadX' else 'MEAN'
+        feature_vertices = None
+        if distance_samples is not None:
+            feature_path = feature_subset.getOutput(0) if isinstance(feature_subset, arcpy.Result) else feature_subset
+            feature_vertices = read_feature_vertices(feature_path)
+            if feature_vertices is None:
+                arcpy.AddWarning("The vector distance engine only measures to lines and points, so " + new_field_name +
+                                 " is found with a distance raster")
+        if feature_vertices is not None:
+            # measure from the buffer samples straight to the features through a spatial index, without a raster
+            coverage, grid = distance_samples
+            index = Distance_Stats.FeatureDistanceIndex(feature_vertices[0], feature_vertices[1])
+            distances = Distance_Stats.buffer_distance_statistics(coverage, grid, index, [stat_type])[0]
+            # buffers without any samples get 0, as the zonal statistics engines give them
+            missing = np.isnan(distances)
+            if missing.any():
+                warning_message = "While calculating " + new_field_name + ", the buffers of the following ReachIDs "
+                warning_message += "were outside of the network extent, so they were set to 0:\n"
+                warning_message += ", ".join([str(reach_id) for reach_id in coverage.reach_ids[missing].tolist()])
+                arcpy.AddWarning(warning_message + "\n")
+                distances[missing] = 0
+            distance_fields.append((new_field_name, distances))
+            return
+
         # set extent to the stream network
         arcpy.env.extent = out_network
         # calculate euclidean distance from input features
         ed_feature = EucDistance(feature_subset, cell_size = 5) # cell size of 5 m
         # get min distance from feature in the within 30 m buffer of each network segment
-        if new_field_name == 'iPC_RoadX':
-            zonalStatsWithinBuffer(buf, ed_feature, 'MINIMUM', 'MIN', out_network, new_field_name, scratch)
+        # if jobs are being collected for a fused numpy pass, the distance raster is added to them instead
+        if zonal_jobs is not None:
+            zonal_jobs.append((ed_feature, stat_type, new_field_name))
+        elif new_field_name == 'iPC_RoadX':
+            zonalStatsWithinBuffer(buf, ed_feature, 'MINIMUM', 'MIN', out_network, new_field_name, scratch, zonal_engine)
         else:
-            zonalStatsWithinBuffer(buf, ed_feature, 'MEAN', 'MEAN', out_network, new_field_name, scratch)
+            zonalStatsWithinBuffer(buf, ed_feature, 'MEAN', 'MEAN', out_network, new_field_name, scratch, zonal_engine)
 
         # delete temp fcs, tbls, etc.
         items = []
@@ -696,25 +1354,21 @@ def find_distance_from_feature(out_network, feature, valley_bottom, temp_dir, bu
             arcpy.Delete_management(item)
 
 # calculate drainage area function
-def calc_drain_area(DEM, input_DEM):
-
-    #  define raster environment settings
-    desc = arcpy.Describe(DEM)
-    arcpy.env.extent = desc.Extent
-    arcpy.env.outputCoordinateSystem = desc.SpatialReference
-    arcpy.env.cellSize = desc.meanCellWidth
-
-    #  calculate cell area for use in drainage area calcultion
-    height = desc.meanCellHeight
-    width = desc.meanCellWidth
-    cell_area = height * width
-
-    # derive drainage area raster (in square km) from input DEM
-    # note: draiange area calculation assumes input dem is in meters
-    filled_DEM = Fill(DEM) # fill sinks in dem
-    flow_direction = FlowDirection(filled_DEM) # calculate flow direction
-    flow_accumulation = FlowAccumulation(flow_direction) # calculate flow accumulattion
-    drain_area = flow_accumulation * cell_area / 1000000 # calculate drainage area in square kilometers
+def calc_drain_area(DEM, input_DEM, use_cache=False):
+    """
+    Gets the drainage area raster of the DEM and saves it in the DEM's Flow folder
+    :param DEM: The DEM smoothed with a 3x3 mean, or None to only smooth it if the drainage area has to be derived
+    :param input_DEM: Path to the unsmoothed DEM
+    :param use_cache: If True, the hydrology rasters are saved by the DEM's files, so a DEM file that has been
+    through Fill, FlowDirection and FlowAccumulation before is reused
+    :return:
+    """
+    if use_cache:
+        filled_DEM, flow_direction, drain_area = Hydrology_Cache.hydrology_rasters(input_DEM, DEM)
+    else:
+        if DEM is None:
+            DEM = Hydrology_Cache.smooth_dem(input_DEM)
+        filled_DEM, flow_direction, drain_area = Hydrology_Cache.derive_hydrology(DEM)
 
     # save drainage area raster
     if os.path.exists(os.path.dirname(input_DEM) + "/Flow/DrainArea_sqkm.tif"):
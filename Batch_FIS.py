@@ -0,0 +1,813 @@
+# -------------------------------------------------------------------------------
+# Name:        Batch FIS
+# Purpose:     Evaluates the BRAT capacity fuzzy inference systems for whole arrays
+#              of reaches at once, using NumPy instead of one skfuzzy compute per reach
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+import os
+import sys
+import multiprocessing
+import json
+import hashlib
+import tempfile
+
+# number of reaches evaluated at once. Each chunk holds a (chunk, output universe) array while defuzzifying,
+# so this bounds the memory used by the engine (1000 x 4500 doubles is ~36 MB)
+DEFAULT_CHUNK_SIZE = 1000
+
+# number of reaches the rules are fired for at once. Firing the rules only needs a few values per reach and rule, so
+# it can work on bigger blocks than defuzzification, which spreads the cost of grouping reaches by band
+RULE_BLOCK_SIZE = 10000
+
+# rules are only fired sparsely if reaches can fire less than this share of the rules on average. Above it, the cost of
+# grouping the reaches is more than the cost of firing every rule
+SPARSE_RULE_FRACTION = 0.1
+
+# number of grid points along each input of a lookup table surface
+DEFAULT_LUT_GRID_SIZE = 401
+
+# where lookup table surfaces are saved so they only have to be computed once
+DEFAULT_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), 'BRAT_FIS_Cache')
+
+# the membership functions and rule tables of the capacity models. Copies of these files can be edited to calibrate the
+# models for a region, and given to Veg_FIS and Comb_FIS in place of the defaults
+MODEL_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FISModels')
+VEG_MODEL_FILE = os.path.join(MODEL_FOLDER, 'Veg_FIS.json')
+COMB_MODEL_FILE = os.path.join(MODEL_FOLDER, 'Comb_FIS.json')
+
+# number of hex characters kept from each reach fingerprint. 16 characters (64 bits) fit comfortably in a shapefile
+# text field and make a false match between two different sets of inputs vanishingly unlikely
+FINGERPRINT_LENGTH = 16
+
+
+class FISValidationError(Exception):
+    pass
+
+
+def check_engine(fis_engine, engines):
+    """
+    Checks the FIS engine a tool was given
+    :param fis_engine: The engine name, or None if the tool's engine parameter was cleared
+    :param engines: The engines the tool can run
+    :return: The engine name, with 'skfuzzy' for None
+    """
+    fis_engine = fis_engine or 'skfuzzy'
+    if fis_engine not in engines:
+        raise Exception("Unknown FIS engine " + str(fis_engine) + ". Use " +
+                        " or ".join(["'" + engine + "'" for engine in engines]))
+    return fis_engine
+
+
+def trimf(x, abc):
+    """
+    Triangular membership function, giving the same values as skfuzzy.trimf
+    :param x: Array of values to find the membership of
+    :param abc: The three breakpoints [a, b, c] of the triangle, with a <= b <= c
+    :return: Array of membership values, the same shape as x
+    """
+    a, b, c = [float(p) for p in abc]
+    x = np.asarray(x, np.float64)
+    y = np.zeros(x.shape)
+    if a != b:
+        rising = (a < x) & (x < b)
+        y[rising] = (x[rising] - a) / (b - a)
+    if b != c:
+        falling = (b < x) & (x < c)
+        y[falling] = (c - x[falling]) / (c - b)
+    y[x == b] = 1.0
+    return y
+
+
+def trapmf(x, abcd):
+    """
+    Trapezoidal membership function, giving the same values as skfuzzy.trapmf
+    :param x: Array of values to find the membership of
+    :param abcd: The four breakpoints [a, b, c, d] of the trapezoid, with a <= b <= c <= d
+    :return: Array of membership values, the same shape as x
+    """
+    a, b, c, d = [float(p) for p in abcd]
+    x = np.asarray(x, np.float64)
+    y = np.ones(x.shape)
+    left = x <= b
+    y[left] = trimf(x[left], [a, b, b])
+    right = x >= c
+    y[right] = trimf(x[right], [c, c, d])
+    y[(x < a) | (x > d)] = 0.0
+    return y
+
+
+MEMBERSHIP_FUNCTIONS = {'trimf': trimf, 'trapmf': trapmf}
+
+
+def trapezoid_breakpoints(mf_type, params):
+    """
+    Writes a trimf or trapmf as the four breakpoints of a trapezoid, so both can be handled the same way
+    :param mf_type: 'trimf' or 'trapmf'
+    :param params: The breakpoints given to the membership function
+    :return: List of [a, b, c, d]
+    """
+    if mf_type == 'trimf':
+        return [float(params[0]), float(params[1]), float(params[1]), float(params[2])]
+    return [float(p) for p in params]
+
+
+def trapezoid(x, abcd):
+    """
+    Evaluates a trapezoid from its breakpoints with no sampling. Agrees with trimf and trapmf, including vertical sides
+    :param x: Array of values to find the membership of
+    :param abcd: The four breakpoints [a, b, c, d]
+    :return: Array of membership values, the same shape as x
+    """
+    a, b, c, d = abcd
+    x = np.asarray(x, np.float64)
+    y = np.ones(x.shape)
+    if b > a:
+        y = np.fmin(y, (x - a) / (b - a))
+    else:
+        y[x < a] = 0.0
+    if d > c:
+        y = np.fmin(y, (d - x) / (d - c))
+    else:
+        y[x > d] = 0.0
+    return np.clip(y, 0.0, 1.0)
+
+
+def universe_bounds(universe_range):
+    """
+    Finds the first and last points of np.arange(*universe_range) without making the array. skfuzzy clips inputs to
+    these, so an input at the stop value of the range is treated as if it were at the last point
+    :param universe_range: (start, stop, step) of the universe
+    :return: Tuple of (first point, last point)
+    """
+    start, stop, step = [float(value) for value in universe_range]
+    num_points = int(np.ceil((stop - start) / step))
+    return start, start + (num_points - 1) * step
+
+
+def piecewise_linear_centroid(x, y):
+    """
+    Finds the centroid of the area under a piecewise linear function, integrating each segment exactly. This is the
+    same calculation skfuzzy's centroid defuzzification does
+    :param x: The x values of the vertices, either one array shared by every row of y, or one row per row of y
+    :param y: Array of (reaches, vertices) membership values
+    :return: Array with the centroid of each row, or 0 where the area is 0
+    """
+    x1 = x[..., :-1]
+    dx = np.diff(x, axis=-1)
+    y1 = y[:, :-1]
+    y2 = y[:, 1:]
+    area = (0.5 * dx * (y1 + y2)).sum(axis=1)
+    moment = (dx * (x1 * 0.5 * (y1 + y2) + dx * (y1 + 2.0 * y2) / 6.0)).sum(axis=1)
+
+    # every reach fires at least one rule in the BRAT models, but don't divide by zero if one doesn't
+    return np.where(area > 0, moment / np.fmax(area, np.finfo(float).eps), 0.0)
+
+
+class FISModel(object):
+    """
+    A Mamdani FIS (min for AND, max for aggregation, centroid defuzzification) compiled into arrays, so that
+    every rule can be evaluated for a whole array of reaches with NumPy broadcasting
+    """
+
+    # arrays that compiled_arrays() saves, and that can be given back to the constructor instead of compiling again
+    COMPILED_ARRAYS = ['output_mfs', 'output_shapes', 'output_edge_starts', 'output_edge_widths', 'output_fixed_points',
+                       'rule_terms', 'rule_negated', 'rule_consequents']
+
+    def __init__(self, definition, compiled=None):
+        """
+        Compiles a model definition like VEG_MODEL
+        :param definition: Dictionary with 'inputs', 'output' and 'rules'. Inputs and output are tuples of
+        (name, (start, stop, step) of the universe, list of (term, mf type, breakpoints)). Each rule is a tuple with
+        one term per input (None if the input isn't used, '~' in front to negate it) followed by the output term
+        :param compiled: The output of compiled_arrays() for this definition, to skip compiling it again
+        """
+        self.definition = definition
+        self.input_names = []
+        self.input_ranges = []
+        self.input_bounds = []
+        self.input_shapes = []
+        self.input_terms = []
+        for name, universe_range, terms in definition['inputs']:
+            self.input_names.append(name)
+            self.input_ranges.append((float(universe_range[0]), float(universe_range[1])))
+            self.input_bounds.append(universe_bounds(universe_range))
+            self.input_shapes.append(np.array([trapezoid_breakpoints(mf_type, params)
+                                               for term, mf_type, params in terms]))
+            self.input_terms.append([term[0] for term in terms])
+
+        # the sampled input membership functions are only built if fuzzify_sampled is used
+        self.input_universes = None
+        self.input_mfs = None
+        self.output_name, output_range, output_terms = definition['output']
+        self.output_universe = np.arange(*output_range)
+        self.output_terms = [term[0] for term in output_terms]
+
+        if compiled is not None:
+            for array_name in self.COMPILED_ARRAYS:
+                setattr(self, array_name, compiled[array_name])
+            return
+
+        self.output_mfs = np.array([MEMBERSHIP_FUNCTIONS[mf_type](self.output_universe, params)
+                                    for term, mf_type, params in output_terms])
+        self.output_shapes = np.array([trapezoid_breakpoints(mf_type, params) for term, mf_type, params in output_terms])
+        self.compile_output_edges()
+
+        # rule_terms[r, i] holds the index of the term rule r uses for input i, or -1 if rule r ignores input i
+        num_rules = len(definition['rules'])
+        self.rule_terms = np.full((num_rules, len(self.input_names)), -1, dtype=np.int64)
+        self.rule_negated = np.zeros((num_rules, len(self.input_names)), dtype=bool)
+        self.rule_consequents = np.zeros(num_rules, dtype=np.int64)
+        for r, rule in enumerate(definition['rules']):
+            for i, term in enumerate(rule[:-1]):
+                if term is None:
+                    continue
+                if term.startswith('~'):
+                    self.rule_negated[r, i] = True
+                    term = term[1:]
+                self.rule_terms[r, i] = self.input_terms[i].index(term)
+            self.rule_consequents[r] = self.output_terms.index(rule[-1])
+
+    def compiled_arrays(self):
+        """
+        Collects the arrays built from the definition, so they can be saved and passed back to the constructor
+        :return: Dictionary of array name to array
+        """
+        return dict((array_name, getattr(self, array_name)) for array_name in self.COMPILED_ARRAYS)
+
+    def compile_output_edges(self):
+        """
+        Precomputes what the analytic defuzzifier needs. The union of the clipped output terms is piecewise linear,
+        and can only bend at a term's breakpoints, where two sloped edges cross, or where an edge crosses the level a
+        term is clipped at. The first two don't depend on the reach, so they're found once here
+        """
+        # each sloped edge is stored as the x where it has membership 0 and the change in x up to membership 1
+        edge_starts = []
+        edge_widths = []
+        for a, b, c, d in self.output_shapes:
+            if b > a:
+                edge_starts.append(a)
+                edge_widths.append(b - a)
+            if d > c:
+                edge_starts.append(d)
+                edge_widths.append(c - d)
+        self.output_edge_starts = np.array(edge_starts)
+        self.output_edge_widths = np.array(edge_widths)
+
+        low, high = self.output_universe[0], self.output_universe[-1]
+        fixed_points = [low, high] + list(self.output_shapes.ravel())
+        for i in range(len(edge_starts)):
+            for j in range(i + 1, len(edge_starts)):
+                # membership along edge i is (x - start_i) / width_i, so the edges meet where those are equal
+                slope_difference = 1.0 / edge_widths[i] - 1.0 / edge_widths[j]
+                if slope_difference != 0:
+                    fixed_points.append((edge_starts[i] / edge_widths[i] - edge_starts[j] / edge_widths[j]) /
+                                        slope_difference)
+        fixed_points = np.clip(np.array(fixed_points), low, high)
+        self.output_fixed_points = np.unique(fixed_points)
+
+    def model_hash(self):
+        """
+        Identifies the membership functions and rules of the model, so that anything derived from it can be cached
+        :return: Hex digest string
+        """
+        return definition_hash(self.definition)
+
+    def fuzzify(self, inputs):
+        """
+        Finds the membership of every input value in every term, straight from the breakpoints of each term. Like
+        skfuzzy, values are first clipped to the first and last points of each universe
+        :param inputs: List of arrays, one per model input
+        :return: List of (reaches, terms) arrays, one per model input
+        """
+        memberships = []
+        for shapes, (low, high), values in zip(self.input_shapes, self.input_bounds, inputs):
+            values = np.clip(values, low, high)
+            memberships.append(np.column_stack([trapezoid(values, shape) for shape in shapes]))
+        return memberships
+
+    def fuzzify_sampled(self, inputs):
+        """
+        Finds memberships the way skfuzzy does, by interpolating membership functions sampled over each universe.
+        Only used to check fuzzify against
+        :param inputs: List of arrays, one per model input
+        :return: List of (reaches, terms) arrays, one per model input
+        """
+        if self.input_mfs is None:
+            self.input_universes = [np.arange(*universe_range) for name, universe_range, terms in
+                                    self.definition['inputs']]
+            self.input_mfs = [np.array([MEMBERSHIP_FUNCTIONS[mf_type](universe, params)
+                                        for term, mf_type, params in variable[2]])
+                              for universe, variable in zip(self.input_universes, self.definition['inputs'])]
+        memberships = []
+        for universe, mfs, values in zip(self.input_universes, self.input_mfs, inputs):
+            memberships.append(np.column_stack([np.interp(values, universe, mf) for mf in mfs]))
+        return memberships
+
+    def validate_membership(self, inputs, sample_size=None, zero_term=None):
+        """
+        Measures how far the breakpoint memberships of fuzzify are from the sampled memberships of fuzzify_sampled on
+        a set of reaches, both for the memberships themselves and for the crisp output
+        :param inputs: List of arrays, one per model input
+        :param sample_size: How many reaches to check, chosen evenly through the arrays. If None, checks every reach
+        :param zero_term: Passed on to evaluate
+        :return: Dictionary with the number of reaches checked, the max membership deviation of each input, and the
+        max output deviation
+        """
+        indices = sample_indices(len(inputs[0]), sample_size)
+        sample = [np.asarray(values, np.float64)[indices] for values in inputs]
+        membership_deviations = {}
+        for name, analytic, sampled in zip(self.input_names, self.fuzzify(sample), self.fuzzify_sampled(sample)):
+            membership_deviations[name] = float(np.abs(analytic - sampled).max()) if len(indices) > 0 else 0.0
+        analytic_out = self.evaluate(sample, zero_term=zero_term)
+        sampled_out = self.evaluate(sample, zero_term=zero_term, membership='sampled')
+        return {'checked': len(indices),
+                'max_membership_deviation': membership_deviations,
+                'max_output_deviation': float(np.abs(analytic_out - sampled_out).max()) if len(indices) > 0 else 0.0}
+
+    def fire_rules(self, memberships):
+        """
+        Finds the activation of every rule, with AND as the minimum of the antecedents
+        :param memberships: Output of fuzzify
+        :return: Array of (reaches, rules) activations
+        """
+        num_reaches = memberships[0].shape[0]
+        activations = np.ones((num_reaches, len(self.rule_consequents)))
+        for i, membership in enumerate(memberships):
+            used = self.rule_terms[:, i] >= 0
+            antecedent = membership[:, self.rule_terms[used, i]]
+            antecedent = np.where(self.rule_negated[used, i], 1.0 - antecedent, antecedent)
+            activations[:, used] = np.fmin(activations[:, used], antecedent)
+        return activations
+
+    def band_keys(self, memberships):
+        """
+        Describes which band of each input a reach falls in, as a bit for every term that has non-zero membership and
+        a bit for every term that has membership below 1 (where its negation is non-zero). Reaches with the same key
+        can fire the same rules
+        :param memberships: Output of fuzzify
+        :return: Array with an integer key for each reach, or None if there are too many terms to fit the bits in one
+        """
+        num_bits = 2 * sum(membership.shape[1] for membership in memberships)
+        if num_bits > 62:
+            return None
+        keys = np.zeros(memberships[0].shape[0], dtype=np.int64)
+        shift = 0
+        for membership in memberships:
+            weights = np.left_shift(np.ones(membership.shape[1], dtype=np.int64), np.arange(membership.shape[1]))
+            keys += np.left_shift(np.dot(membership > 0, weights), shift)
+            keys += np.left_shift(np.dot(membership < 1, weights), shift + membership.shape[1])
+            shift += 2 * membership.shape[1]
+        return keys
+
+    def find_strengths_sparse(self, memberships):
+        """
+        Fires and aggregates only the rules that can fire for each reach. A rule can only fire if every term it uses
+        is non-zero, and most reaches sit in a band of each input where only one or two terms are, so most rules can
+        be skipped. Reaches are grouped by band_keys, and each group only evaluates the rules its bands can fire
+        :param memberships: Output of fuzzify
+        :return: Array of (reaches, output terms) activations, or None if band_keys can't describe the model or the
+        reaches can fire too many of the rules for skipping the rest to be worth it
+        """
+        keys = self.band_keys(memberships)
+        if keys is None:
+            return None
+        num_reaches = len(keys)
+        num_rules = len(self.rule_consequents)
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+        # every reach in a group has the same non-zero terms, so the first reach of each group stands for the group
+        fireable = np.ones((len(unique_keys), num_rules), dtype=bool)
+        for i, membership in enumerate(memberships):
+            used = self.rule_terms[:, i] >= 0
+            antecedent = membership[first][:, self.rule_terms[used, i]]
+            fireable[:, used] &= np.where(self.rule_negated[used, i], antecedent < 1, antecedent > 0)
+        group_sizes = np.bincount(inverse.ravel())
+        if np.dot(group_sizes, fireable.sum(axis=1)) >= SPARSE_RULE_FRACTION * num_reaches * num_rules:
+            return None
+
+        # lay the memberships of every input side by side as [terms, negated terms, 1], so each antecedent of each rule
+        # is a single column (1 where the rule ignores the input), and sort the reaches so each group is a block of rows
+        blocks = []
+        rule_columns = []
+        offset = 0
+        for i, membership in enumerate(memberships):
+            num_terms = membership.shape[1]
+            blocks += [membership, 1.0 - membership, np.ones((num_reaches, 1))]
+            rule_columns.append(offset + np.where(self.rule_terms[:, i] < 0, 2 * num_terms,
+                                                  self.rule_terms[:, i] + num_terms * self.rule_negated[:, i]))
+            offset += 2 * num_terms + 1
+        rule_columns = np.column_stack(rule_columns)
+        order = np.argsort(inverse.ravel(), kind='mergesort')
+        extended = np.hstack(blocks)[order]
+        bounds = np.append(0, np.cumsum(group_sizes))
+
+        # rules are taken in order of their output term, so each term's rules are next to each other for reduceat
+        rule_order = np.argsort(self.rule_consequents, kind='mergesort')
+        sorted_strengths = np.zeros((num_reaches, len(self.output_terms)))
+        for g in range(len(unique_keys)):
+            rules = rule_order[fireable[g, rule_order]]
+            if len(rules) == 0:
+                continue
+            rows = slice(bounds[g], bounds[g + 1])
+            antecedents = extended[rows, rule_columns[rules].ravel()].reshape(-1, len(rules), len(memberships))
+            activations = np.fmin.reduce(antecedents, axis=2)
+            terms, starts = np.unique(self.rule_consequents[rules], return_index=True)
+            sorted_strengths[rows, terms] = np.maximum.reduceat(activations, starts, axis=1)
+
+        strengths = np.zeros(sorted_strengths.shape)
+        strengths[order] = sorted_strengths
+        return strengths
+
+    def find_strengths(self, inputs, sparse=True, chunk_size=DEFAULT_CHUNK_SIZE, membership='analytic'):
+        """
+        Runs the inputs through fuzzification, the rules and aggregation
+        :param inputs: List of arrays, one per model input
+        :param sparse: If True, only evaluates the rules each reach can fire (see find_strengths_sparse)
+        :param chunk_size: How many reaches to fire all the rules for at a time, if they aren't fired sparsely
+        :param membership: 'analytic' to use fuzzify, or 'sampled' to use fuzzify_sampled
+        :return: Array of (reaches, output terms) activations
+        """
+        if membership == 'sampled':
+            memberships = self.fuzzify_sampled(inputs)
+        else:
+            memberships = self.fuzzify(inputs)
+        if sparse:
+            strengths = self.find_strengths_sparse(memberships)
+            if strengths is not None:
+                return strengths
+
+        # firing every rule makes a (reaches, rules) array, which is fastest in chunks that stay in the cpu cache
+        strengths = np.zeros((len(memberships[0]), len(self.output_terms)))
+        for start in range(0, len(strengths), chunk_size):
+            activations = self.fire_rules([membership[start:start + chunk_size] for membership in memberships])
+            strengths[start:start + chunk_size] = self.aggregate(activations)
+        return strengths
+
+    def aggregate(self, activations):
+        """
+        Finds how strongly each output term is activated, as the maximum of the rules that imply it
+        :param activations: Output of fire_rules
+        :return: Array of (reaches, output terms) activations
+        """
+        strengths = np.zeros((activations.shape[0], len(self.output_terms)))
+        for t in range(len(self.output_terms)):
+            implies_term = self.rule_consequents == t
+            if implies_term.any():
+                strengths[:, t] = activations[:, implies_term].max(axis=1)
+        return strengths
+
+    def defuzzify_sampled(self, strengths):
+        """
+        Clips each output term at its activation, takes the union of the clipped terms and finds its centroid over
+        the sampled output universe
+        :param strengths: Output of aggregate
+        :return: Array with the crisp output for each reach
+        """
+        combined = np.zeros((strengths.shape[0], len(self.output_universe)))
+        for t in range(len(self.output_terms)):
+            np.fmax(combined, np.fmin(self.output_mfs[t], strengths[:, t:t + 1]), out=combined)
+        return piecewise_linear_centroid(self.output_universe, combined)
+
+    def defuzzify_analytic(self, strengths):
+        """
+        Finds the exact centroid of the union of the clipped output terms. The union is only evaluated at the points
+        where it can bend (see compile_output_edges), which is about a hundred points per reach instead of the whole
+        output universe
+        :param strengths: Output of aggregate
+        :return: Array with the crisp output for each reach
+        """
+        num_reaches = strengths.shape[0]
+        low, high = self.output_universe[0], self.output_universe[-1]
+        crossings = (self.output_edge_starts[np.newaxis, np.newaxis, :] +
+                     strengths[:, :, np.newaxis] * self.output_edge_widths[np.newaxis, np.newaxis, :])
+        points = np.concatenate([np.tile(self.output_fixed_points, (num_reaches, 1)),
+                                 np.clip(crossings.reshape(num_reaches, -1), low, high)], axis=1)
+        points.sort(axis=1)
+
+        combined = np.zeros(points.shape)
+        for t in range(len(self.output_terms)):
+            np.fmax(combined, np.fmin(trapezoid(points, self.output_shapes[t]), strengths[:, t:t + 1]), out=combined)
+        return piecewise_linear_centroid(points, combined)
+
+    def evaluate(self, inputs, chunk_size=DEFAULT_CHUNK_SIZE, method='analytic', zero_term=None, sparse=True,
+                 membership='analytic'):
+        """
+        Runs the FIS on every reach
+        :param inputs: List of arrays, one per model input, in the order of the model definition
+        :param chunk_size: How many reaches to evaluate at a time
+        :param method: 'analytic' for the exact centroid, or 'sampled' to integrate over the sampled output universe
+        :param zero_term: If given, reaches where this is the only output term that fires get an output of 0
+        :param sparse: If True, only the rules each reach can fire are evaluated. The output is the same either way
+        :param membership: 'analytic' to find input memberships from the breakpoints, or 'sampled' to interpolate them
+        from the sampled universes like skfuzzy
+        :return: Array with the crisp output for each reach
+        """
+        if method == 'sampled':
+            defuzzify = self.defuzzify_sampled
+        else:
+            defuzzify = self.defuzzify_analytic
+        inputs = [np.asarray(values, np.float64) for values in inputs]
+        num_reaches = len(inputs[0])
+        block_size = max(chunk_size, RULE_BLOCK_SIZE)
+        out = np.zeros(num_reaches)
+        for block_start in range(0, num_reaches, block_size):
+            block_strengths = self.find_strengths([values[block_start:block_start + block_size] for values in inputs],
+                                                  sparse, chunk_size, membership)
+            for start in range(0, len(block_strengths), chunk_size):
+                strengths = block_strengths[start:start + chunk_size]
+                chunk_out = defuzzify(strengths)
+                if zero_term is not None:
+                    others = np.arange(len(self.output_terms)) != self.output_terms.index(zero_term)
+                    chunk_out[strengths[:, others].max(axis=1) == 0] = 0.0
+                out[block_start + start:block_start + start + chunk_size] = chunk_out
+        return out
+
+
+def read_definition(model_file):
+    """
+    Reads a model file into the definition FISModel and build_simulation take
+    :param model_file: Path to a JSON model file, like FISModels/Veg_FIS.json
+    :return: Dictionary with 'inputs', 'output' and 'rules'
+    """
+    with open(model_file) as f:
+        contents = json.load(f)
+
+    def read_variable(variable):
+        return (str(variable['name']), tuple(variable['universe']),
+                [(str(term), str(mf_type), params) for term, mf_type, params in variable['terms']])
+
+    return {'inputs': [read_variable(variable) for variable in contents['inputs']],
+            'output': read_variable(contents['output']),
+            'rules': [tuple(None if term is None else str(term) for term in rule) for rule in contents['rules']]}
+
+
+VEG_MODEL = read_definition(VEG_MODEL_FILE)
+COMB_MODEL = read_definition(COMB_MODEL_FILE)
+
+
+def load_model(model_file, cache_folder=DEFAULT_CACHE_FOLDER):
+    """
+    Reads and compiles a model file. The compiled arrays are saved under the hash of the file, so each version of a
+    model file is only compiled once
+    :param model_file: Path to a JSON model file
+    :param cache_folder: Where to look for and save compiled models. If None, the model isn't cached
+    :return: FISModel
+    """
+    with open(model_file, 'rb') as f:
+        file_hash = hashlib.sha1(f.read()).hexdigest()
+    definition = read_definition(model_file)
+    if cache_folder is None:
+        return FISModel(definition)
+
+    cache_file = os.path.join(cache_folder, "FIS_Model_" + file_hash + ".npz")
+    if os.path.exists(cache_file):
+        return FISModel(definition, np.load(cache_file))
+
+    model = FISModel(definition)
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    np.savez(cache_file, **model.compiled_arrays())
+    return model
+
+
+def definition_hash(definition):
+    """
+    Identifies the membership functions and rules of a model definition
+    :param definition: Dictionary from read_definition
+    :return: Hex digest string
+    """
+    return hashlib.sha1(json.dumps(definition, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def reach_fingerprints(columns, model_key):
+    """
+    Hashes the FIS inputs of each reach together with a key for the model, so a rerun can skip the reaches where
+    neither has changed
+    :param columns: List of input arrays, with one value per reach
+    :param model_key: String identifying the model and any setting that changes its output
+    :return: Array of hex strings, one per reach
+    """
+    rows = np.ascontiguousarray(np.column_stack(columns).astype(np.float64))
+    key = model_key.encode('utf-8')
+    return np.array([hashlib.sha1(key + row.tobytes()).hexdigest()[:FINGERPRINT_LENGTH] for row in rows])
+
+
+class FISLookupTable(object):
+    """
+    The output of a two input FIS precomputed on a regular grid, so that reaches can be evaluated with bilinear
+    interpolation instead of running the rules
+    """
+
+    def __init__(self, model, grid_size=DEFAULT_LUT_GRID_SIZE, cache_folder=DEFAULT_CACHE_FOLDER, zero_term=None):
+        """
+        Loads the surface from the cache, or computes it and saves it there
+        :param model: The FISModel to tabulate. Must have exactly two inputs
+        :param grid_size: The number of grid points along each input
+        :param cache_folder: Where to look for and save surfaces. If None, the surface isn't cached
+        :param zero_term: Passed on to FISModel.evaluate when computing the surface
+        """
+        if len(model.input_names) != 2:
+            raise Exception("Lookup tables can only be built for FIS models with two inputs")
+        self.model = model
+        self.grid_size = int(grid_size)
+        self.zero_term = zero_term
+        self.axes = [np.linspace(low, high, self.grid_size) for low, high in model.input_ranges]
+
+        cache_file = None
+        if cache_folder is not None:
+            cache_name = "FIS_LUT_" + model.model_hash() + "_" + str(self.grid_size)
+            if zero_term is not None:
+                cache_name += "_" + zero_term
+            cache_file = os.path.join(cache_folder, cache_name + ".npy")
+        if cache_file is not None and os.path.exists(cache_file):
+            self.surface = np.load(cache_file)
+        else:
+            grid_x, grid_y = np.meshgrid(self.axes[0], self.axes[1], indexing='ij')
+            self.surface = model.evaluate([grid_x.ravel(), grid_y.ravel()], zero_term=zero_term).reshape(grid_x.shape)
+            if cache_file is not None:
+                if not os.path.exists(cache_folder):
+                    os.makedirs(cache_folder)
+                np.save(cache_file, self.surface)
+
+    def evaluate(self, inputs):
+        """
+        Finds the output for every reach by bilinear interpolation of the surface
+        :param inputs: List of the two input arrays. Values outside the grid are clipped to its edges
+        :return: Array with the output for each reach
+        """
+        cells = []
+        fractions = []
+        for axis, values in zip(self.axes, inputs):
+            values = np.clip(np.asarray(values, np.float64), axis[0], axis[-1])
+            position = (values - axis[0]) / (axis[-1] - axis[0]) * (self.grid_size - 1)
+            cell = np.clip(np.floor(position).astype(np.int64), 0, self.grid_size - 2)
+            cells.append(cell)
+            fractions.append(position - cell)
+        i, j = cells
+        fx, fy = fractions
+        return ((1 - fx) * (1 - fy) * self.surface[i, j] + fx * (1 - fy) * self.surface[i + 1, j] +
+                (1 - fx) * fy * self.surface[i, j + 1] + fx * fy * self.surface[i + 1, j + 1])
+
+    def error_report(self, inputs, lut_out, sample_size=None):
+        """
+        Compares lookup table output against exact evaluation of the model
+        :param inputs: The arrays that were passed to evaluate()
+        :param lut_out: The output of evaluate()
+        :param sample_size: How many reaches to check, chosen evenly through the arrays. If None, checks every reach
+        :return: Dictionary with the number of reaches checked and the max and mean absolute error
+        """
+        indices = sample_indices(len(lut_out), sample_size)
+        exact = self.model.evaluate([np.asarray(values, np.float64)[indices] for values in inputs],
+                                    zero_term=self.zero_term)
+        errors = np.abs(exact - lut_out[indices])
+        return {'checked': len(indices),
+                'max_error': float(errors.max()) if len(errors) > 0 else 0.0,
+                'mean_error': float(errors.mean()) if len(errors) > 0 else 0.0}
+
+
+def sample_indices(num_reaches, sample_size):
+    """
+    Picks reaches spread evenly through the arrays for spot checks
+    :param num_reaches: How many reaches there are
+    :param sample_size: How many to pick. If None, picks every reach
+    :return: Array of indices
+    """
+    if sample_size is None or sample_size >= num_reaches:
+        return np.arange(num_reaches)
+    return np.unique(np.linspace(0, num_reaches - 1, sample_size).astype(np.int64))
+
+
+def compare_with_simulation(model, simulation, inputs, batch_out, tolerance=None, sample_size=None):
+    """
+    Checks batch output against a skfuzzy ControlSystemSimulation built from the same rules
+    :param model: The FISModel that made batch_out
+    :param simulation: The skfuzzy ControlSystemSimulation to compare against
+    :param inputs: The arrays that were passed to model.evaluate()
+    :param batch_out: The output of model.evaluate()
+    :param tolerance: The largest absolute difference allowed. If None, the difference is only reported
+    :param sample_size: How many reaches to check, chosen evenly through the arrays. If None, checks every reach
+    :return: The largest absolute difference found
+    """
+    max_difference = 0.0
+    for i in sample_indices(len(batch_out), sample_size):
+        for name, values in zip(model.input_names, inputs):
+            simulation.input[name] = values[i]
+        simulation.compute()
+        max_difference = max(max_difference, abs(simulation.output[model.output_name] - batch_out[i]))
+
+    if tolerance is not None and max_difference > tolerance:
+        raise FISValidationError("Batch FIS output differs from skfuzzy by up to " + str(max_difference) +
+                                 ", which is more than the tolerance of " + str(tolerance))
+    return max_difference
+
+
+def build_simulation(definition):
+    """
+    Builds the skfuzzy ControlSystemSimulation for a model definition
+    :param definition: Dictionary like VEG_MODEL
+    :return: skfuzzy ControlSystemSimulation
+    """
+    import skfuzzy as fuzz
+    from skfuzzy import control as ctrl
+
+    antecedents = []
+    for name, universe_range, terms in definition['inputs']:
+        antecedent = ctrl.Antecedent(np.arange(*universe_range), name)
+        for term, mf_type, params in terms:
+            antecedent[term] = getattr(fuzz, mf_type)(antecedent.universe, params)
+        antecedents.append(antecedent)
+
+    name, universe_range, terms = definition['output']
+    consequent = ctrl.Consequent(np.arange(*universe_range), name)
+    for term, mf_type, params in terms:
+        consequent[term] = getattr(fuzz, mf_type)(consequent.universe, params)
+
+    rules = []
+    for rule in definition['rules']:
+        antecedent_terms = []
+        for antecedent, term in zip(antecedents, rule[:-1]):
+            if term is None:
+                continue
+            if term.startswith('~'):
+                antecedent_terms.append(~antecedent[term[1:]])
+            else:
+                antecedent_terms.append(antecedent[term])
+        combined = antecedent_terms[0]
+        for antecedent_term in antecedent_terms[1:]:
+            combined = combined & antecedent_term
+        rules.append(ctrl.Rule(combined, consequent[rule[-1]]))
+
+    return ctrl.ControlSystemSimulation(ctrl.ControlSystem(rules))
+
+
+# set in each worker process by init_worker, so the model is built once per worker instead of being sent with every chunk
+worker_model = None
+worker_simulation = None
+
+
+def init_worker(definition, engine):
+    """
+    Builds the model a worker process will use for every chunk it evaluates
+    :param definition: Dictionary like VEG_MODEL
+    :param engine: 'batch' or 'skfuzzy'
+    :return: None
+    """
+    global worker_model, worker_simulation
+    worker_model = FISModel(definition)
+    if engine == 'skfuzzy':
+        worker_simulation = build_simulation(definition)
+
+
+def evaluate_worker_chunk(task):
+    """
+    Evaluates one chunk of reaches in a worker process
+    :param task: Tuple of (start index, list of input arrays, zero_term)
+    :return: Tuple of (start index, output array)
+    """
+    start, chunk, zero_term = task
+    if worker_simulation is None:
+        return start, worker_model.evaluate(chunk, zero_term=zero_term)
+
+    out = np.zeros(len(chunk[0]))
+    for i in range(len(out)):
+        for name, values in zip(worker_model.input_names, chunk):
+            worker_simulation.input[name] = values[i]
+        worker_simulation.compute()
+        out[i] = worker_simulation.output[worker_model.output_name]
+    return start, out
+
+
+def evaluate_in_pool(definition, inputs, workers, engine='batch', zero_term=None, chunks_per_worker=4):
+    """
+    Splits the reaches into chunks and evaluates them in a multiprocessing pool. Every reach is evaluated the same way
+    it would be in one process, so the output is identical to a serial run
+    :param definition: Dictionary like VEG_MODEL
+    :param inputs: List of arrays, one per model input, in the order of the model definition
+    :param workers: How many processes to use
+    :param engine: 'batch' to use FISModel.evaluate, or 'skfuzzy' to run a ControlSystemSimulation on each reach
+    :param zero_term: Passed on to FISModel.evaluate
+    :param chunks_per_worker: How many chunks to give each worker, so a slow chunk doesn't hold up the rest
+    :return: Array with the crisp output for each reach, in the same order as the inputs
+    """
+    inputs = [np.asarray(values, np.float64) for values in inputs]
+    num_reaches = len(inputs[0])
+    chunk_size = max(1, int(np.ceil(num_reaches / float(workers * chunks_per_worker))))
+    tasks = [(start, [values[start:start + chunk_size] for values in inputs], zero_term)
+             for start in range(0, num_reaches, chunk_size)]
+
+    # inside ArcGIS, sys.executable is the ArcGIS application, which can't be used to start workers
+    if os.name == 'nt' and not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+
+    out = np.zeros(num_reaches)
+    pool = multiprocessing.Pool(int(workers), init_worker, (definition, engine))
+    try:
+        for start, chunk_out in pool.imap_unordered(evaluate_worker_chunk, tasks):
+            out[start:start + len(chunk_out)] = chunk_out
+    finally:
+        pool.close()
+        pool.join()
+    return out
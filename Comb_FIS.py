@@ -11,22 +11,39 @@
 
 import arcpy
 import skfuzzy as fuzz
-from skfuzzy import control as ctrl
 import numpy as np
 import os
 import sys
-from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, getUUID, find_relative_path, write_xml_element_with_path
+from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, getUUID, find_relative_path, write_xml_element_with_path, write_arrays_to_fields
 import XMLBuilder
 reload(XMLBuilder)
 XMLBuilder = XMLBuilder.XMLBuilder
+import Batch_FIS
+reload(Batch_FIS)
 
 def main(
     projPath,
     in_network,
     max_DA_thresh,
-    out_name):
-
-    scratch = 'in_memory'
+    out_name,
+    fis_engine='skfuzzy',
+    tolerance=None,
+    workers=None,
+    model_file=None,
+    incremental=False,
+    validate_membership=False):
+
+    # the tool passes None if the engine parameter is cleared
+    fis_engine = Batch_FIS.check_engine(fis_engine, ['skfuzzy', 'batch'])
+    if fis_engine == 'skfuzzy' and tolerance is not None:
+        arcpy.AddWarning("The skfuzzy engine is the reference the other engines are checked against, so the " +
+                         "tolerance is ignored")
+
+    # use the default membership functions and rules unless the user gave a calibrated copy
+    if model_file is None:
+        model_file = Batch_FIS.COMB_MODEL_FILE
+    incremental = incremental not in [None, False, 'false']
+    validate_membership = validate_membership not in [None, False, 'false']
 
     output_folder = os.path.dirname(os.path.dirname(in_network))
     analyses_folder = make_folder(output_folder, "02_Analyses")
@@ -35,51 +52,91 @@ def main(
     else:
         out_network = os.path.join(analyses_folder, out_name + ".shp")
 
+    # keep the outputs of the last run so an incremental run can reuse them for reaches that haven't changed
+    previous_outputs = None
     if os.path.exists(out_network):
+        if incremental:
+            previous_outputs = read_previous_outputs(out_network)
         arcpy.Delete_management(out_network)
     arcpy.CopyFeatures_management(in_network, out_network)
 
-    # run the combined fis function for both potential and existing
-    combFIS(out_network, 'pt', scratch, max_DA_thresh)
-    combFIS(out_network, 'ex', scratch, max_DA_thresh)
+    # run the combined fis for both potential and existing in one pass
+    combFIS(out_network, max_DA_thresh, fis_engine, tolerance, workers, model_file, previous_outputs,
+            validate_membership, incremental)
 
     make_layers(out_network)
 
     add_xml_output(in_network, out_network)
 
+def read_previous_outputs(out_network):
+    """
+    Reads the combined capacity and input fingerprint of each reach from the output of an earlier run
+    :param out_network: The output network of the earlier run
+    :return: Structured array with ReachID, oCC_PT, oCC_EX and oCC_Hash, or None if the network doesn't have them
+    """
+    previous_fields = ["ReachID", "oCC_PT", "oCC_EX", "oCC_Hash"]
+    fields = [f.name for f in arcpy.ListFields(out_network)]
+    if not all(field in fields for field in previous_fields):
+        return None
+    return arcpy.da.FeatureClassToNumPyArray(out_network, previous_fields)
+
+
 # combined fis function
-def combFIS(in_network, model_run, scratch, max_DA_thresh):
+def combFIS(in_network, max_DA_thresh, fis_engine='skfuzzy', tolerance=None, workers=None,
+            model_file=Batch_FIS.COMB_MODEL_FILE, previous_outputs=None, validate_membership=False, incremental=False):
     arcpy.env.overwriteOutput = True
 
-    # get list of all fields in the flowline network
-    fields = [f.name for f in arcpy.ListFields(in_network)]
-
-    # set the carrying capacity and vegetation field depending on whether potential or existing run
-    if model_run == 'pt':
-        out_field = "oCC_PT"
-        veg_field = "oVC_PT"
-        mcc_field = "mCC_PT_CT"
-    else:
-        out_field = "oCC_EX"
-        veg_field = "oVC_EX"
-        mcc_field = "mCC_EX_CT"
-
-    # check for oCC_* field in the network attribute table and delete if exists
-    if out_field in fields:
-        arcpy.DeleteField_management(in_network, out_field)
-
-    # get arrays for fields of interest
-    segid_np = arcpy.da.FeatureClassToNumPyArray(in_network, "ReachID")
-    ovc_np = arcpy.da.FeatureClassToNumPyArray(in_network, veg_field)
-    ihydsp2_np = arcpy.da.FeatureClassToNumPyArray(in_network, "iHyd_SP2")
-    ihydsplow_np = arcpy.da.FeatureClassToNumPyArray(in_network, "iHyd_SPLow")
-    igeoslope_np = arcpy.da.FeatureClassToNumPyArray(in_network, "iGeo_Slope")
-
-    segid_array = np.asarray(segid_np, np.int64)
-    ovc_array = np.asarray(ovc_np, np.float64)
-    ihydsp2_array = np.asarray(ihydsp2_np, np.float64)
-    ihydsplow_array = np.asarray(ihydsplow_np, np.float64)
-    igeoslope_array = np.asarray(igeoslope_np, np.float64)
+    # the potential run uses the potential vegetation capacity and the existing run uses the existing capacity
+    veg_fields = ["oVC_PT", "oVC_EX"]
+    out_fields = ["oCC_PT", "oCC_EX"]
+    mcc_fields = ["mCC_PT_CT", "mCC_EX_CT"]
+    fingerprint_field = "oCC_Hash"
+
+    # get arrays for fields of interest, reading the network once for both runs
+    network_array = arcpy.da.FeatureClassToNumPyArray(in_network, ["ReachID", "iHyd_SP2", "iHyd_SPLow", "iGeo_Slope",
+                                                                   "iGeo_DA", "iGeo_Len"] + veg_fields)
+    segid_array = np.asarray(network_array["ReachID"], np.int64)
+    da_array = np.asarray(network_array["iGeo_DA"], np.float64)
+    len_km_array = np.asarray(network_array["iGeo_Len"], np.float64) / 1000
+    veg_columns = np.vstack([np.asarray(network_array[field], np.float64) for field in veg_fields])
+    ihydsp2_array = np.asarray(network_array["iHyd_SP2"], np.float64)
+    ihydsplow_array = np.asarray(network_array["iHyd_SPLow"], np.float64)
+    igeoslope_array = np.asarray(network_array["iGeo_Slope"], np.float64)
+    num_runs = len(veg_fields)
+    del network_array
+
+    # read the membership functions and rules
+    comb_definition = Batch_FIS.read_definition(model_file)
+
+    # in an incremental run, fingerprint the inputs of each reach with the model, engine and DA threshold, and only
+    # run the FIS for reaches that have changed since the last run
+    fingerprints = None
+    if incremental:
+        model_key = Batch_FIS.definition_hash(comb_definition) + ":" + fis_engine + ":" + str(float(max_DA_thresh))
+        fingerprints = Batch_FIS.reach_fingerprints([veg_columns[0], veg_columns[1], ihydsp2_array, ihydsplow_array,
+                                                     igeoslope_array, da_array], model_key)
+    elif fingerprint_field in [f.name for f in arcpy.ListFields(in_network)]:
+        # fingerprints copied from the input network won't match the outputs written now
+        arcpy.DeleteField_management(in_network, fingerprint_field)
+    changed = np.ones(len(segid_array), dtype=bool)
+    occ_columns = np.zeros((num_runs, len(segid_array)))
+    if incremental and previous_outputs is not None:
+        previous_index = dict(zip(np.asarray(previous_outputs["ReachID"], np.int64).tolist(),
+                                  range(len(previous_outputs))))
+        previous_fingerprints = previous_outputs[fingerprint_field].astype(fingerprints.dtype)
+        for i, reach_id in enumerate(segid_array.tolist()):
+            j = previous_index.get(reach_id)
+            if j is not None and previous_fingerprints[j] == fingerprints[i]:
+                changed[i] = False
+                occ_columns[:, i] = [previous_outputs[field][j] for field in out_fields]
+        arcpy.AddMessage(str(np.count_nonzero(changed)) + " of " + str(len(changed)) +
+                         " reaches have changed since the last run")
+
+    # stack the potential reaches on top of the existing reaches so both runs are evaluated together
+    ovc_array = veg_columns[:, changed].flatten()
+    ihydsp2_array = np.tile(ihydsp2_array[changed], num_runs)
+    ihydsplow_array = np.tile(ihydsplow_array[changed], num_runs)
+    igeoslope_array = np.tile(igeoslope_array[changed], num_runs)
 
     # check that inputs are within range of fis
     # if not, re-assign the value to just within range
@@ -91,165 +148,53 @@ def combFIS(in_network, model_run, scratch, max_DA_thresh):
     ihydsplow_array[ihydsplow_array > 10000] = 10000
     igeoslope_array[igeoslope_array > 1] = 1
 
-    # delete temp arrays
-    items = [segid_np, ovc_np, ihydsp2_np, ihydsplow_np, igeoslope_np]
-    for item in items:
-        del item
-
-    # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
-    ovc = ctrl.Antecedent(np.arange(0, 45, 0.01), 'input1')
-    sp2 = ctrl.Antecedent(np.arange(0, 10000, 1), 'input2')
-    splow = ctrl.Antecedent(np.arange(0, 10000, 1), 'input3')
-    slope = ctrl.Antecedent(np.arange(0, 1, 0.0001), 'input4')
-    density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')
-
-    # build membership functions for each antecedent and consequent object
-    ovc['none'] = fuzz.trimf(ovc.universe, [0, 0, 0.1])
-    ovc['rare'] = fuzz.trapmf(ovc.universe, [0, 0.1, 0.5, 1.5])
-    ovc['occasional'] = fuzz.trapmf(ovc.universe, [0.5, 1.5, 4, 8])
-    ovc['frequent'] = fuzz.trapmf(ovc.universe, [4, 8, 12, 25])
-    ovc['pervasive'] = fuzz.trapmf(ovc.universe, [12, 25, 45, 45])
-
-    sp2['persists'] = fuzz.trapmf(sp2.universe, [0, 0, 1000, 1200])
-    sp2['breach'] = fuzz.trimf(sp2.universe, [1000, 1200, 1600])
-    sp2['oblowout'] = fuzz.trimf(sp2.universe, [1200, 1600, 2400])
-    sp2['blowout'] = fuzz.trapmf(sp2.universe, [1600, 2400, 10000, 10000])
-
-    splow['can'] = fuzz.trapmf(splow.universe, [0, 0, 150, 175])
-    splow['probably'] = fuzz.trapmf(splow.universe, [150, 175, 180, 190])
-    splow['cannot'] = fuzz.trapmf(splow.universe, [180, 190, 10000, 10000])
-
-    slope['flat'] = fuzz.trapmf(slope.universe, [0, 0, 0.0002, 0.005])
-    slope['can'] = fuzz.trapmf(slope.universe, [0.0002, 0.005, 0.12, 0.15])
-    slope['probably'] = fuzz.trapmf(slope.universe, [0.12, 0.15, 0.17, 0.23])
-    slope['cannot'] = fuzz.trapmf(slope.universe, [0.17, 0.23, 1, 1])
-
-    density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
-    density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
-    density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
-    density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
-    density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
-
-    # build fis rule table
-    rule1 = ctrl.Rule(ovc['none'], density['none'])
-    rule2 = ctrl.Rule(splow['cannot'], density['none'])
-    rule3 = ctrl.Rule(slope['cannot'], density['none'])
-    rule4 = ctrl.Rule(ovc['rare'] & sp2['persists'] & splow['can'] & ~slope['cannot'], density['rare'])
-    rule5 = ctrl.Rule(ovc['rare'] & sp2['persists'] & splow['probably'] & ~slope['cannot'], density['rare'])
-    rule6 = ctrl.Rule(ovc['rare'] & sp2['breach'] & splow['can'] & ~slope['cannot'], density['rare'])
-    rule7 = ctrl.Rule(ovc['rare'] & sp2['breach'] & splow['probably'] & ~slope['cannot'], density['rare'])
-    rule8 = ctrl.Rule(ovc['rare'] & sp2['oblowout'] & splow['can'] & ~slope['cannot'], density['rare'])
-    rule9 = ctrl.Rule(ovc['rare'] & sp2['oblowout'] & splow['probably'] & ~slope['cannot'], density['rare'])
-    rule10 = ctrl.Rule(ovc['rare'] & sp2['blowout'] & splow['can'] & ~slope['cannot'], density['none'])
-    rule11 = ctrl.Rule(ovc['rare'] & sp2['blowout'] & splow['probably'] & ~slope['cannot'], density['none'])
-    rule12 = ctrl.Rule(ovc['occasional'] & sp2['persists'] & splow['can'] & ~slope['cannot'], density['occasional'])
-    rule13 = ctrl.Rule(ovc['occasional'] & sp2['persists'] & splow['probably'] & ~slope['cannot'], density['occasional'])
-    rule14 = ctrl.Rule(ovc['occasional'] & sp2['breach'] & splow['can'] & ~slope['cannot'], density['occasional'])
-    rule15 = ctrl.Rule(ovc['occasional'] & sp2['breach'] & splow['probably'] & ~slope['cannot'], density['occasional'])
-    rule16 = ctrl.Rule(ovc['occasional'] & sp2['oblowout'] & splow['can'] & ~slope['cannot'], density['occasional'])
-    rule17 = ctrl.Rule(ovc['occasional'] & sp2['oblowout'] & splow['probably'] & ~slope['cannot'], density['occasional'])
-    rule18 = ctrl.Rule(ovc['occasional'] & sp2['blowout'] & splow['can'] & ~slope['cannot'], density['rare'])
-    rule19 = ctrl.Rule(ovc['occasional'] & sp2['blowout'] & splow['probably'] & ~slope['cannot'], density['rare'])
-    rule20 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['flat'], density['occasional'])
-    rule21 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['can'], density['frequent'])
-    rule22 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['can'] & slope['probably'], density['occasional'])
-    rule23 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['flat'], density['occasional'])
-    rule24 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['can'], density['frequent'])
-    rule25 = ctrl.Rule(ovc['frequent'] & sp2['persists'] & splow['probably'] & slope['probably'], density['occasional'])
-    rule26 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['flat'], density['occasional'])
-    rule27 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['can'], density['frequent'])
-    rule28 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['can'] & slope['probably'], density['occasional'])
-    rule29 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['flat'], density['occasional'])
-    rule30 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['can'], density['frequent'])
-    rule31 = ctrl.Rule(ovc['frequent'] & sp2['breach'] & splow['probably'] & slope['probably'], density['occasional'])
-    rule32 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['flat'], density['occasional'])
-    rule33 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['can'], density['frequent'])
-    rule34 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['can'] & slope['probably'], density['occasional'])
-    rule35 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['flat'], density['rare'])
-    rule36 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['can'], density['occasional'])
-    rule37 = ctrl.Rule(ovc['frequent'] & sp2['oblowout'] & splow['probably'] & slope['probably'], density['rare'])
-    rule38 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['flat'], density['rare'])
-    rule39 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['can'], density['rare'])
-    rule40 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['can'] & slope['probably'], density['rare'])
-    rule41 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['flat'], density['rare'])
-    rule42 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['can'], density['rare'])
-    rule43 = ctrl.Rule(ovc['frequent'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['rare'])
-    rule44 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['flat'], density['frequent'])
-    rule45 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['can'], density['pervasive'])
-    rule46 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['can'] & slope['probably'], density['frequent'])
-    rule47 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['flat'], density['frequent'])
-    rule48 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['can'], density['pervasive'])
-    rule49 = ctrl.Rule(ovc['pervasive'] & sp2['persists'] & splow['probably'] & slope['probably'], density['frequent'])
-    rule50 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['flat'], density['frequent'])
-    rule51 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['can'], density['pervasive'])
-    rule52 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['can'] & slope['probably'], density['frequent'])
-    rule53 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['flat'], density['frequent'])
-    rule54 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['can'], density['pervasive'])
-    rule55 = ctrl.Rule(ovc['pervasive'] & sp2['breach'] & splow['probably'] & slope['probably'], density['frequent'])
-    rule56 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['flat'], density['frequent'])
-    rule57 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['can'], density['pervasive'])
-    rule58 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['can'] & slope['probably'], density['frequent'])
-    rule59 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['flat'], density['occasional'])
-    rule60 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['can'], density['frequent'])
-    rule61 = ctrl.Rule(ovc['pervasive'] & sp2['oblowout'] & splow['probably'] & slope['probably'], density['occasional'])
-    rule62 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['flat'], density['occasional'])
-    rule63 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['can'], density['occasional'])
-    rule64 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['can'] & slope['probably'], density['rare'])
-    rule65 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['flat'], density['occasional'])
-    rule66 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['can'], density['occasional'])
-    rule67 = ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['rare'])
-
-    comb_ctrl = ctrl.ControlSystem([rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8, rule9, rule10, rule11, rule12,
-                                    rule13, rule14, rule15, rule16, rule17, rule18, rule19, rule20, rule21, rule22, rule23,
-                                    rule24, rule25, rule26, rule27, rule28, rule29, rule30, rule31, rule32, rule33, rule34,
-                                    rule35, rule36, rule37, rule38, rule39, rule40, rule41, rule42, rule43, rule44, rule45,
-                                    rule46, rule47, rule48, rule49, rule50, rule51, rule52, rule53, rule54, rule55, rule56,
-                                    rule57, rule58, rule59, rule60, rule61, rule62, rule63, rule64, rule65, rule66, rule67])
-    comb_fis = ctrl.ControlSystemSimulation(comb_ctrl)
-
     # run fuzzy inference system on inputs and defuzzify output
-    out = np.zeros(len(ovc_array)) # todo: test this using nas instead of zeros
-    for i in range(len(out)):
-        comb_fis.input['input1'] = ovc_array[i]
-        comb_fis.input['input2'] = ihydsp2_array[i]
-        comb_fis.input['input3'] = ihydsplow_array[i]
-        comb_fis.input['input4'] = igeoslope_array[i]
-        comb_fis.compute()
-        out[i] = comb_fis.output['result']
-
-    # save fuzzy inference system output as table
-    columns = np.column_stack((segid_array, out))
-    out_table = os.path.dirname(in_network) + "/" + out_field + "_Table.txt"  # todo: see if possible to skip this step
-    np.savetxt(out_table, columns, delimiter = ",", header = "ReachID, " + out_field, comments = "")
-    occ_table = scratch + "/" + out_field + "Tbl"
-    arcpy.CopyRows_management(out_table, occ_table)
-
-    # join the fuzzy inference system output to the flowline network
-    # create empty dictionary to hold input table field values
-    tblDict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(occ_table, ['ReachID', out_field]) as cursor:
-        for row in cursor:
-            tblDict[row[0]] = row[1]
-    # populate flowline network out field
-    arcpy.AddField_management(in_network, out_field, 'DOUBLE')
-    with arcpy.da.UpdateCursor(in_network, ['ReachID', out_field]) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = tblDict[aKey]
-                cursor.updateRow(row)
-            except:
-                pass
-    tblDict.clear()
+    fis_inputs = [ovc_array, ihydsp2_array, ihydsplow_array, igeoslope_array]
+    if workers is not None and int(workers) > 1:
+        arcpy.AddMessage("Running combined FIS in " + str(workers) + " processes...")
+        zero_term = 'none' if fis_engine == 'batch' else None
+        out = Batch_FIS.evaluate_in_pool(comb_definition, fis_inputs, int(workers), fis_engine, zero_term)
+        # spot check the pooled batch output against skfuzzy if the user gave a tolerance, as a single process run does
+        if fis_engine == 'batch' and tolerance is not None:
+            max_difference = Batch_FIS.compare_with_simulation(Batch_FIS.load_model(model_file),
+                                                               Batch_FIS.build_simulation(comb_definition),
+                                                               fis_inputs, out, float(tolerance), sample_size=1000)
+            arcpy.AddMessage("Batch combined capacity values are within " + str(max_difference) + " of skfuzzy")
+    elif fis_engine == 'batch':
+        batch_model = Batch_FIS.load_model(model_file)
+        out = batch_model.evaluate(fis_inputs, zero_term='none')
+        # spot check the batch output against skfuzzy if the user gave a tolerance
+        if tolerance is not None:
+            max_difference = Batch_FIS.compare_with_simulation(batch_model, Batch_FIS.build_simulation(comb_definition),
+                                                               fis_inputs, out, float(tolerance), sample_size=1000)
+            arcpy.AddMessage("Batch combined capacity values are within " + str(max_difference) + " of skfuzzy")
+    else:
+        comb_fis = Batch_FIS.build_simulation(comb_definition)
+        out = np.zeros(len(ovc_array)) # todo: test this using nas instead of zeros
+        for i in range(len(out)):
+            for variable, values in zip(comb_definition['inputs'], fis_inputs):
+                comb_fis.input[variable[0]] = values[i]
+            comb_fis.compute()
+            out[i] = comb_fis.output[comb_definition['output'][0]]
+
+    # report how far the breakpoint memberships the batch engine uses are from memberships sampled like skfuzzy's
+    if validate_membership:
+        report = Batch_FIS.load_model(model_file).validate_membership(fis_inputs, zero_term='none')
+        arcpy.AddMessage("Membership validation over " + str(report['checked']) + " reaches: max membership " +
+                         "deviation " + str(max(report['max_membership_deviation'].values())) +
+                         ", max output deviation " + str(report['max_output_deviation']))
 
     # calculate defuzzified centroid value for density 'none' MF group
     # this will be used to re-classify output values that fall in this group
     # important: will need to update the array (x) and MF values (mfx) if the
     #            density 'none' values are changed in the model
-    x = np.arange(0, 45, 0.01)
-    mfx = fuzz.trimf(x, [0, 0, 0.1])
-    defuzz_centroid = round(fuzz.defuzz(x, mfx, 'centroid'), 6)
+    # the batch engine already set reaches that only fire the density 'none' rules to 0
+    if fis_engine == 'batch':
+        defuzz_centroid = None
+    else:
+        x = np.arange(0, 45, 0.01)
+        mfx = fuzz.trimf(x, [0, 0, 0.1])
+        defuzz_centroid = round(fuzz.defuzz(x, mfx, 'centroid'), 6)
 
     # update combined capacity (occ_*) values in stream network
     # correct for occ_* greater than ovc_* as vegetation is most limiting factor in model
@@ -257,43 +202,35 @@ def combFIS(in_network, model_run, scratch, max_DA_thresh):
     # set occ_* to 0 if the drainage area is greater than the user defined threshold
     # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
     # set occ_* to 0 if output falls fully in 'none' category
-
-    with arcpy.da.UpdateCursor(in_network, [out_field, veg_field, 'iGeo_DA', 'iGeo_Slope']) as cursor:
-        for row in cursor:
-            if row[0] > row[1]:
-                row[0] = row[1]
-            if row[2] >= float(max_DA_thresh):
-                row[0] = 0.0
-            if round(row[0], 6) == defuzz_centroid:
-                row[0] = 0.0
-            cursor.updateRow(row)
-
-    # delete temporary tables and arrays
-    arcpy.Delete_management(out_table)
-    arcpy.Delete_management(occ_table)
-    items = [columns, out, x, mfx, defuzz_centroid]
-    for item in items:
-        del item
+    out_columns = out.reshape(num_runs, np.count_nonzero(changed))
+    out_columns = np.where(out_columns > veg_columns[:, changed], veg_columns[:, changed], out_columns)
+    out_columns[:, da_array[changed] >= float(max_DA_thresh)] = 0.0
+    if defuzz_centroid is not None:
+        out_columns[np.round(out_columns, 6) == defuzz_centroid] = 0.0
+    occ_columns[:, changed] = out_columns
 
     # calculate dam count (mCC_**_CT) for each reach as number of dams * reach length (in km)
-    arcpy.AddField_management(in_network, mcc_field, 'SHORT')
-    with arcpy.da.UpdateCursor(in_network, [mcc_field, out_field, 'iGeo_Len']) as cursor:
-        for row in cursor:
-            len_km = row[2] / 1000
-            raw_ct = row[1] * len_km
-            if raw_ct > 0 and raw_ct < 1:
-                row[0] = 1
-            else:
-                row[0] = round(raw_ct)
-            cursor.updateRow(row)
+    # reaches with less than one dam are rounded up to one, the rest are rounded half away from zero
+    raw_counts = occ_columns * len_km_array
+    mcc_columns = np.where(raw_counts >= 0, np.floor(raw_counts + 0.5), np.ceil(raw_counts - 0.5))
+    mcc_columns[(raw_counts > 0) & (raw_counts < 1)] = 1
+    mcc_columns = mcc_columns.astype(np.int64)
 
     # calculate dam count historic departure as difference between potential count and existing count
-    if model_run == 'ex':
-        arcpy.AddField_management(in_network, 'mCC_HisDep', 'SHORT')
-        with arcpy.da.UpdateCursor(in_network, ['mCC_HisDep', 'mCC_EX_CT', 'mCC_PT_CT']) as cursor:
-            for row in cursor:
-                row[0] = row[2] - row[1]
-                cursor.updateRow(row)
+    his_dep_array = mcc_columns[0] - mcc_columns[1]
+
+    # write the capacities, dam counts and departure back to the network in a single sweep
+    field_arrays = list(zip(out_fields, occ_columns))
+    if incremental:
+        field_arrays.append((fingerprint_field, fingerprints, 'TEXT'))
+    field_arrays += [(mcc_field, mcc_column, 'SHORT') for mcc_field, mcc_column in zip(mcc_fields, mcc_columns)]
+    field_arrays += [('mCC_HisDep', his_dep_array, 'SHORT')]
+    write_arrays_to_fields(in_network, segid_array, field_arrays)
+
+    # delete temporary arrays
+    items = [out, out_columns, occ_columns, veg_columns, raw_counts, mcc_columns]
+    for item in items:
+        del item
 
 
 def add_xml_output(in_network, out_network):
@@ -14,7 +14,7 @@ import numpy as np
 import os
 import sys
 import projectxml
-from SupportingFunctions import getUUID
+from SupportingFunctions import getUUID, write_arrays_to_fields
 
 
 def main(
@@ -30,8 +30,6 @@ def main(
     RRHigh,
     out_name):
 
-    scratch = 'in_memory'
-
     arcpy.env.overwriteOutput = True
 
     # CrossingLow = 10
@@ -42,14 +40,14 @@ def main(
     # CanalHigh = 200
     # RRLow = 30
     # RRHigh = 100
-    out_network = find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh, scratch)
+    out_network = find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh)
 
     addxmloutput(projPath, in_network, out_network)
 
     makeLayers(out_network)
 
 
-def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh, scratch):
+def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjHigh, CanalLow, CanalHigh, RRLow, RRHigh):
     if out_name.endswith('.shp'):
         out_network = os.path.join(os.path.dirname(in_network), out_name)
     else:
@@ -187,35 +185,8 @@ def find_oPC_Score(out_name, in_network, CrossingLow, CrossingHigh, AdjLow, AdjH
     # this is our conflict potential output
     oPC_Score = np.fmax(roadx_pc, np.fmax(roadad_pc, np.fmax(canal_pc, np.fmax(rr_pc, lu_pc))))
 
-    # save the output text file
-    columns = np.column_stack((segid_array, oPC_Score))
-    out_table = os.path.dirname(out_network) + "/oPC_Score_Table.txt"
-    np.savetxt(out_table, columns, delimiter = ",", header = "ReachID, oPC_Score", comments = "")
-
-    opc_score_table = scratch + "/opc_score_table"
-    arcpy.CopyRows_management(out_table, opc_score_table)
-
     # join the output to the flowline network
-    # create empty dictionary to hold input table field values
-    tblDict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(opc_score_table, ['ReachID', 'oPC_Score']) as cursor:
-        for row in cursor:
-            tblDict[row[0]] = row[1]
-    # populate flowline network out field
-    arcpy.AddField_management(out_network, 'oPC_Score', 'DOUBLE')
-    with arcpy.da.UpdateCursor(out_network, ['ReachID', 'oPC_Score']) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = tblDict[aKey]
-                cursor.updateRow(row)
-            except:
-                pass
-    tblDict.clear()
-
-    arcpy.Delete_management(out_table)
-    arcpy.Delete_management(opc_score_table)
+    write_arrays_to_fields(out_network, segid_array, [("oPC_Score", oPC_Score)])
 
     return out_network
 
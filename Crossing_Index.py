@@ -0,0 +1,223 @@
+# -------------------------------------------------------------------------------
+# Name:        Crossing Index
+# Purpose:     Finds where reaches cross roads with an R-tree over the road segments,
+#              giving both the crossing points and where to split each reach
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+
+# number of children of each R-tree node
+DEFAULT_NODE_CAPACITY = 16
+
+# number of reach segments looked up in the R-tree at once, to bound the memory of the candidate pairs
+DEFAULT_QUERY_CHUNK = 10000
+
+# reaches are not split closer than this to their ends or to another split, in map units
+DEFAULT_SPLIT_TOLERANCE = 0.001
+
+
+def str_order(boxes, node_capacity):
+    """
+    Orders boxes with Sort-Tile-Recursive packing, so each run of node_capacity boxes in the order is close together:
+    the boxes are cut into vertical slices by their center x, then sorted by center y within each slice
+    :param boxes: (n, 4) array of min x, min y, max x, max y
+    :param node_capacity: Number of boxes that will be grouped into each node
+    :return: Array of box numbers in packing order
+    """
+    num_nodes = int(np.ceil(len(boxes) / float(node_capacity)))
+    slice_size = int(np.ceil(np.sqrt(num_nodes))) * node_capacity
+    center_x = boxes[:, 0] + boxes[:, 2]
+    center_y = boxes[:, 1] + boxes[:, 3]
+    by_x = np.argsort(center_x, kind='mergesort')
+    slices = np.empty(len(boxes), np.int64)
+    slices[by_x] = np.arange(len(boxes)) // slice_size
+    return np.lexsort((center_y, slices))
+
+
+def boxes_overlap(first, second):
+    """
+    :param first: (n, 4) array of min x, min y, max x, max y
+    :param second: (n, 4) array of min x, min y, max x, max y
+    :return: Boolean array, True where the boxes in the same row overlap or touch
+    """
+    return (first[:, 0] <= second[:, 2]) & (second[:, 0] <= first[:, 2]) & (first[:, 1] <= second[:, 3]) & \
+        (second[:, 1] <= first[:, 3])
+
+
+class SegmentRTree(object):
+    """
+    An R-tree over line segments, bulk loaded with Sort-Tile-Recursive packing. Every level is stored as arrays, so
+    a whole batch of boxes is looked up at once, level by level
+    """
+    def __init__(self, starts, ends, node_capacity=DEFAULT_NODE_CAPACITY):
+        """
+        :param starts: (n, 2) array of the start of each segment
+        :param ends: (n, 2) array of the end of each segment
+        :param node_capacity: Number of children of each node
+        """
+        starts = np.asarray(starts, np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, np.float64).reshape(-1, 2)
+        self.node_capacity = max(int(node_capacity), 2)
+        boxes = np.column_stack((np.minimum(starts[:, 0], ends[:, 0]), np.minimum(starts[:, 1], ends[:, 1]),
+                                 np.maximum(starts[:, 0], ends[:, 0]), np.maximum(starts[:, 1], ends[:, 1])))
+        self.segment_order = str_order(boxes, self.node_capacity) if len(boxes) else np.zeros(0, np.int64)
+        self.entry_boxes = boxes[self.segment_order]
+
+        # group each level into nodes from the bottom up. A node's children are a run of the level below
+        self.levels = []
+        level_boxes = self.entry_boxes
+        while len(level_boxes) > 0:
+            child_starts = np.arange(0, len(level_boxes), self.node_capacity)
+            child_ends = np.minimum(child_starts + self.node_capacity, len(level_boxes))
+            node_boxes = np.column_stack((np.minimum.reduceat(level_boxes[:, 0], child_starts),
+                                          np.minimum.reduceat(level_boxes[:, 1], child_starts),
+                                          np.maximum.reduceat(level_boxes[:, 2], child_starts),
+                                          np.maximum.reduceat(level_boxes[:, 3], child_starts)))
+            if len(node_boxes) > 1:
+                node_order = str_order(node_boxes, self.node_capacity)
+                node_boxes = node_boxes[node_order]
+                child_starts = child_starts[node_order]
+                child_ends = child_ends[node_order]
+            self.levels.append((node_boxes, child_starts, child_ends))
+            if len(node_boxes) == 1:
+                break
+            level_boxes = node_boxes
+
+    def query(self, boxes):
+        """
+        Finds the segments whose boxes overlap each of a batch of boxes
+        :param boxes: (n, 4) array of min x, min y, max x, max y
+        :return: Tuple of arrays of query box numbers and segment numbers, one pair per overlap
+        """
+        boxes = np.asarray(boxes, np.float64).reshape(-1, 4)
+        if not self.levels or len(boxes) == 0:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+
+        # start every query at the root, and step down into the children of the nodes it overlaps
+        queries = np.arange(len(boxes))
+        nodes = np.zeros(len(boxes), np.int64)
+        for node_boxes, child_starts, child_ends in reversed(self.levels):
+            keep = boxes_overlap(boxes[queries], node_boxes[nodes])
+            queries = queries[keep]
+            nodes = nodes[keep]
+            counts = child_ends[nodes] - child_starts[nodes]
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            queries = np.repeat(queries, counts)
+            nodes = np.repeat(child_starts[nodes], counts) + offsets
+        keep = boxes_overlap(boxes[queries], self.entry_boxes[nodes])
+        return queries[keep], self.segment_order[nodes[keep]]
+
+
+def polyline_segments(features):
+    """
+    Breaks polylines into their segments
+    :param features: List with the parts of each polyline, each part a list of x, y vertices
+    :return: Tuple of arrays of segment starts, segment ends, the feature number of each segment, the distance along
+    its feature to the start of each segment, and the length of each feature
+    """
+    starts = []
+    ends = []
+    feature_numbers = []
+    for feature_number, parts in enumerate(features):
+        for part in parts:
+            part = np.asarray(part, np.float64).reshape(-1, 2)
+            if len(part) < 2:
+                continue
+            starts.append(part[:-1])
+            ends.append(part[1:])
+            feature_numbers.append(np.full(len(part) - 1, feature_number, np.int64))
+    if not starts:
+        empty = np.zeros((0, 2))
+        return empty, empty, np.zeros(0, np.int64), np.zeros(0), np.zeros(len(features))
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    feature_numbers = np.concatenate(feature_numbers)
+
+    # parts are measured one after another, as arcpy measures along a multipart polyline
+    lengths = np.hypot(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])
+    feature_lengths = np.bincount(feature_numbers, weights=lengths, minlength=len(features))
+    feature_starts = np.concatenate([[0.0], np.cumsum(feature_lengths)[:-1]])
+    along = np.cumsum(lengths) - lengths - feature_starts[feature_numbers]
+    return starts, ends, feature_numbers, along, feature_lengths
+
+
+class CrossingIndex(object):
+    """
+    Every point where a reach crosses or touches a road, found in one pass by looking up each reach segment in an
+    R-tree of the road segments. It gives both the crossing points, for iPC_RoadX, and the distances along each reach
+    to split it at, for segmenting the network by roads. Parallel segments that overlap are not counted as crossings
+    """
+    def __init__(self, reaches, roads, node_capacity=DEFAULT_NODE_CAPACITY, query_chunk=DEFAULT_QUERY_CHUNK):
+        """
+        :param reaches: List with the parts of each reach, each part a list of x, y vertices
+        :param roads: List with the parts of each road, each part a list of x, y vertices
+        :param node_capacity: Number of children of each R-tree node
+        :param query_chunk: Number of reach segments looked up at once
+        """
+        reach_starts, reach_ends, reach_numbers, reach_along, self.reach_lengths = polyline_segments(reaches)
+        road_starts, road_ends, road_numbers = polyline_segments(roads)[:3]
+        tree = SegmentRTree(road_starts, road_ends, node_capacity)
+
+        found = []
+        for first in range(0, len(reach_starts), max(int(query_chunk), 1)):
+            chunk = slice(first, first + max(int(query_chunk), 1))
+            boxes = np.column_stack((np.minimum(reach_starts[chunk, 0], reach_ends[chunk, 0]),
+                                     np.minimum(reach_starts[chunk, 1], reach_ends[chunk, 1]),
+                                     np.maximum(reach_starts[chunk, 0], reach_ends[chunk, 0]),
+                                     np.maximum(reach_starts[chunk, 1], reach_ends[chunk, 1])))
+            reach_segments, road_segments = tree.query(boxes)
+            reach_segments += first
+
+            # solve start + t * direction for both segments, keeping the pairs that meet within both
+            p = reach_starts[reach_segments]
+            r = reach_ends[reach_segments] - p
+            q = road_starts[road_segments]
+            s = road_ends[road_segments] - q
+            denominator = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+            safe_denominator = np.where(denominator != 0, denominator, 1.0)
+            t = ((q[:, 0] - p[:, 0]) * s[:, 1] - (q[:, 1] - p[:, 1]) * s[:, 0]) / safe_denominator
+            u = ((q[:, 0] - p[:, 0]) * r[:, 1] - (q[:, 1] - p[:, 1]) * r[:, 0]) / safe_denominator
+            crosses = (denominator != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+            reach_segments = reach_segments[crosses]
+            t = t[crosses]
+            points = p[crosses] + t[:, np.newaxis] * r[crosses]
+            distances = reach_along[reach_segments] + t * np.hypot(r[crosses, 0], r[crosses, 1])
+            found.append((reach_numbers[reach_segments], road_numbers[road_segments[crosses]], points, distances))
+
+        if found:
+            self.reach_numbers = np.concatenate([crossing[0] for crossing in found])
+            self.road_numbers = np.concatenate([crossing[1] for crossing in found])
+            self.points = np.concatenate([crossing[2] for crossing in found]).reshape(-1, 2)
+            self.distances = np.concatenate([crossing[3] for crossing in found])
+        else:
+            self.reach_numbers = np.zeros(0, np.int64)
+            self.road_numbers = np.zeros(0, np.int64)
+            self.points = np.zeros((0, 2))
+            self.distances = np.zeros(0)
+
+        # a crossing on a vertex is found for both segments that share it, so keep one per reach, road and place
+        order = np.lexsort((self.distances, self.road_numbers, self.reach_numbers))
+        keep = np.ones(len(order), bool)
+        keep[1:] = (np.diff(self.reach_numbers[order]) != 0) | (np.diff(self.road_numbers[order]) != 0) | \
+            (np.diff(self.distances[order]) > DEFAULT_SPLIT_TOLERANCE)
+        order = order[keep]
+        self.reach_numbers = self.reach_numbers[order]
+        self.road_numbers = self.road_numbers[order]
+        self.points = self.points[order]
+        self.distances = self.distances[order]
+
+    def split_distances(self, tolerance=DEFAULT_SPLIT_TOLERANCE):
+        """
+        :param tolerance: Crossings closer than this to a reach's ends or to the previous split are left out
+        :return: List with a sorted list of the distances along each reach to split it at
+        """
+        splits = [[] for length in self.reach_lengths]
+        order = np.lexsort((self.distances, self.reach_numbers))
+        for reach_number, distance in zip(self.reach_numbers[order].tolist(), self.distances[order].tolist()):
+            reach_splits = splits[reach_number]
+            previous = reach_splits[-1] if reach_splits else 0.0
+            if distance - previous > tolerance and self.reach_lengths[reach_number] - distance > tolerance:
+                reach_splits.append(distance)
+        return splits
@@ -0,0 +1,138 @@
+# -------------------------------------------------------------------------------
+# Name:        Distance Stats
+# Purpose:     Finds distances from the reach buffers to infrastructure features with a
+#              spatial index over the features, instead of Euclidean distance rasters
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# cell size of the EucDistance rasters the distances stand in for. The buffers are sampled at the centers of cells
+# of this size, the same cells ZonalStatisticsAsTable would have read
+DEFAULT_SAMPLE_SPACING = 5.0
+
+# greatest distance between the points put along each feature segment for the spatial index. Distances are exact
+# whatever the spacing, it only changes how many points are indexed and how many are checked for each sample
+DEFAULT_VERTEX_SPACING = 25.0
+
+# number of nearest indexed points first checked for each sample
+DEFAULT_NEIGHBOURS = 8
+
+
+class FeatureDistanceIndex(object):
+    """
+    The segments of a set of line and point features, indexed by points placed along them in a KD-tree. Memory grows
+    with the length and number of the features, not with the area they cover
+    """
+    def __init__(self, lines, points=None, vertex_spacing=DEFAULT_VERTEX_SPACING):
+        """
+        :param lines: List of (n, 2) arrays of x, y vertices, one per line part
+        :param points: (n, 2) array of x, y point features
+        :param vertex_spacing: Greatest distance between the indexed points along each segment
+        """
+        starts = [np.asarray(line, np.float64).reshape(-1, 2)[:-1] for line in lines if len(line) > 1]
+        ends = [np.asarray(line, np.float64).reshape(-1, 2)[1:] for line in lines if len(line) > 1]
+        if points is not None and len(points) > 0:
+            # a point is a segment that starts and ends in the same place
+            points = np.asarray(points, np.float64).reshape(-1, 2)
+            starts.append(points)
+            ends.append(points)
+        if not starts:
+            raise Exception("There are no features to find distances to")
+        self.starts = np.concatenate(starts)
+        self.ends = np.concatenate(ends)
+        self.vertex_spacing = float(vertex_spacing)
+
+        # place points along each segment, no further apart than the spacing, and remember their segment
+        lengths = np.hypot(self.ends[:, 0] - self.starts[:, 0], self.ends[:, 1] - self.starts[:, 1])
+        pieces = np.maximum(np.ceil(lengths / self.vertex_spacing), 1).astype(np.int64)
+        self.vertex_segments = np.repeat(np.arange(len(pieces)), pieces + 1)
+        steps = np.arange(len(self.vertex_segments)) - np.repeat(np.cumsum(pieces + 1) - (pieces + 1), pieces + 1)
+        fractions = (steps / np.repeat(pieces, pieces + 1).astype(np.float64))[:, np.newaxis]
+        vertices = self.starts[self.vertex_segments] + fractions * (self.ends[self.vertex_segments] -
+                                                                    self.starts[self.vertex_segments])
+        self.tree = cKDTree(vertices)
+
+    def segment_distances(self, x, y, segments):
+        """
+        :param x: Array of the X coordinates of the samples
+        :param y: Array of the Y coordinates of the samples
+        :param segments: Array of segment numbers, with a row for each sample
+        :return: Array of the distance from each sample to each of its segments
+        """
+        starts = self.starts[segments]
+        ends = self.ends[segments]
+        dx = ends[..., 0] - starts[..., 0]
+        dy = ends[..., 1] - starts[..., 1]
+        offset_x = x[:, np.newaxis] - starts[..., 0]
+        offset_y = y[:, np.newaxis] - starts[..., 1]
+        squared_lengths = dx * dx + dy * dy
+        safe_lengths = np.where(squared_lengths > 0, squared_lengths, 1.0)
+        along = np.where(squared_lengths > 0, np.clip((offset_x * dx + offset_y * dy) / safe_lengths, 0, 1), 0)
+        return np.hypot(offset_x - along * dx, offset_y - along * dy)
+
+    def distances(self, x, y, neighbours=DEFAULT_NEIGHBOURS):
+        """
+        Finds the exact distance from each sample to the nearest feature. Every part of a segment is within half the
+        spacing of one of its indexed points, so only segments with an indexed point within the nearest indexed
+        point's distance plus half the spacing can be nearest. The nearest indexed points are checked, and the
+        search is widened for the samples that might have more candidates
+        :param x: Array of the X coordinates of the samples
+        :param y: Array of the Y coordinates of the samples
+        :param neighbours: Number of nearest indexed points first checked for each sample
+        :return: Array of the distance from each sample to the nearest feature
+        """
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        result = np.zeros(len(x))
+        todo = np.arange(len(x))
+        neighbours = max(int(neighbours), 1)
+        while len(todo) > 0:
+            k = min(neighbours, self.tree.n)
+            vertex_distances, vertices = self.tree.query(np.column_stack((x[todo], y[todo])), k=k)
+            vertex_distances = vertex_distances.reshape(len(todo), k)
+            vertices = vertices.reshape(len(todo), k)
+            # a sample is done if every indexed point that could belong to its nearest segment was found
+            done = (vertex_distances[:, -1] > vertex_distances[:, 0] + self.vertex_spacing / 2) | (k == self.tree.n)
+            segments = self.vertex_segments[vertices[done]]
+            result[todo[done]] = self.segment_distances(x[todo[done]], y[todo[done]], segments).min(axis=1)
+            todo = todo[~done]
+            neighbours *= 4
+        return result
+
+
+def buffer_distance_statistics(coverage, grid, index, stat_types):
+    """
+    Finds statistics of the distance to the nearest feature over the cell centers in each buffer, as
+    ZonalStatisticsAsTable would find them from a Euclidean distance raster on the same grid. Each cell is only
+    measured once, however many buffers it is in
+    :param coverage: Zonal_Stats.BufferCoverage of the buffers on the sample grid
+    :param grid: Zonal_Stats.RasterGrid the samples are the cell centers of
+    :param index: FeatureDistanceIndex of the features
+    :param stat_types: List of statistics to find, from 'MINIMUM', 'MAXIMUM' and 'MEAN'
+    :return: List with an array of values for each statistic, one per buffer. Buffers without any cells are NaN
+    """
+    unique_cells, cell_numbers = np.unique(coverage.cell_indices, return_inverse=True)
+    sample_x = grid.x_min + (unique_cells % grid.cols + 0.5) * grid.cell_width
+    sample_y = grid.y_max - (unique_cells // grid.cols + 0.5) * grid.cell_height
+    cell_distances = index.distances(sample_x, sample_y)[cell_numbers]
+
+    num_zones = len(coverage.reach_ids)
+    counts = np.diff(coverage.zone_starts)
+    occupied = counts > 0
+    results = []
+    for stat_type in stat_types:
+        values = np.full(num_zones, np.nan)
+        if stat_type == 'MEAN':
+            sums = np.bincount(coverage.zone_numbers(), weights=cell_distances, minlength=num_zones)
+            values[occupied] = sums[occupied] / counts[occupied]
+        elif stat_type == 'MINIMUM' and occupied.any():
+            values[occupied] = np.minimum.reduceat(cell_distances, coverage.zone_starts[:-1][occupied])
+        elif stat_type == 'MAXIMUM' and occupied.any():
+            values[occupied] = np.maximum.reduceat(cell_distances, coverage.zone_starts[:-1][occupied])
+        elif stat_type not in ['MINIMUM', 'MAXIMUM', 'MEAN']:
+            raise Exception("Unknown distance statistic " + str(stat_type))
+        results.append(values)
+    return results
@@ -0,0 +1,281 @@
+# -------------------------------------------------------------------------------
+# Name:        FIS Benchmark
+# Purpose:     Times the capacity FIS engines on synthetic reaches and checks their
+#              accuracy against each other. Doesn't need arcpy, so it can run on any
+#              machine with numpy (and skfuzzy, to time the skfuzzy engine)
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+import numpy as np
+import Batch_FIS
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# skfuzzy takes a few milliseconds per reach, so it's only timed on this many reaches and its speed extrapolated
+DEFAULT_SKFUZZY_REACHES = 1000
+
+ENGINES = ['skfuzzy', 'batch', 'batch_dense', 'batch_sampled', 'lut', 'pool']
+
+
+def make_synthetic_reaches(num_reaches, seed=0):
+    """
+    Makes FIS inputs for a network of made up reaches, drawn from distributions like those seen in real BRAT runs
+    :param num_reaches: How many reaches to make
+    :param seed: Seed for the random numbers, so the same reaches are made every time
+    :return: Dictionary of arrays, keyed by the BRAT field name
+    """
+    rng = np.random.RandomState(seed)
+    reaches = {}
+
+    # vegetation suitability is the mean of 0-4 suitability codes in the buffer. Buffers that are all one class give
+    # whole numbers, so a share of the reaches sit exactly on the codes and the rest are spread between them
+    for field in ['iVeg_100PT', 'iVeg_30PT', 'iVeg_100EX', 'iVeg_30EX']:
+        veg = 4 * rng.beta(2.0, 1.5 if field.endswith('PT') else 2.5, num_reaches)
+        whole = rng.rand(num_reaches) < 0.2
+        veg[whole] = np.round(veg[whole])
+        reaches[field] = veg
+
+    # stream power and slope are roughly log normal, with a long tail of steep, high energy reaches
+    reaches['iHyd_SP2'] = rng.lognormal(np.log(300), 1.2, num_reaches)
+    reaches['iHyd_SPLow'] = rng.lognormal(np.log(20), 1.3, num_reaches)
+    reaches['iGeo_Slope'] = np.clip(rng.lognormal(np.log(0.01), 1.0, num_reaches), 0, 1)
+    return reaches
+
+
+def veg_inputs(reaches, model_run='EX'):
+    """
+    Gets the vegetation FIS inputs, clipped to the model range the same way Veg_FIS does
+    :param reaches: Dictionary from make_synthetic_reaches
+    :param model_run: 'PT' or 'EX'
+    :return: List of input arrays
+    """
+    return [np.clip(reaches['iVeg_100' + model_run], 0, 4), np.clip(reaches['iVeg_30' + model_run], 0, 4)]
+
+
+def comb_inputs(reaches, ovc):
+    """
+    Gets the combined FIS inputs, clipped to the model range the same way Comb_FIS does
+    :param reaches: Dictionary from make_synthetic_reaches
+    :param ovc: Vegetation capacity of each reach
+    :return: List of input arrays
+    """
+    sp2 = reaches['iHyd_SP2'].copy()
+    splow = reaches['iHyd_SPLow'].copy()
+    sp2[sp2 > 10000] = 10000
+    splow[splow > 10000] = 10000
+    return [np.clip(ovc, 0, 45), sp2, splow, np.clip(reaches['iGeo_Slope'], None, 1)]
+
+
+def time_call(function, *args, **kwargs):
+    """
+    Runs a function and times it
+    :return: Tuple of (what the function returned, seconds taken)
+    """
+    start = timeit.default_timer()
+    result = function(*args, **kwargs)
+    return result, timeit.default_timer() - start
+
+
+def run_skfuzzy(definition, inputs):
+    """
+    Evaluates reaches one at a time with skfuzzy, the way the tools do with the skfuzzy engine
+    :param definition: Dictionary like Batch_FIS.VEG_MODEL
+    :param inputs: List of input arrays
+    :return: Array with the output for each reach
+    """
+    simulation = Batch_FIS.build_simulation(definition)
+    out = np.zeros(len(inputs[0]))
+    for i in range(len(out)):
+        for variable, values in zip(definition['inputs'], inputs):
+            simulation.input[variable[0]] = values[i]
+        simulation.compute()
+        out[i] = simulation.output[definition['output'][0]]
+    return out
+
+
+def compare_outputs(reference, values):
+    """
+    :return: Dictionary with the max and mean absolute difference between the two arrays
+    """
+    differences = np.abs(np.asarray(reference) - np.asarray(values))
+    if len(differences) == 0:
+        return {'max_error': 0.0, 'mean_error': 0.0}
+    return {'max_error': float(differences.max()), 'mean_error': float(differences.mean())}
+
+
+def timing(num_reaches, seconds):
+    return {'reaches': int(num_reaches), 'seconds': seconds,
+            'reaches_per_second': num_reaches / seconds if seconds > 0 else None}
+
+
+def benchmark_model(definition, inputs, engines, skfuzzy_reaches, workers, lut_grid_size):
+    """
+    Times each engine on one model and compares their outputs
+    :param definition: Dictionary like Batch_FIS.VEG_MODEL
+    :param inputs: List of input arrays
+    :param engines: Which of ENGINES to run
+    :param skfuzzy_reaches: How many reaches to run through skfuzzy
+    :param workers: Number of processes for the pool engine
+    :param lut_grid_size: Grid size for the lookup table engine
+    :return: Dictionary of results, keyed by engine
+    """
+    num_reaches = len(inputs[0])
+    results = {}
+
+    model, compile_seconds = time_call(Batch_FIS.FISModel, definition)
+    exact, seconds = time_call(model.evaluate, inputs)
+    if 'batch' in engines:
+        results['batch'] = timing(num_reaches, seconds)
+        results['batch']['compile_seconds'] = compile_seconds
+
+    outputs = {}
+    if 'batch_dense' in engines:
+        outputs['batch_dense'], seconds = time_call(model.evaluate, inputs, sparse=False)
+        results['batch_dense'] = timing(num_reaches, seconds)
+
+    if 'batch_sampled' in engines:
+        outputs['batch_sampled'], seconds = time_call(model.evaluate, inputs, method='sampled')
+        results['batch_sampled'] = timing(num_reaches, seconds)
+
+    if 'lut' in engines and len(model.input_names) == 2:
+        # build the surface in an empty folder so the build time isn't hidden by an earlier cached surface
+        cache_folder = tempfile.mkdtemp()
+        try:
+            lookup_table, build_seconds = time_call(Batch_FIS.FISLookupTable, model, lut_grid_size, cache_folder)
+        finally:
+            shutil.rmtree(cache_folder)
+        outputs['lut'], seconds = time_call(lookup_table.evaluate, inputs)
+        results['lut'] = timing(num_reaches, seconds)
+        results['lut']['build_seconds'] = build_seconds
+        results['lut']['grid_size'] = lookup_table.grid_size
+
+    if 'pool' in engines and workers > 1:
+        outputs['pool'], seconds = time_call(Batch_FIS.evaluate_in_pool, definition, inputs, workers)
+        results['pool'] = timing(num_reaches, seconds)
+        results['pool']['workers'] = workers
+
+    # everything is checked against the exact analytic batch output over every reach
+    for engine in outputs:
+        results[engine]['vs_batch'] = compare_outputs(exact, outputs[engine])
+
+    # and against skfuzzy on an even sample of reaches
+    if 'skfuzzy' in engines and skfuzzy_reaches > 0:
+        try:
+            import skfuzzy
+        except ImportError:
+            results['skfuzzy'] = {'skipped': 'skfuzzy is not installed'}
+        else:
+            indices = Batch_FIS.sample_indices(num_reaches, skfuzzy_reaches)
+            sample = [values[indices] for values in inputs]
+            skfuzzy_out, seconds = time_call(run_skfuzzy, definition, sample)
+            results['skfuzzy'] = timing(len(indices), seconds)
+            results['skfuzzy']['estimated_seconds'] = seconds / len(indices) * num_reaches
+            outputs['batch'] = exact
+            for engine in outputs:
+                if engine in results:
+                    results[engine]['vs_skfuzzy'] = compare_outputs(skfuzzy_out, outputs[engine][indices])
+
+    return results
+
+
+def run_benchmark(sizes, engines=ENGINES, skfuzzy_reaches=DEFAULT_SKFUZZY_REACHES, workers=0,
+                  lut_grid_size=Batch_FIS.DEFAULT_LUT_GRID_SIZE, seed=0):
+    """
+    Benchmarks both capacity models on synthetic networks of each size
+    :param sizes: List of network sizes, in reaches
+    :return: Dictionary report, ready to be written as JSON
+    """
+    report = {'python': platform.python_version(),
+              'numpy': np.__version__,
+              'platform': platform.platform(),
+              'seed': seed,
+              'runs': []}
+    for num_reaches in sizes:
+        reaches = make_synthetic_reaches(num_reaches, seed)
+        print("Benchmarking " + str(num_reaches) + " reaches...")
+        veg = veg_inputs(reaches)
+        veg_results = benchmark_model(Batch_FIS.VEG_MODEL, veg, engines, skfuzzy_reaches, workers, lut_grid_size)
+
+        # the combined FIS runs on the vegetation capacity, so use the exact vegetation output as its first input
+        ovc = Batch_FIS.FISModel(Batch_FIS.VEG_MODEL).evaluate(veg, zero_term='none')
+        comb_results = benchmark_model(Batch_FIS.COMB_MODEL, comb_inputs(reaches, ovc), engines, skfuzzy_reaches,
+                                       workers, lut_grid_size)
+        report['runs'].append({'reaches': num_reaches, 'veg': veg_results, 'comb': comb_results})
+    return report
+
+
+def find_regressions(report, baseline, max_slowdown, max_error=None):
+    """
+    Compares a report against an earlier one
+    :param report: Dictionary from run_benchmark
+    :param baseline: Dictionary from an earlier run_benchmark
+    :param max_slowdown: How many times slower than the baseline an engine may be before it counts as a regression
+    :param max_error: If given, any engine further than this from skfuzzy also counts as a regression
+    :return: List of messages describing each regression
+    """
+    regressions = []
+    baseline_runs = dict((run['reaches'], run) for run in baseline['runs'])
+    for run in report['runs']:
+        for model_name in ['veg', 'comb']:
+            for engine, result in run[model_name].items():
+                label = model_name + " " + engine + " at " + str(run['reaches']) + " reaches"
+                if max_error is not None and 'vs_skfuzzy' in result and \
+                        result['vs_skfuzzy']['max_error'] > max_error:
+                    regressions.append(label + " is " + str(result['vs_skfuzzy']['max_error']) + " from skfuzzy")
+
+                old_run = baseline_runs.get(run['reaches'])
+                if old_run is None or engine not in old_run[model_name]:
+                    continue
+                old_speed = old_run[model_name][engine].get('reaches_per_second')
+                new_speed = result.get('reaches_per_second')
+                if old_speed and new_speed and new_speed * max_slowdown < old_speed:
+                    regressions.append(label + " fell from " + str(int(old_speed)) + " to " + str(int(new_speed)) +
+                                       " reaches per second")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times the BRAT capacity FIS engines on synthetic reaches")
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Network sizes to benchmark, in reaches")
+    parser.add_argument('-e', '--engines', nargs='+', choices=ENGINES, default=ENGINES, help="Engines to time")
+    parser.add_argument('--skfuzzy-reaches', type=int, default=DEFAULT_SKFUZZY_REACHES,
+                        help="How many reaches to run through skfuzzy at each size")
+    parser.add_argument('-w', '--workers', type=int, default=0, help="Number of processes for the pool engine")
+    parser.add_argument('--lut-grid-size', type=int, default=Batch_FIS.DEFAULT_LUT_GRID_SIZE,
+                        help="Grid size for the lookup table engine")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic reaches")
+    parser.add_argument('-o', '--output', help="Path to write the JSON report to. Printed if not given")
+    parser.add_argument('-b', '--baseline', help="An earlier JSON report to check for regressions against")
+    parser.add_argument('--max-slowdown', type=float, default=1.5,
+                        help="How many times slower than the baseline an engine may get before the run fails")
+    parser.add_argument('--max-error', type=float,
+                        help="Fail if any engine differs from skfuzzy by more than this")
+    args = parser.parse_args()
+
+    benchmark_report = run_benchmark(args.sizes, args.engines, args.skfuzzy_reaches, args.workers,
+                                     args.lut_grid_size, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(benchmark_report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(benchmark_report, indent=2, sort_keys=True))
+
+    if args.baseline or args.max_error is not None:
+        baseline_report = {'runs': []}
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline_report = json.load(f)
+        found = find_regressions(benchmark_report, baseline_report, args.max_slowdown, args.max_error)
+        for message in found:
+            print("Regression: " + message)
+        if found:
+            sys.exit(1)
@@ -0,0 +1,170 @@
+# -------------------------------------------------------------------------------
+# Name:        Focal Stats
+# Purpose:     Smooths a DEM with a 3x3 mean a block at a time with NumPy, either only
+#              where it is read or into a cached tiled GeoTIFF of the whole DEM
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+import os
+import hashlib
+import tempfile
+import Tiled_Raster
+
+# where smoothed DEMs are saved so each DEM is only smoothed once
+DEFAULT_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), 'BRAT_Focal_Cache')
+
+# NoData value of the smoothed DEMs that are written out
+SMOOTHED_NODATA = -9999.0
+
+
+def focal_mean(window, nodata=None):
+    """
+    Finds the mean of each cell's 3x3 neighbourhood, like FocalStatistics with a 3x3 NbrRectangle and the 'DATA'
+    option followed by ExtractByMask to the original raster. NoData neighbours are left out of the mean, and cells
+    that are NoData themselves stay NoData
+    :param window: 2D array with a halo of one cell around the cells to smooth. Cells outside of the raster should
+    be NaN or the NoData value
+    :param nodata: The NoData value of the raster
+    :return: 2D array of the smoothed cells, two rows and columns smaller than the window, with NaN for NoData
+    """
+    window = np.asarray(window, np.float64)
+    has_data = ~np.isnan(window)
+    if nodata is not None:
+        has_data &= window != float(nodata)
+    values = np.where(has_data, window, 0.0)
+
+    num_rows = window.shape[0] - 2
+    num_cols = window.shape[1] - 2
+    sums = np.zeros((num_rows, num_cols))
+    counts = np.zeros((num_rows, num_cols))
+    for row_offset in range(3):
+        for col_offset in range(3):
+            sums += values[row_offset:row_offset + num_rows, col_offset:col_offset + num_cols]
+            counts += has_data[row_offset:row_offset + num_rows, col_offset:col_offset + num_cols]
+
+    smoothed = np.full((num_rows, num_cols), np.nan)
+    center_has_data = has_data[1:-1, 1:-1]
+    smoothed[center_has_data] = sums[center_has_data] / counts[center_has_data]
+    return smoothed
+
+
+class FocalMeanSource(object):
+    """
+    Smooths another raster source with a 3x3 mean as its windows are read, so only the parts of the raster that are
+    actually summarized are ever smoothed. It can be used anywhere a source for Zonal_Stats.fused_zonal_statistics
+    can
+    """
+    def __init__(self, source):
+        """
+        :param source: The raster to smooth, with a nodata attribute, a (rows, cols) shape and a read_window method
+        """
+        self.source = source
+        self.nodata = None
+        self.shape = tuple(source.shape)
+
+    def read_window(self, first_row, first_col, num_rows, num_cols):
+        """
+        :param first_row: The first row of the window
+        :param first_col: The first column of the window
+        :param num_rows: The number of rows in the window
+        :param num_cols: The number of columns in the window
+        :return: 2D array of the smoothed window, with NaN for NoData
+        """
+        # read the window with a halo of one cell, leaving the parts outside of the raster as NaN
+        rows, cols = self.shape
+        low_row = max(first_row - 1, 0)
+        high_row = min(first_row + num_rows + 1, rows)
+        low_col = max(first_col - 1, 0)
+        high_col = min(first_col + num_cols + 1, cols)
+        window = np.full((num_rows + 2, num_cols + 2), np.nan)
+        window[low_row - first_row + 1:high_row - first_row + 1, low_col - first_col + 1:high_col - first_col + 1] = \
+            self.source.read_window(low_row, low_col, high_row - low_row, high_col - low_col)
+        return focal_mean(window, self.source.nodata)
+
+
+def raster_files(raster_path):
+    """
+    Finds the files a raster is stored in on disk, so it can be told apart from other rasters without reading it.
+    A raster in a single file comes with its sidecar files, like .aux.xml, .tfw and .prj, and a raster stored as a
+    folder, like an Esri grid, is every file in the folder
+    :param raster_path: Path to the raster
+    :return: List of file paths, or None if the raster isn't a plain file or folder, like a raster in a file
+    geodatabase or an enterprise geodatabase
+    """
+    raster_path = os.path.abspath(str(raster_path))
+    parent_folder = os.path.dirname(raster_path)
+    if raster_path.lower().endswith(('.gdb', '.sde')) or parent_folder.lower().endswith(('.gdb', '.sde')):
+        return None
+    if os.path.isdir(raster_path):
+        files = []
+        for folder, folder_names, file_names in os.walk(raster_path):
+            folder_names.sort()
+            files += [os.path.join(folder, file_name) for file_name in sorted(file_names)]
+    elif os.path.isfile(raster_path):
+        files = [raster_path]
+    else:
+        return None
+
+    # sidecars share the raster's name, with or without its extension
+    names = [os.path.basename(raster_path) + ".", os.path.splitext(os.path.basename(raster_path))[0] + "."]
+    for file_name in sorted(os.listdir(parent_folder)):
+        file_path = os.path.join(parent_folder, file_name)
+        if file_name.startswith(tuple(names)) and file_path not in files and os.path.isfile(file_path):
+            files.append(file_path)
+    return files
+
+
+def raster_signature(raster_path):
+    """
+    Identifies a raster by its path and the size and modification time of each of its files, so a smoothed copy is
+    only reused for the same unchanged raster, without reading the raster to tell
+    :param raster_path: Path to the raster
+    :return: Hex digest string, or None if the raster isn't stored as plain files that can be checked for changes
+    """
+    files = raster_files(raster_path)
+    if files is None:
+        return None
+    signature = [os.path.normcase(os.path.abspath(str(raster_path)))]
+    for file_path in files:
+        file_stat = os.stat(file_path)
+        signature.append(repr((os.path.basename(file_path), file_stat.st_size, file_stat.st_mtime)))
+    return hashlib.sha1("\n".join(signature).encode('utf-8')).hexdigest()
+
+
+def cached_focal_mean(raster_path, cache_folder=DEFAULT_CACHE_FOLDER, block_size=Tiled_Raster.DEFAULT_BLOCK_SIZE):
+    """
+    Gets a 3x3 mean smoothed copy of a raster as a tiled GeoTIFF, smoothing it a block at a time only if the same
+    raster hasn't been smoothed before
+    :param raster_path: Path to the raster to smooth
+    :param cache_folder: Where to look for and save smoothed rasters
+    :param block_size: Number of rows and columns smoothed at once
+    :return: Path to the smoothed GeoTIFF, or None if the raster isn't stored as plain files, like a raster in a
+    geodatabase, in which case it has to be smoothed some other way
+    """
+    signature = raster_signature(raster_path)
+    if signature is None:
+        return None
+    smoothed_path = os.path.join(cache_folder, "FocalMean_" + signature + ".tif")
+    if os.path.exists(smoothed_path):
+        return smoothed_path
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+
+    # write to a temporary name first, so a run that stops part way doesn't leave a smoothed raster to be reused
+    partial_path = os.path.join(cache_folder, "Partial_" + os.path.basename(smoothed_path))
+    raster = Tiled_Raster.TiledRaster(raster_path, block_size)
+    source = FocalMeanSource(raster)
+    smoothed = Tiled_Raster.TiledRaster.create(partial_path, raster, fill_value=SMOOTHED_NODATA,
+                                               nodata=SMOOTHED_NODATA, block_size=block_size)
+    for block_row in range(raster.num_block_rows):
+        for block_col in range(raster.num_block_cols):
+            first_row, first_col, num_rows, num_cols = raster.block_bounds(block_row, block_col)
+            block = source.read_window(first_row, first_col, num_rows, num_cols)
+            block[np.isnan(block)] = SMOOTHED_NODATA
+            smoothed.write_window(first_row, first_col, block)
+    smoothed.close()
+    raster.close()
+    os.rename(partial_path, smoothed_path)
+    return smoothed_path
@@ -0,0 +1,130 @@
+# -------------------------------------------------------------------------------
+# Name:        Hydrology Cache
+# Purpose:     Derives the filled DEM, flow direction and drainage area rasters from a
+#              DEM once, and reuses them for any later run on the same DEM file
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import arcpy
+from arcpy.sa import *
+import os
+import hashlib
+import tempfile
+import Focal_Stats
+
+# where derived hydrology rasters are saved, in a folder named after the DEM they came from
+DEFAULT_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), 'BRAT_Hydrology_Cache')
+
+# names of the rasters saved for each DEM
+FILLED_DEM_NAME = "Filled_DEM.tif"
+FLOW_DIRECTION_NAME = "Flow_Direction.tif"
+DRAINAGE_AREA_NAME = "DrainArea_sqkm.tif"
+
+# written once every raster for a DEM has been saved, so a run that stops part way isn't reused
+COMPLETE_NAME = "complete.txt"
+
+
+def hydrology_key(in_DEM):
+    """
+    Identifies a DEM by its path, extent, cell size and spatial reference, and by the size and modification time of
+    each of its files, so the DEM is never read to find its key. The rasters are derived from the DEM after it is
+    smoothed with a 3x3 mean, so that is part of the key too
+    :param in_DEM: Path to the DEM
+    :return: Hex digest string, or None if the DEM isn't stored as plain files that can be checked for changes
+    """
+    signature = Focal_Stats.raster_signature(in_DEM)
+    if signature is None:
+        return None
+    desc = arcpy.Describe(in_DEM)
+    extent = desc.extent
+    key = [signature,
+           repr((extent.XMin, extent.YMin, extent.XMax, extent.YMax)),
+           repr((desc.meanCellWidth, desc.meanCellHeight)),
+           desc.spatialReference.exportToString(),
+           "3x3 mean"]
+    return hashlib.sha1("\n".join(key).encode('utf-8')).hexdigest()
+
+
+def smooth_dem(in_DEM, use_cache=False):
+    """
+    Smooths a DEM with a 3x3 mean, clipped to the DEM, with FocalStatistics
+    :param in_DEM: Path to the DEM
+    :param use_cache: If True, the DEM is smoothed a block at a time into a GeoTIFF that later runs on the same DEM
+    file reuse. DEMs that aren't stored as plain files, like rasters in a geodatabase, are still smoothed with
+    FocalStatistics
+    :return: Raster of the smoothed DEM
+    """
+    if use_cache:
+        smoothed_path = Focal_Stats.cached_focal_mean(in_DEM)
+        if smoothed_path is not None:
+            return arcpy.Raster(smoothed_path)
+    neighborhood = NbrRectangle(3, 3, "CELL")
+    tmp_dem = FocalStatistics(in_DEM, neighborhood, 'MEAN')
+    return ExtractByMask(tmp_dem, in_DEM)
+
+
+def derive_hydrology(smoothed_DEM):
+    """
+    Runs Fill, FlowDirection and FlowAccumulation on a smoothed DEM
+    :param smoothed_DEM: The DEM smoothed with a 3x3 mean
+    :return: Tuple of the filled DEM, flow direction and drainage area (in square km) rasters
+    """
+    #  define raster environment settings
+    desc = arcpy.Describe(smoothed_DEM)
+    arcpy.env.extent = desc.Extent
+    arcpy.env.outputCoordinateSystem = desc.SpatialReference
+    arcpy.env.cellSize = desc.meanCellWidth
+    cell_area = desc.meanCellHeight * desc.meanCellWidth
+
+    # derive drainage area raster (in square km) from input DEM
+    # note: draiange area calculation assumes input dem is in meters
+    filled_DEM = Fill(smoothed_DEM) # fill sinks in dem
+    flow_direction = FlowDirection(filled_DEM) # calculate flow direction
+    flow_accumulation = FlowAccumulation(flow_direction) # calculate flow accumulattion
+    drain_area = flow_accumulation * cell_area / 1000000 # calculate drainage area in square kilometers
+    return filled_DEM, flow_direction, drain_area
+
+
+def hydrology_rasters(in_DEM, smoothed_DEM=None, cache_folder=DEFAULT_CACHE_FOLDER):
+    """
+    Gets the filled DEM, flow direction and drainage area (in square km) rasters of a DEM, running Fill,
+    FlowDirection and FlowAccumulation only if the same DEM hasn't been through them before
+    :param in_DEM: Path to the DEM
+    :param smoothed_DEM: The DEM smoothed with a 3x3 mean, if it has already been made. Otherwise it is only made if
+    the rasters have to be derived
+    :param cache_folder: Where to look for and save the rasters
+    :return: Tuple of the filled DEM, flow direction and drainage area rasters. These are paths to the saved rasters,
+    unless the DEM isn't stored as plain files, in which case the rasters are derived without being saved
+    """
+    key = hydrology_key(in_DEM)
+    if key is None:
+        arcpy.AddMessage("The DEM isn't stored as a file or grid folder, so its hydrology rasters won't be reused...")
+        if smoothed_DEM is None:
+            smoothed_DEM = smooth_dem(in_DEM)
+        return derive_hydrology(smoothed_DEM)
+
+    dem_folder = os.path.join(cache_folder, key)
+    filled_path = os.path.join(dem_folder, FILLED_DEM_NAME)
+    flow_direction_path = os.path.join(dem_folder, FLOW_DIRECTION_NAME)
+    drain_area_path = os.path.join(dem_folder, DRAINAGE_AREA_NAME)
+    if os.path.exists(os.path.join(dem_folder, COMPLETE_NAME)):
+        arcpy.AddMessage("Reusing the hydrology rasters already derived from this DEM...")
+        return filled_path, flow_direction_path, drain_area_path
+
+    if smoothed_DEM is None:
+        smoothed_DEM = smooth_dem(in_DEM, True)
+    if not os.path.exists(dem_folder):
+        os.makedirs(dem_folder)
+
+    filled_DEM, flow_direction, drain_area = derive_hydrology(smoothed_DEM)
+
+    for raster, raster_path in [(filled_DEM, filled_path), (flow_direction, flow_direction_path),
+                                (drain_area, drain_area_path)]:
+        if arcpy.Exists(raster_path):
+            arcpy.Delete_management(raster_path)
+        arcpy.CopyRaster_management(raster, raster_path)
+    with open(os.path.join(dem_folder, COMPLETE_NAME), 'w') as complete_file:
+        complete_file.write(str(in_DEM) + "\n")
+
+    return filled_path, flow_direction_path, drain_area_path
@@ -68,7 +68,7 @@ def check_intermediates(intermediates_folder, symbologyFolder):
         arcpy.AddMessage("Could not find BRAT Table output in intermediates, so could not generate layers for them")
         return
 
-    check_buffer_layers(intermediates_folder, symbologyFolder)
+    check_buffer_layers(intermediates_folder, symbologyFolder, brat_table_file)
 
     check_intermediate_layer(intermediates_folder, symbologyFolder, "Drainage_Area_Feature_Class.lyr", brat_table_file, "TopographicMetrics", "Drainage Area", "iGeo_DA")
     check_intermediate_layer(intermediates_folder, symbologyFolder, "Slope_Feature_Class.lyr", brat_table_file, "TopographicMetrics", "Reach Slope", "iGeo_Slope")
@@ -156,14 +156,24 @@ def find_BRAT_table_output(intermediates_folder):
     return brat_table_file
 
 
-def check_buffer_layers(intermediates_folder, symbology_folder):
+def check_buffer_layers(intermediates_folder, symbology_folder, brat_table_file=None):
     """
     Finds the buffer folder, and checks that it has the
     :param intermediates_folder: The path to the intermediates folder
     :param symbology_folder: The path to the symbology folder
+    :param brat_table_file: The BRAT Table output, which buffers that BRAT Table didn't write out are made from
     :return:
     """
     buffer_folder = find_folder(intermediates_folder, "Buffers")
+    if buffer_folder is None:
+        return
+
+    # BRAT Table only writes the buffers out if it needed them, so make any that are missing now
+    if brat_table_file:
+        for buffer_name, buffer_distance in [("buffer_30m.shp", "30 Meters"), ("buffer_100m.shp", "100 Meters")]:
+            buffer_path = os.path.join(buffer_folder, buffer_name)
+            if not os.path.exists(buffer_path):
+                arcpy.Buffer_analysis(brat_table_file, buffer_path, buffer_distance, "", "ROUND")
 
     buffer_100m = os.path.join(buffer_folder, "buffer_100m.shp")
     buffer_100m_layer = os.path.join(buffer_folder, "100mBuffer.lyr")
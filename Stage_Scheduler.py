@@ -0,0 +1,197 @@
+# -------------------------------------------------------------------------------
+# Name:        Stage Scheduler
+# Purpose:     Runs the attribute stages of the BRAT table in a process pool, each on
+#              its own copy of the network, and merges their fields in one write
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+# arcpy is imported in the functions that use it, so stage fields can be merged without ArcGIS
+
+# stands in for the network in a stage's arguments, and is replaced with the path to the stage's copy of the network
+NETWORK = "<network>"
+
+# arcpy field types and the types AddField_management takes for them
+FIELD_TYPES = {'Double': 'DOUBLE', 'Single': 'FLOAT', 'Integer': 'LONG', 'SmallInteger': 'SHORT', 'String': 'TEXT',
+               'Date': 'DATE'}
+
+
+class Stage(object):
+    """
+    One step of building the table, with what it needs and what it makes. A stage writes only its own output fields,
+    so stages that don't depend on each other can run at the same time
+    """
+    def __init__(self, name, function, args, output_fields, depends_on=None):
+        """
+        :param name: Name of the stage, used in messages and by depends_on
+        :param function: Module level function that runs the stage. It must be importable in a worker process
+        :param args: List of arguments to call the function with, with NETWORK where the network goes
+        :param output_fields: Names of the fields the stage writes to the network. Fields it didn't make are skipped
+        :param depends_on: Names of the stages whose output fields this stage reads
+        """
+        self.name = name
+        self.function = function
+        self.args = list(args)
+        self.output_fields = list(output_fields)
+        self.depends_on = list(depends_on) if depends_on else []
+
+
+def run_stage(task):
+    """
+    Runs a stage on its copy of the network in a worker process, and reads back the fields it made
+    :param task: Tuple of the stage and the path to its copy of the network
+    :return: Tuple of the stage name and a list of (field name, values, field type) tuples, keyed by ReachID
+    """
+    import arcpy
+    stage, network_copy = task
+    arcpy.env.overwriteOutput = True
+    arcpy.CheckOutExtension("Spatial")
+    stage.function(*[network_copy if arg == NETWORK else arg for arg in stage.args])
+    return stage.name, read_stage_fields(network_copy, stage.output_fields)
+
+
+def read_stage_fields(network, output_fields):
+    """
+    :param network: The network a stage ran on
+    :param output_fields: Names of the fields the stage could have made
+    :return: List of (field name, values, field type) tuples, with the ReachIDs first as ('ReachID', values, 'LONG')
+    """
+    import arcpy
+    field_types = dict((f.name, FIELD_TYPES.get(f.type, 'DOUBLE')) for f in arcpy.ListFields(network))
+    fields = [field for field in output_fields if field in field_types]
+    columns = [[] for field in fields]
+    reach_ids = []
+    with arcpy.da.SearchCursor(network, ['ReachID'] + fields) as cursor:
+        for row in cursor:
+            reach_ids.append(row[0])
+            for column, value in zip(columns, row[1:]):
+                column.append(value)
+    # values stay Python objects, so empty values are written back empty
+    return [('ReachID', reach_ids, 'LONG')] + [(field, column, field_types[field])
+                                               for field, column in zip(fields, columns)]
+
+
+def stage_field_arrays(stage_fields):
+    """
+    :param stage_fields: Fields read by read_stage_fields
+    :return: Tuple of the ReachID array and the list of (field name, array, field type) tuples
+    """
+    reach_ids = np.asarray(stage_fields[0][1], np.int64)
+    field_arrays = []
+    for field, values, field_type in stage_fields[1:]:
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        field_arrays.append((field, column, field_type))
+    return reach_ids, field_arrays
+
+
+def merge_stage_fields(names, results):
+    """
+    Lines up the fields of every stage by ReachID, in the order of the first stage's ReachIDs
+    :param names: Names of the stages, in the order their fields are written
+    :param results: Dictionary of stage name to the fields read by read_stage_fields
+    :return: Tuple of the ReachID array and the list of (field name, array, field type) tuples of every stage
+    """
+    reach_ids = None
+    field_arrays = []
+    for name in names:
+        stage_reach_ids, stage_arrays = stage_field_arrays(results[name])
+        if reach_ids is None:
+            reach_ids = stage_reach_ids
+        elif not np.array_equal(reach_ids, stage_reach_ids):
+            order = dict(zip(stage_reach_ids.tolist(), range(len(stage_reach_ids))))
+            positions = np.array([order[reach_id] for reach_id in reach_ids.tolist()], np.int64)
+            stage_arrays = [(field, values[positions], field_type) for field, values, field_type in stage_arrays]
+        field_arrays += stage_arrays
+    return reach_ids, field_arrays
+
+
+def run_stages(out_network, stages, workers):
+    """
+    Runs stages in a process pool, each on its own copy of the network, starting each stage as soon as the stages it
+    depends on are done. Once every stage is done, all of their fields are written to the network in one sweep
+    :param out_network: The network the fields are written to. It must have a ReachID field
+    :param stages: List of Stage objects
+    :param workers: Number of processes to run stages in
+    :return:
+    """
+    import arcpy
+    from SupportingFunctions import write_arrays_to_fields
+    names = [stage.name for stage in stages]
+    for stage in stages:
+        for name in stage.depends_on:
+            if name not in names:
+                raise Exception("Stage " + stage.name + " depends on " + name + ", which isn't one of the stages")
+
+    # inside ArcGIS, sys.executable is the ArcGIS application, which can't be used to start workers
+    if os.name == 'nt' and not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+
+    # the copies are deleted however the stages end, so a failed stage doesn't leave its copy behind
+    copies_folder = tempfile.mkdtemp(prefix="BRAT_Stages_")
+    try:
+        results = run_stage_pool(out_network, stages, workers, copies_folder)
+    finally:
+        shutil.rmtree(copies_folder, ignore_errors=True)
+
+    # merge every stage's fields by ReachID and write them all at once
+    reach_ids, field_arrays = merge_stage_fields(names, results)
+    if field_arrays:
+        write_arrays_to_fields(out_network, reach_ids, field_arrays)
+
+
+def run_stage_pool(out_network, stages, workers, copies_folder):
+    """
+    Runs stages in a process pool, starting each stage as soon as the stages it depends on are done
+    :param out_network: The network each stage's copy is made from
+    :param stages: List of Stage objects
+    :param workers: Number of processes to run stages in
+    :param copies_folder: Folder the copies of the network are made in
+    :return: Dictionary of stage name to the fields read by read_stage_fields
+    """
+    import arcpy
+    from SupportingFunctions import write_arrays_to_fields
+    results = {}
+    running = {}
+    waiting = list(stages)
+    pool = multiprocessing.Pool(max(1, min(int(workers), len(stages))))
+    try:
+        while waiting or running:
+            # start every stage whose dependencies are done, on a copy that has their fields in it
+            for stage in [stage for stage in waiting if all(name in results for name in stage.depends_on)]:
+                waiting.remove(stage)
+                network_copy = os.path.join(copies_folder, stage.name + ".shp")
+                arcpy.CopyFeatures_management(out_network, network_copy)
+                for name in stage.depends_on:
+                    reach_ids, field_arrays = stage_field_arrays(results[name])
+                    write_arrays_to_fields(network_copy, reach_ids, field_arrays)
+                arcpy.AddMessage("Starting the " + stage.name + " stage...")
+                running[stage.name] = pool.apply_async(run_stage, [(stage, network_copy)])
+            if not running:
+                raise Exception("The stages " + ", ".join([stage.name for stage in waiting]) +
+                                " depend on each other, so none of them can start")
+
+            # wait for any running stage to finish
+            finished = [name for name in running if running[name].ready()]
+            if not finished:
+                list(running.values())[0].wait(1)
+                continue
+            for name in finished:
+                stage_name, stage_fields = running.pop(name).get()
+                results[stage_name] = stage_fields
+                arcpy.AddMessage("Finished the " + stage_name + " stage")
+    finally:
+        # a failed stage stops the others rather than waiting for them
+        if waiting or running:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+    return results
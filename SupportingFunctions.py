@@ -168,3 +168,39 @@ def write_xml_element_with_path(xml_file, base_element, xml_element_name, item_n
     xml_file.add_sub_element(new_element, "Name", item_name)
     relative_path = find_relative_path(path, project_root)
     xml_file.add_sub_element(new_element, "Path", relative_path)
+
+
+def write_arrays_to_fields(in_network, reach_ids, field_arrays, key_field="ReachID", replace_fields=True):
+    """
+    Writes NumPy arrays straight into fields of the network, matching values to rows by ReachID
+    :param in_network: The network that we want to write the fields to
+    :param reach_ids: Array of ReachID values that the value arrays are aligned with
+    :param field_arrays: List of (field name, array) or (field name, array, field type) tuples. Field type defaults to
+    DOUBLE
+    :param key_field: The field used to match rows to values
+    :param replace_fields: If True, existing fields with the same names are replaced. If False, they are kept and only
+    the rows in reach_ids are updated
+    :return:
+    """
+    existing_fields = [f.name for f in arcpy.ListFields(in_network)]
+    field_names = []
+    field_columns = []
+    for field_array in field_arrays:
+        field_name = field_array[0]
+        field_type = field_array[2] if len(field_array) > 2 else 'DOUBLE'
+        if field_name in existing_fields and replace_fields:
+            arcpy.DeleteField_management(in_network, field_name)
+        if field_name not in existing_fields or replace_fields:
+            arcpy.AddField_management(in_network, field_name, field_type)
+        field_names.append(field_name)
+        field_columns.append(field_array[1].tolist())
+
+    # rows are looked up by ReachID, so the network doesn't need to be in the same order as the arrays
+    reach_index = dict(zip(reach_ids.tolist(), range(len(reach_ids))))
+    with arcpy.da.UpdateCursor(in_network, [key_field] + field_names) as cursor:
+        for row in cursor:
+            i = reach_index.get(row[0])
+            if i is None:
+                continue
+            row[1:] = [column[i] for column in field_columns]
+            cursor.updateRow(row)
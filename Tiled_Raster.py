@@ -0,0 +1,256 @@
+# -------------------------------------------------------------------------------
+# Name:        Tiled Raster
+# Purpose:     Reads and writes rasters a block at a time through a small cache, so
+#              rasters that are larger than memory can still be worked on
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+from collections import OrderedDict
+
+# number of rows and columns in each block. A 512 x 512 block of doubles is 2 MB
+DEFAULT_BLOCK_SIZE = 512
+
+# number of blocks kept in memory. Once the cache is full, the least recently used block is dropped, and written back
+# to the raster first if it was changed
+DEFAULT_CACHE_BLOCKS = 16
+
+
+class TiledRaster(object):
+    """
+    A single band of a raster on disk, read and written in square blocks through a least recently used cache. Windows,
+    single cells and blocks with a halo of neighbouring cells can be read anywhere in the raster, and only the blocks
+    they touch are ever loaded
+    """
+    def __init__(self, raster_path, block_size=DEFAULT_BLOCK_SIZE, halo=0, cache_blocks=DEFAULT_CACHE_BLOCKS,
+                 update=False, band_number=1, fill_value=None):
+        """
+        :param raster_path: Path to any raster GDAL can open
+        :param block_size: Number of rows and columns in each block
+        :param halo: Number of cells around each block that are also returned by blocks(), for neighbourhood operations
+        :param cache_blocks: Number of blocks kept in memory
+        :param update: If True, the raster can be written to
+        :param band_number: The band to read
+        :param fill_value: Value given to cells of a window that fall outside of the raster. Defaults to the NoData
+        value of the band, or 0 if it has none
+        """
+        from osgeo import gdal
+        self.raster_path = raster_path
+        self.dataset = gdal.Open(raster_path, gdal.GA_Update if update else gdal.GA_ReadOnly)
+        if self.dataset is None:
+            raise Exception("Could not open raster " + str(raster_path))
+        self.band = self.dataset.GetRasterBand(band_number)
+        self.update = update
+        self.nodata = self.band.GetNoDataValue()
+        self.rows = self.dataset.RasterYSize
+        self.cols = self.dataset.RasterXSize
+        self.shape = (self.rows, self.cols)
+        self.geotransform = self.dataset.GetGeoTransform()
+        self.projection = self.dataset.GetProjection()
+        self.dtype = self.band.ReadAsArray(0, 0, 1, 1).dtype
+
+        self.block_size = max(int(block_size), 1)
+        self.halo = max(int(halo), 0)
+        self.cache_blocks = max(int(cache_blocks), 1)
+        if fill_value is None:
+            fill_value = self.nodata if self.nodata is not None else 0
+        self.fill_value = fill_value
+        self.num_block_rows = (self.rows + self.block_size - 1) // self.block_size
+        self.num_block_cols = (self.cols + self.block_size - 1) // self.block_size
+        self.cache = OrderedDict()
+        self.dirty = set()
+
+    @classmethod
+    def create(cls, raster_path, like, fill_value=-9999.0, nodata=-9999.0, data_type=None,
+               block_size=DEFAULT_BLOCK_SIZE, halo=0, cache_blocks=DEFAULT_CACHE_BLOCKS):
+        """
+        Creates a GeoTIFF on the same grid as another raster and opens it for writing. The GeoTIFF is tiled with the
+        same block size when it can be, so each block is stored together on disk
+        :param raster_path: Path of the GeoTIFF to create
+        :param like: TiledRaster whose size, geotransform and projection the new raster copies
+        :param fill_value: Value every cell starts with
+        :param nodata: NoData value of the new raster, or None for no NoData value
+        :param data_type: GDAL data type of the new raster. Defaults to Float32
+        :param block_size: Number of rows and columns in each block
+        :param halo: Number of cells around each block that are also returned by blocks()
+        :param cache_blocks: Number of blocks kept in memory
+        :return: TiledRaster
+        """
+        from osgeo import gdal
+        if data_type is None:
+            data_type = gdal.GDT_Float32
+        options = ['BIGTIFF=IF_SAFER']
+        # GeoTIFF tiles have to be a multiple of 16 cells across
+        if block_size % 16 == 0:
+            options += ['TILED=YES', 'BLOCKXSIZE=' + str(block_size), 'BLOCKYSIZE=' + str(block_size)]
+        dataset = gdal.GetDriverByName('GTiff').Create(raster_path, like.cols, like.rows, 1, data_type, options)
+        dataset.SetGeoTransform(like.geotransform)
+        dataset.SetProjection(like.projection)
+        band = dataset.GetRasterBand(1)
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        band.Fill(fill_value)
+        band.FlushCache()
+        dataset = None
+        return cls(raster_path, block_size, halo, cache_blocks, update=True)
+
+    def block_bounds(self, block_row, block_col):
+        """
+        :param block_row: Row of the block in the grid of blocks
+        :param block_col: Column of the block in the grid of blocks
+        :return: Tuple of the first row, first column, number of rows and number of columns of the block
+        """
+        first_row = block_row * self.block_size
+        first_col = block_col * self.block_size
+        return (first_row, first_col, min(self.block_size, self.rows - first_row),
+                min(self.block_size, self.cols - first_col))
+
+    def get_block(self, block_row, block_col):
+        """
+        Gets a block from the cache, reading it from disk if it isn't there. The block is the cached array itself
+        :param block_row: Row of the block in the grid of blocks
+        :param block_col: Column of the block in the grid of blocks
+        :return: 2D array of the block
+        """
+        key = (block_row, block_col)
+        block = self.cache.pop(key, None)
+        if block is None:
+            first_row, first_col, num_rows, num_cols = self.block_bounds(block_row, block_col)
+            block = self.band.ReadAsArray(first_col, first_row, num_cols, num_rows)
+            while len(self.cache) >= self.cache_blocks:
+                self.evict()
+        self.cache[key] = block
+        return block
+
+    def evict(self):
+        """
+        Drops the least recently used block from the cache, writing it back to disk first if it was changed
+        :return:
+        """
+        key, block = self.cache.popitem(last=False)
+        if key in self.dirty:
+            first_row, first_col, num_rows, num_cols = self.block_bounds(key[0], key[1])
+            self.band.WriteArray(block, first_col, first_row)
+            self.dirty.discard(key)
+
+    def overlapping_blocks(self, first_row, first_col, num_rows, num_cols):
+        """
+        Finds the blocks a window touches, and which part of the window and of each block overlap
+        :return: List of (block row, block column, window slices, block slices) tuples
+        """
+        last_row = min(first_row + num_rows, self.rows) - 1
+        last_col = min(first_col + num_cols, self.cols) - 1
+        overlaps = []
+        for block_row in range(max(first_row, 0) // self.block_size, last_row // self.block_size + 1):
+            for block_col in range(max(first_col, 0) // self.block_size, last_col // self.block_size + 1):
+                block_first_row, block_first_col, block_rows, block_cols = self.block_bounds(block_row, block_col)
+                low_row = max(first_row, block_first_row)
+                high_row = min(first_row + num_rows, block_first_row + block_rows)
+                low_col = max(first_col, block_first_col)
+                high_col = min(first_col + num_cols, block_first_col + block_cols)
+                if low_row >= high_row or low_col >= high_col:
+                    continue
+                window_slices = (slice(low_row - first_row, high_row - first_row),
+                                 slice(low_col - first_col, high_col - first_col))
+                block_slices = (slice(low_row - block_first_row, high_row - block_first_row),
+                                slice(low_col - block_first_col, high_col - block_first_col))
+                overlaps.append((block_row, block_col, window_slices, block_slices))
+        return overlaps
+
+    def read_window(self, first_row, first_col, num_rows, num_cols):
+        """
+        Reads any window of the raster. Cells outside of the raster get the fill value
+        :param first_row: The first row of the window, which may be negative
+        :param first_col: The first column of the window, which may be negative
+        :param num_rows: The number of rows in the window
+        :param num_cols: The number of columns in the window
+        :return: 2D array of the window, which is a copy and can be changed freely
+        """
+        # most windows of a neighbourhood operation fall inside a single block
+        block_row = first_row // self.block_size
+        block_col = first_col // self.block_size
+        if first_row >= 0 and first_col >= 0 and first_row + num_rows <= self.rows and \
+                first_col + num_cols <= self.cols and (first_row + num_rows - 1) // self.block_size == block_row and \
+                (first_col + num_cols - 1) // self.block_size == block_col:
+            row = first_row - block_row * self.block_size
+            col = first_col - block_col * self.block_size
+            return self.get_block(block_row, block_col)[row:row + num_rows, col:col + num_cols].copy()
+
+        window = np.empty((num_rows, num_cols), self.dtype)
+        window.fill(self.fill_value)
+        for block_row, block_col, window_slices, block_slices in self.overlapping_blocks(first_row, first_col,
+                                                                                         num_rows, num_cols):
+            window[window_slices] = self.get_block(block_row, block_col)[block_slices]
+        return window
+
+    def write_window(self, first_row, first_col, values):
+        """
+        Writes a window of values into the raster. Values that fall outside of the raster are ignored. The changes
+        are kept in the cache until the block is dropped or the raster is flushed
+        :param first_row: The first row of the window, which may be negative
+        :param first_col: The first column of the window, which may be negative
+        :param values: 2D array of the values to write
+        :return:
+        """
+        if not self.update:
+            raise Exception("Raster " + str(self.raster_path) + " was not opened for writing")
+        values = np.asarray(values)
+        for block_row, block_col, window_slices, block_slices in self.overlapping_blocks(first_row, first_col,
+                                                                                         values.shape[0],
+                                                                                         values.shape[1]):
+            self.get_block(block_row, block_col)[block_slices] = values[window_slices]
+            self.dirty.add((block_row, block_col))
+
+    def blocks(self):
+        """
+        Goes through the raster block by block, in row order
+        :return: Generator of (first row, first column, number of rows, number of columns, window) tuples. The window
+        is the block plus the halo around it, so it starts halo cells up and to the left of the block
+        """
+        for block_row in range(self.num_block_rows):
+            for block_col in range(self.num_block_cols):
+                first_row, first_col, num_rows, num_cols = self.block_bounds(block_row, block_col)
+                window = self.read_window(first_row - self.halo, first_col - self.halo, num_rows + 2 * self.halo,
+                                          num_cols + 2 * self.halo)
+                yield first_row, first_col, num_rows, num_cols, window
+
+    def __getitem__(self, index):
+        row, col = index
+        if row < 0 or col < 0 or row >= self.rows or col >= self.cols:
+            raise IndexError("Cell " + str(index) + " is outside of raster " + str(self.raster_path))
+        return self.get_block(row // self.block_size, col // self.block_size)[row % self.block_size,
+                                                                              col % self.block_size]
+
+    def __setitem__(self, index, value):
+        row, col = index
+        if not self.update:
+            raise Exception("Raster " + str(self.raster_path) + " was not opened for writing")
+        if row < 0 or col < 0 or row >= self.rows or col >= self.cols:
+            raise IndexError("Cell " + str(index) + " is outside of raster " + str(self.raster_path))
+        key = (row // self.block_size, col // self.block_size)
+        self.get_block(key[0], key[1])[row % self.block_size, col % self.block_size] = value
+        self.dirty.add(key)
+
+    def flush(self):
+        """
+        Writes every changed block in the cache back to disk
+        :return:
+        """
+        for key in list(self.dirty):
+            first_row, first_col, num_rows, num_cols = self.block_bounds(key[0], key[1])
+            self.band.WriteArray(self.cache[key], first_col, first_row)
+        self.dirty.clear()
+        if self.update:
+            self.band.FlushCache()
+
+    def close(self):
+        """
+        Writes any changes and closes the raster
+        :return:
+        """
+        if self.dataset is not None:
+            self.flush()
+        self.cache.clear()
+        self.band = None
+        self.dataset = None
@@ -11,150 +11,97 @@
 
 import arcpy
 import skfuzzy as fuzz
-from skfuzzy import control as ctrl
 import numpy as np
 import os
 import sys
-from SupportingFunctions import make_folder, make_layer, find_available_num_prefix
-
-
-def main(in_network):
-
-    scratch = 'in_memory'
-
-    # vegetation capacity fis function
-    def vegFIS(model_run):
-
-        arcpy.env.overwriteOutput = True
-
-        # get list of all fields in the flowline network
-        fields = [f.name for f in arcpy.ListFields(in_network)]
-
-        # set the carrying capacity and vegetation field depending on whether potential or existing run
-        if model_run == 'pt':
-            out_field = "oVC_PT"
-            riparian_field = "iVeg_100PT"
-            streamside_field = "iVeg_30PT"
-        else:
-            out_field = "oVC_EX"
-            riparian_field = "iVeg_100EX"
-            streamside_field = "iVeg_30EX"
-
-        # check for oVC_* field in the network attribute table and delete if exists
-        if out_field in fields:
-            arcpy.DeleteField_management(in_network, out_field)
-
-        # get arrays for fields of interest
-        segid_np = arcpy.da.FeatureClassToNumPyArray(in_network, "ReachID")
-        riparian_np = arcpy.da.FeatureClassToNumPyArray(in_network, riparian_field)
-        streamside_np = arcpy.da.FeatureClassToNumPyArray(in_network, streamside_field)
-
-        segid_array = np.asarray(segid_np, np.int64)
-        riparian_array = np.asarray(riparian_np, np.float64)
-        streamside_array = np.asarray(streamside_np, np.float64)
-
-        # check that inputs are within range of fis
-        # if not, re-assign the value to just within range
-        riparian_array[riparian_array < 0] = 0
-        riparian_array[riparian_array > 4] = 4
-        streamside_array[streamside_array < 0] = 0
-        streamside_array[streamside_array > 4] = 4
-
-        # delete temp arrays
-        items = [segid_np, riparian_np, streamside_np]
-        for item in items:
-            del item
-
-        # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
-        riparian = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input1')
-        streamside = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input2')
-        density = ctrl.Consequent(np.arange(0, 45, 0.01), 'result')
-
-        # build membership functions for each antecedent and consequent object
-        riparian['unsuitable'] = fuzz.trapmf(riparian.universe, [0, 0, 0.1, 1])
-        riparian['barely'] = fuzz.trimf(riparian.universe, [0.1, 1, 2])
-        riparian['moderately'] = fuzz.trimf(riparian.universe, [1, 2, 3])
-        riparian['suitable'] = fuzz.trimf(riparian.universe, [2, 3, 4])
-        riparian['preferred'] = fuzz.trimf(riparian.universe, [3, 4, 4])
-
-        streamside['unsuitable'] = fuzz.trapmf(streamside.universe, [0, 0, 0.1, 1])
-        streamside['barely'] = fuzz.trimf(streamside.universe, [0.1, 1, 2])
-        streamside['moderately'] = fuzz.trimf(streamside.universe, [1, 2, 3])
-        streamside['suitable'] = fuzz.trimf(streamside.universe, [2, 3, 4])
-        streamside['preferred'] = fuzz.trimf(streamside.universe, [3, 4, 4])
-
-        density['none'] = fuzz.trimf(density.universe, [0, 0, 0.1])
-        density['rare'] = fuzz.trapmf(density.universe, [0, 0.1, 0.5, 1.5])
-        density['occasional'] = fuzz.trapmf(density.universe, [0.5, 1.5, 4, 8])
-        density['frequent'] = fuzz.trapmf(density.universe, [4, 8, 12, 25])
-        density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
-
-        # build fis rule table
-        rule1 = ctrl.Rule(riparian['unsuitable'] & streamside['unsuitable'], density['none'])
-        rule2 = ctrl.Rule(riparian['barely'] & streamside['unsuitable'], density['rare'])
-        rule3 = ctrl.Rule(riparian['moderately'] & streamside['unsuitable'], density['rare'])
-        rule4 = ctrl.Rule(riparian['suitable'] & streamside['unsuitable'], density['occasional'])
-        rule5 = ctrl.Rule(riparian['preferred'] & streamside['unsuitable'], density['occasional'])
-        rule6 = ctrl.Rule(riparian['unsuitable'] & streamside['barely'], density['rare'])
-        rule7 = ctrl.Rule(riparian['barely'] & streamside['barely'], density['rare']) # matBRAT has consequnt as 'occasional'
-        rule8 = ctrl.Rule(riparian['moderately'] & streamside['barely'], density['occasional'])
-        rule9 = ctrl.Rule(riparian['suitable'] & streamside['barely'], density['occasional'])
-        rule10 = ctrl.Rule(riparian['preferred'] & streamside['barely'], density['occasional'])
-        rule11 = ctrl.Rule(riparian['unsuitable'] & streamside['moderately'], density['rare'])
-        rule12 = ctrl.Rule(riparian['barely'] & streamside['moderately'], density['occasional'])
-        rule13 = ctrl.Rule(riparian['moderately'] & streamside['moderately'], density['occasional'])
-        rule14 = ctrl.Rule(riparian['suitable'] & streamside['moderately'], density['frequent'])
-        rule15 = ctrl.Rule(riparian['preferred'] & streamside['moderately'], density['frequent'])
-        rule16 = ctrl.Rule(riparian['unsuitable'] & streamside['suitable'], density['occasional'])
-        rule17 = ctrl.Rule(riparian['barely'] & streamside['suitable'], density['occasional'])
-        rule18 = ctrl.Rule(riparian['moderately'] & streamside['suitable'], density['frequent'])
-        rule19 = ctrl.Rule(riparian['suitable'] & streamside['suitable'], density['frequent'])
-        rule20 = ctrl.Rule(riparian['preferred'] & streamside['suitable'], density['pervasive'])
-        rule21 = ctrl.Rule(riparian['unsuitable'] & streamside['preferred'], density['occasional'])
-        rule22 = ctrl.Rule(riparian['barely'] & streamside['preferred'], density['frequent'])
-        rule23 = ctrl.Rule(riparian['moderately'] & streamside['preferred'], density['pervasive'])
-        rule24 = ctrl.Rule(riparian['suitable'] & streamside['preferred'], density['pervasive'])
-        rule25 = ctrl.Rule(riparian['preferred'] & streamside['preferred'], density['pervasive'])
-
-        # FIS
-        veg_ctrl = ctrl.ControlSystem([rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8, rule9, rule10, rule11,
-                                       rule12, rule13, rule14, rule15, rule16, rule17, rule18, rule19, rule20, rule21, rule22, rule23, rule24, rule25])
-        veg_fis = ctrl.ControlSystemSimulation(veg_ctrl)
-
-        # run fuzzy inference system on inputs and defuzzify output
-        out = np.zeros(len(riparian_array))
-        for i in range(len(out)):
-            veg_fis.input['input1'] = riparian_array[i]
-            veg_fis.input['input2'] = streamside_array[i]
-            veg_fis.compute()
-            out[i] = veg_fis.output['result']
-
-        # save fuzzy inference system output as table
-        columns = np.column_stack((segid_array, out))
-        out_table = os.path.dirname(in_network) + "/" + out_field + "_Table.txt"  # todo: see if possible to skip this step
-        np.savetxt(out_table, columns, delimiter = ",", header = "ReachID, " + out_field, comments = "")
-        ovc_table = scratch + "/" + out_field + "Tbl"
-        arcpy.CopyRows_management(out_table, ovc_table)
-
-        # join the fuzzy inference system output to the flowline network
-        # create empty dictionary to hold input table field values
-        tblDict = {}
-        # add values to dictionary
-        with arcpy.da.SearchCursor(ovc_table, ['ReachID', out_field]) as cursor:
-            for row in cursor:
-                tblDict[row[0]] = row[1]
-        # populate flowline network out field
-        arcpy.AddField_management(in_network, out_field, 'DOUBLE')
-        with arcpy.da.UpdateCursor(in_network, ['ReachID', out_field]) as cursor:
-            for row in cursor:
-                try:
-                    aKey = row[0]
-                    row[1] = tblDict[aKey]
-                    cursor.updateRow(row)
-                except:
-                    pass
-        tblDict.clear()
-
+from SupportingFunctions import make_folder, make_layer, find_available_num_prefix, write_arrays_to_fields
+import Batch_FIS
+reload(Batch_FIS)
+
+
+def main(in_network, fis_engine='skfuzzy', tolerance=None, lut_grid_size=None, workers=None, model_file=None,
+         incremental=False, validate_membership=False):
+
+    arcpy.env.overwriteOutput = True
+
+    # the tool passes None if the engine parameter is cleared
+    fis_engine = Batch_FIS.check_engine(fis_engine, ['skfuzzy', 'batch', 'lut'])
+    if fis_engine == 'lut' and workers is not None and int(workers) > 1:
+        arcpy.AddWarning("The lut engine interpolates every reach in one process, so the number of workers is ignored")
+    if fis_engine == 'skfuzzy' and tolerance is not None:
+        arcpy.AddWarning("The skfuzzy engine is the reference the other engines are checked against, so the " +
+                         "tolerance is ignored")
+
+    # read the membership functions and rules, either the defaults or a calibrated copy given by the user
+    if model_file is None:
+        model_file = Batch_FIS.VEG_MODEL_FILE
+    veg_definition = Batch_FIS.read_definition(model_file)
+    incremental = incremental not in [None, False, 'false']
+    validate_membership = validate_membership not in [None, False, 'false']
+
+    # read the inputs for both the potential and existing runs in one pass over the network
+    riparian_fields = ["iVeg_100PT", "iVeg_100EX"]
+    streamside_fields = ["iVeg_30PT", "iVeg_30EX"]
+    out_fields = ["oVC_PT", "oVC_EX"]
+    fingerprint_field = "oVC_Hash"
+
+    # an incremental run can only reuse the outputs if a previous run wrote them along with the fingerprints
+    fields = [f.name for f in arcpy.ListFields(in_network)]
+    reuse_outputs = incremental and all(field in fields for field in out_fields + [fingerprint_field])
+    read_fields = ["ReachID"] + riparian_fields + streamside_fields
+    if reuse_outputs:
+        read_fields += [fingerprint_field]
+    network_array = arcpy.da.FeatureClassToNumPyArray(in_network, read_fields)
+    segid_array = np.asarray(network_array["ReachID"], np.int64)
+    riparian_columns = [np.asarray(network_array[field], np.float64) for field in riparian_fields]
+    streamside_columns = [np.asarray(network_array[field], np.float64) for field in streamside_fields]
+
+    # check that inputs are within range of fis
+    # if not, re-assign the value to just within range
+    for column in riparian_columns + streamside_columns:
+        column[column < 0] = 0
+        column[column > 4] = 4
+
+    # in an incremental run, fingerprint the inputs of each reach with the model and engine, and only run the FIS
+    # where they have changed
+    model_key = Batch_FIS.definition_hash(veg_definition) + ":" + fis_engine
+    if fis_engine == 'lut':
+        model_key += ":" + str(lut_grid_size)
+    fingerprints = None
+    if incremental:
+        fingerprints = Batch_FIS.reach_fingerprints(riparian_columns + streamside_columns, model_key)
+    elif fingerprint_field in fields:
+        # fingerprints left by an earlier incremental run won't match the outputs written now
+        arcpy.DeleteField_management(in_network, fingerprint_field)
+    if reuse_outputs:
+        changed = fingerprints != network_array[fingerprint_field].astype(fingerprints.dtype)
+        arcpy.AddMessage(str(np.count_nonzero(changed)) + " of " + str(len(changed)) +
+                         " reaches have changed since the last run")
+    else:
+        changed = np.ones(len(segid_array), dtype=bool)
+    del network_array
+
+    if not changed.any():
+        makeLayers(in_network)
+        return
+
+    # stack the potential reaches on top of the existing reaches so both runs are evaluated together
+    riparian_array = np.concatenate([column[changed] for column in riparian_columns])
+    streamside_array = np.concatenate([column[changed] for column in streamside_columns])
+
+    # run fuzzy inference system on inputs and defuzzify output
+    fis_inputs = [riparian_array, streamside_array]
+    out = vegFIS(fis_inputs, veg_definition, model_file, fis_engine, tolerance, lut_grid_size, workers)
+
+    # report how far the breakpoint memberships the batch engines use are from memberships sampled like skfuzzy's
+    if validate_membership:
+        report = Batch_FIS.load_model(model_file).validate_membership(fis_inputs, zero_term='none')
+        arcpy.AddMessage("Membership validation over " + str(report['checked']) + " reaches: max membership " +
+                         "deviation " + str(max(report['max_membership_deviation'].values())) +
+                         ", max output deviation " + str(report['max_output_deviation']))
+
+    # the batch and lut engines already set reaches that only fire the density 'none' rules to 0
+    if fis_engine not in ['batch', 'lut']:
         # calculate defuzzified centroid value for density 'none' MF group
         # this will be used to re-classify output values that fall in this group
         # important: will need to update the array (x) and MF values (mfx) if the
@@ -163,27 +110,74 @@ def main(in_network):
         mfx = fuzz.trimf(x, [0, 0, 0.1])
         defuzz_centroid = round(fuzz.defuzz(x, mfx, 'centroid'), 6)
 
-        # update vegetation capacity (ovc_*) values in stream network
         # set ovc_* to 0 if output falls fully in 'none' category
+        out[np.round(out, 6) == defuzz_centroid] = 0.0
 
-        with arcpy.da.UpdateCursor(in_network, [out_field]) as cursor:
-            for row in cursor:
-                if round(row[0], 6) == defuzz_centroid:
-                    row[0] = 0.0
-                cursor.updateRow(row)
+    # write oVC_PT and oVC_EX back to the network in a single sweep, leaving unchanged reaches as they are
+    out_columns = out.reshape(len(out_fields), np.count_nonzero(changed))
+    field_arrays = list(zip(out_fields, out_columns))
+    if incremental:
+        field_arrays.append((fingerprint_field, fingerprints[changed], 'TEXT'))
+    write_arrays_to_fields(in_network, segid_array[changed], field_arrays, replace_fields=not reuse_outputs)
 
-        # delete temporary tables and arrays
-        arcpy.Delete_management(out_table)
-        arcpy.Delete_management(ovc_table)
-        items = [columns, out, x, mfx, defuzz_centroid]
-        for item in items:
-            del item
+    makeLayers(in_network)
 
-    # run the combined fis function for both potential and existing
-    vegFIS('pt')
-    vegFIS('ex')
 
-    makeLayers(in_network)
+def vegFIS(fis_inputs, veg_definition, model_file, fis_engine='skfuzzy', tolerance=None, lut_grid_size=None,
+           workers=None):
+    """
+    Runs the vegetation capacity FIS on every reach in the inputs
+    :param fis_inputs: List with the riparian (100 m) and streamside (30 m) vegetation arrays
+    :param veg_definition: The FIS definition read from the model file
+    :param model_file: Path to the model file, used to find the compiled model in the cache
+    :param fis_engine: 'skfuzzy', 'batch' or 'lut'
+    :param tolerance: If given, fail when the batch or lut output is further than this from the exact value
+    :param lut_grid_size: Number of points along each axis of the lookup table
+    :param workers: Number of processes to split the reaches across
+    :return: Array of vegetation capacity values
+    """
+    if workers is not None and int(workers) > 1 and fis_engine in ['batch', 'skfuzzy']:
+        arcpy.AddMessage("Running vegetation FIS in " + str(workers) + " processes...")
+        zero_term = 'none' if fis_engine == 'batch' else None
+        out = Batch_FIS.evaluate_in_pool(veg_definition, fis_inputs, int(workers), fis_engine, zero_term)
+        # spot check the pooled batch output against skfuzzy if the user gave a tolerance, as a single process run does
+        if fis_engine == 'batch' and tolerance is not None:
+            max_difference = Batch_FIS.compare_with_simulation(Batch_FIS.load_model(model_file),
+                                                               Batch_FIS.build_simulation(veg_definition),
+                                                               fis_inputs, out, float(tolerance), sample_size=1000)
+            arcpy.AddMessage("Batch vegetation capacity values are within " + str(max_difference) + " of skfuzzy")
+    elif fis_engine == 'batch':
+        batch_model = Batch_FIS.load_model(model_file)
+        out = batch_model.evaluate(fis_inputs, zero_term='none')
+        # spot check the batch output against skfuzzy if the user gave a tolerance
+        if tolerance is not None:
+            max_difference = Batch_FIS.compare_with_simulation(batch_model, Batch_FIS.build_simulation(veg_definition),
+                                                               fis_inputs, out, float(tolerance), sample_size=1000)
+            arcpy.AddMessage("Batch vegetation capacity values are within " + str(max_difference) + " of skfuzzy")
+    elif fis_engine == 'lut':
+        if lut_grid_size is None:
+            lut_grid_size = Batch_FIS.DEFAULT_LUT_GRID_SIZE
+        lookup_table = Batch_FIS.FISLookupTable(Batch_FIS.load_model(model_file), int(lut_grid_size),
+                                                zero_term='none')
+        out = lookup_table.evaluate(fis_inputs)
+        # report how far the interpolated surface is from exact evaluation
+        report = lookup_table.error_report(fis_inputs, out, sample_size=1000)
+        arcpy.AddMessage("Lookup table vegetation capacity error over " + str(report['checked']) + " reaches: max " +
+                         str(report['max_error']) + ", mean " + str(report['mean_error']))
+        if tolerance is not None and report['max_error'] > float(tolerance):
+            raise Batch_FIS.FISValidationError("Lookup table output differs from exact evaluation by up to " +
+                                               str(report['max_error']) + ", which is more than the tolerance of " +
+                                               str(tolerance))
+    else:
+        veg_fis = Batch_FIS.build_simulation(veg_definition)
+        out = np.zeros(len(fis_inputs[0]))
+        for i in range(len(out)):
+            for variable, values in zip(veg_definition['inputs'], fis_inputs):
+                veg_fis.input[variable[0]] = values[i]
+            veg_fis.compute()
+            out[i] = veg_fis.output[veg_definition['output'][0]]
+
+    return out
 
 
 def makeLayers(inputNetwork):
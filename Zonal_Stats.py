@@ -0,0 +1,644 @@
+# -------------------------------------------------------------------------------
+# Name:        Zonal Stats
+# Purpose:     Finds raster statistics within the reach buffers with NumPy, so that
+#              overlapping buffers can all be summarized in one sweep over the raster
+#
+# Created:     10/2026
+# -------------------------------------------------------------------------------
+
+import numpy as np
+import os
+import hashlib
+import tempfile
+import Tiled_Raster
+import Crossing_Index
+
+# where buffer coverages are saved so each buffer layer is only rasterized once per raster grid
+DEFAULT_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), 'BRAT_Coverage_Cache')
+
+# number of candidate cells checked at once when finding the cells around points or lines
+DEFAULT_CHUNK_CELLS = 4000000
+
+# statistic names used by arcpy.sa.ZonalStatisticsAsTable, and the table field each one is written to
+STATISTIC_FIELDS = {'MINIMUM': 'MIN', 'MAXIMUM': 'MAX', 'MEAN': 'MEAN'}
+
+
+class RasterGrid(object):
+    """
+    The position and size of a raster's cells, which buffer polygons are rasterized onto
+    """
+    def __init__(self, x_min, y_max, cell_width, cell_height, rows, cols):
+        """
+        :param x_min: X coordinate of the left edge of the raster
+        :param y_max: Y coordinate of the top edge of the raster
+        :param cell_width: Width of each cell
+        :param cell_height: Height of each cell, as a positive number
+        :param rows: Number of rows in the raster
+        :param cols: Number of columns in the raster
+        """
+        self.x_min = float(x_min)
+        self.y_max = float(y_max)
+        self.cell_width = float(cell_width)
+        self.cell_height = abs(float(cell_height))
+        self.rows = int(rows)
+        self.cols = int(cols)
+
+    @classmethod
+    def from_geotransform(cls, geotransform, rows, cols):
+        """
+        Makes a grid from a GDAL geotransform. Rotated rasters are not supported
+        :param geotransform: The six geotransform coefficients of the raster
+        :param rows: Number of rows in the raster
+        :param cols: Number of columns in the raster
+        :return: RasterGrid
+        """
+        if geotransform[2] != 0 or geotransform[4] != 0:
+            raise Exception("Rotated rasters are not supported by the NumPy zonal statistics engine")
+        return cls(geotransform[0], geotransform[3], geotransform[1], geotransform[5], rows, cols)
+
+    def key(self):
+        """
+        :return: Tuple that is the same for any two grids with the same cells
+        """
+        return (self.x_min, self.y_max, self.cell_width, self.cell_height, self.rows, self.cols)
+
+    def disk_offsets(self, radius):
+        """
+        Finds the row and column offsets, from the cell a point is in, of every cell whose center could be within a
+        radius of the point, wherever the point is in its cell
+        :param radius: Radius of the disk, in the units of the grid
+        :return: Tuple of arrays of row offsets and column offsets
+        """
+        reach_rows = int(np.ceil(radius / self.cell_height)) + 1
+        reach_cols = int(np.ceil(radius / self.cell_width)) + 1
+        row_offsets, col_offsets = np.mgrid[-reach_rows:reach_rows + 1, -reach_cols:reach_cols + 1]
+        row_offsets = row_offsets.ravel()
+        col_offsets = col_offsets.ravel()
+        # the closest a cell center can be to a point in the middle cell is half a cell less than the centers' distance
+        gap_y = np.maximum(np.abs(row_offsets) - 0.5, 0) * self.cell_height
+        gap_x = np.maximum(np.abs(col_offsets) - 0.5, 0) * self.cell_width
+        possible = gap_x * gap_x + gap_y * gap_y <= radius * radius
+        return row_offsets[possible], col_offsets[possible]
+
+    def disk_cells(self, x, y, radius, row_offsets=None, col_offsets=None):
+        """
+        Finds the cells whose centers are within a radius of each of a set of points, the cells ZonalStatisticsAsTable
+        uses for a buffer of that radius around each point, without making the buffers
+        :param x: Array of the X coordinates of the points
+        :param y: Array of the Y coordinates of the points
+        :param radius: Radius of the disk, in the units of the grid
+        :param row_offsets: Row offsets from disk_offsets, if they have already been found
+        :param col_offsets: Column offsets from disk_offsets, if they have already been found
+        :return: Tuple of the flat cell indices covered by the points, with each point's cells together, and the number
+        of cells covered by each point
+        """
+        if row_offsets is None or col_offsets is None:
+            row_offsets, col_offsets = self.disk_offsets(radius)
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        center_rows = np.floor((self.y_max - y) / self.cell_height).astype(np.int64)
+        center_cols = np.floor((x - self.x_min) / self.cell_width).astype(np.int64)
+        rows = center_rows[:, np.newaxis] + row_offsets[np.newaxis, :]
+        cols = center_cols[:, np.newaxis] + col_offsets[np.newaxis, :]
+        distance_x = self.x_min + (cols + 0.5) * self.cell_width - x[:, np.newaxis]
+        distance_y = self.y_max - (rows + 0.5) * self.cell_height - y[:, np.newaxis]
+        inside = (distance_x * distance_x + distance_y * distance_y <= radius * radius) & (rows >= 0) & \
+            (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return (rows * self.cols + cols)[inside], inside.sum(axis=1)
+
+    def polygon_cells(self, rings):
+        """
+        Finds the cells whose centers fall inside a polygon, the same cells ZonalStatisticsAsTable uses for it
+        :param rings: List of (n, 2) arrays of x, y vertices, one per ring. Holes are found with the even-odd rule, so
+        rings can be given in any order and direction
+        :return: Array of flat cell indices (row * cols + col) inside the polygon
+        """
+        starts = []
+        ends = []
+        for ring in rings:
+            ring = np.asarray(ring, np.float64)
+            if len(ring) < 3:
+                continue
+            starts.append(ring)
+            ends.append(np.roll(ring, -1, axis=0))
+        if not starts:
+            return np.zeros(0, np.int64)
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+
+        # rows of cells whose centers are between the top and bottom of the polygon
+        y_all = starts[:, 1]
+        first_row = max(int(np.floor((self.y_max - y_all.max()) / self.cell_height - 0.5)), 0)
+        last_row = min(int(np.ceil((self.y_max - y_all.min()) / self.cell_height - 0.5)), self.rows - 1)
+        if last_row < first_row:
+            return np.zeros(0, np.int64)
+        row_numbers = np.arange(first_row, last_row + 1)
+        row_y = self.y_max - (row_numbers + 0.5) * self.cell_height
+
+        # where each edge crosses the center line of each row. An edge counts a crossing at its lower end but not its
+        # upper end, so a vertex on the center line is only counted once
+        y0 = starts[:, 1][:, np.newaxis]
+        y1 = ends[:, 1][:, np.newaxis]
+        crosses = ((y0 <= row_y) & (row_y < y1)) | ((y1 <= row_y) & (row_y < y0))
+        edge_index, row_index = np.nonzero(crosses)
+        if len(edge_index) == 0:
+            return np.zeros(0, np.int64)
+        x0 = starts[edge_index, 0]
+        x1 = ends[edge_index, 0]
+        ya = starts[edge_index, 1]
+        yb = ends[edge_index, 1]
+        crossing_x = x0 + (row_y[row_index] - ya) * (x1 - x0) / (yb - ya)
+
+        # each row has an even number of crossings, and the cells inside the polygon lie between every other pair
+        order = np.lexsort((crossing_x, row_index))
+        crossing_x = crossing_x[order]
+        row_index = row_index[order]
+        left = crossing_x[0::2]
+        right = crossing_x[1::2]
+        span_rows = row_numbers[row_index[0::2]]
+
+        # a cell is inside a span if its center is at or right of the left crossing and left of the right crossing
+        first_col = np.clip(np.ceil((left - self.x_min) / self.cell_width - 0.5), 0, self.cols).astype(np.int64)
+        end_col = np.clip(np.ceil((right - self.x_min) / self.cell_width - 0.5), 0, self.cols).astype(np.int64)
+        lengths = np.maximum(end_col - first_col, 0)
+        total = lengths.sum()
+        if total == 0:
+            return np.zeros(0, np.int64)
+
+        # expand the spans into cell indices without a Python loop over the spans
+        span_starts = span_rows * self.cols + first_col
+        offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(span_starts, lengths) + offsets
+
+
+class BufferCoverage(object):
+    """
+    The cells covered by each reach buffer on a raster grid. Every buffer keeps its own cells, so buffers that overlap
+    each other are all summarized correctly. A cell is either in a buffer or not, so every cell has the same weight
+    and no weights are stored
+    """
+    def __init__(self, reach_ids, cell_indices, zone_starts):
+        """
+        :param reach_ids: Array of the ReachID of each buffer
+        :param cell_indices: Flat cell indices covered by the buffers, with each buffer's cells together and in the
+        same order as reach_ids
+        :param zone_starts: Position in cell_indices where each buffer's cells start, with one more entry at the end
+        """
+        self.reach_ids = np.asarray(reach_ids, np.int64)
+        self.cell_indices = np.asarray(cell_indices, np.int64)
+        self.zone_starts = np.asarray(zone_starts, np.int64)
+
+    @classmethod
+    def from_polygons(cls, reach_ids, polygons, grid):
+        """
+        Rasterizes the buffer polygons onto a grid
+        :param reach_ids: The ReachID of each buffer
+        :param polygons: List with the rings of each buffer, as taken by RasterGrid.polygon_cells
+        :param grid: The RasterGrid of the raster the statistics will be found for
+        :return: BufferCoverage
+        """
+        cells = [grid.polygon_cells(rings) for rings in polygons]
+        counts = np.array([len(cell) for cell in cells], np.int64)
+        zone_starts = np.concatenate([[0], np.cumsum(counts)])
+        cell_indices = np.concatenate(cells) if cells else np.zeros(0, np.int64)
+        return cls(reach_ids, cell_indices, zone_starts)
+
+    @classmethod
+    def from_points(cls, reach_ids, x, y, radius, grid, chunk_cells=DEFAULT_CHUNK_CELLS):
+        """
+        Finds the cells within a radius of each point on a grid, as if each point had been buffered and rasterized.
+        The same cell offsets are used for every point, and the points are done a chunk at a time to bound memory
+        :param reach_ids: The ReachID of each point
+        :param x: Array of the X coordinates of the points
+        :param y: Array of the Y coordinates of the points
+        :param radius: Radius around each point, in the units of the grid
+        :param grid: The RasterGrid of the raster the statistics will be found for
+        :param chunk_cells: Number of candidate cells checked at once
+        :return: BufferCoverage
+        """
+        row_offsets, col_offsets = grid.disk_offsets(radius)
+        chunk_points = max(int(chunk_cells) // max(len(row_offsets), 1), 1)
+        cells = []
+        counts = []
+        for start in range(0, len(x), chunk_points):
+            chunk_cell_indices, chunk_counts = grid.disk_cells(x[start:start + chunk_points],
+                                                               y[start:start + chunk_points], radius,
+                                                               row_offsets, col_offsets)
+            cells.append(chunk_cell_indices)
+            counts.append(chunk_counts)
+        counts = np.concatenate(counts) if counts else np.zeros(0, np.int64)
+        zone_starts = np.concatenate([[0], np.cumsum(counts)])
+        cell_indices = np.concatenate(cells) if cells else np.zeros(0, np.int64)
+        return cls(reach_ids, cell_indices, zone_starts)
+
+    @classmethod
+    def from_lines(cls, reach_ids, lines, radius, grid, chunk_cells=DEFAULT_CHUNK_CELLS):
+        """
+        Finds the cells within a radius of each line on a grid, as if each line had been buffered with round ends and
+        rasterized. Segments are cut into pieces no longer than the buffer is wide, so the box of candidate cells
+        around each piece stays close to the buffer, and the pieces are done a chunk at a time to bound memory
+        :param reach_ids: The ReachID of each line
+        :param lines: List with the parts of each line, each part a list of x, y vertices
+        :param radius: Buffer distance around each line, in the units of the grid
+        :param grid: The RasterGrid of the raster the statistics will be found for
+        :param chunk_cells: Number of candidate cells checked at once
+        :return: BufferCoverage
+        """
+        starts, ends, line_numbers = Crossing_Index.polyline_segments(lines)[:3]
+        num_cells = grid.rows * grid.cols
+
+        # cut each segment into pieces of equal length
+        piece_length = 2 * radius + max(grid.cell_width, grid.cell_height)
+        lengths = np.hypot(ends[:, 0] - starts[:, 0], ends[:, 1] - starts[:, 1])
+        pieces = np.maximum(np.ceil(lengths / piece_length), 1).astype(np.int64)
+        segments = np.repeat(np.arange(len(pieces)), pieces)
+        steps = (np.arange(len(segments)) - np.repeat(np.cumsum(pieces) - pieces, pieces)).astype(np.float64)
+        directions = (ends - starts)[segments]
+        piece_starts = starts[segments] + (steps / pieces[segments])[:, np.newaxis] * directions
+        piece_ends = starts[segments] + ((steps + 1) / pieces[segments])[:, np.newaxis] * directions
+        piece_lines = line_numbers[segments]
+
+        # the rows and columns of the cells whose centers are in the box around each piece
+        min_x = np.minimum(piece_starts[:, 0], piece_ends[:, 0]) - radius
+        max_x = np.maximum(piece_starts[:, 0], piece_ends[:, 0]) + radius
+        min_y = np.minimum(piece_starts[:, 1], piece_ends[:, 1]) - radius
+        max_y = np.maximum(piece_starts[:, 1], piece_ends[:, 1]) + radius
+        first_cols = np.clip(np.ceil((min_x - grid.x_min) / grid.cell_width - 0.5), 0, grid.cols).astype(np.int64)
+        end_cols = np.clip(np.floor((max_x - grid.x_min) / grid.cell_width - 0.5) + 1, 0, grid.cols).astype(np.int64)
+        first_rows = np.clip(np.ceil((grid.y_max - max_y) / grid.cell_height - 0.5), 0, grid.rows).astype(np.int64)
+        end_rows = np.clip(np.floor((grid.y_max - min_y) / grid.cell_height - 0.5) + 1, 0,
+                           grid.rows).astype(np.int64)
+        num_cols = np.maximum(end_cols - first_cols, 0)
+        counts = np.maximum(end_rows - first_rows, 0) * num_cols
+
+        # keep the candidate cells whose centers are within the radius of their piece, numbered by line then cell so
+        # the cells a line's pieces share are only kept once
+        keys = []
+        cumulative_counts = np.cumsum(counts)
+        first = 0
+        while first < len(counts):
+            done = cumulative_counts[first] - counts[first]
+            last = max(int(np.searchsorted(cumulative_counts, done + chunk_cells, side='right')), first + 1)
+            chunk_counts = counts[first:last]
+            chunk_pieces = np.repeat(np.arange(first, last), chunk_counts)
+            offsets = np.arange(chunk_counts.sum()) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            rows = first_rows[chunk_pieces] + offsets // np.maximum(num_cols[chunk_pieces], 1)
+            cols = first_cols[chunk_pieces] + offsets % np.maximum(num_cols[chunk_pieces], 1)
+
+            offset_x = grid.x_min + (cols + 0.5) * grid.cell_width - piece_starts[chunk_pieces, 0]
+            offset_y = grid.y_max - (rows + 0.5) * grid.cell_height - piece_starts[chunk_pieces, 1]
+            dx = piece_ends[chunk_pieces, 0] - piece_starts[chunk_pieces, 0]
+            dy = piece_ends[chunk_pieces, 1] - piece_starts[chunk_pieces, 1]
+            squared_lengths = dx * dx + dy * dy
+            safe_lengths = np.where(squared_lengths > 0, squared_lengths, 1.0)
+            along = np.clip((offset_x * dx + offset_y * dy) / safe_lengths, 0, 1)
+            distance_x = offset_x - along * dx
+            distance_y = offset_y - along * dy
+            inside = distance_x * distance_x + distance_y * distance_y <= radius * radius
+            keys.append(np.unique(piece_lines[chunk_pieces[inside]] * num_cells + (rows * grid.cols + cols)[inside]))
+            first = last
+
+        keys = np.unique(np.concatenate(keys)) if keys else np.zeros(0, np.int64)
+        counts = np.bincount(keys // num_cells, minlength=len(lines)) if num_cells else np.zeros(len(lines), np.int64)
+        zone_starts = np.concatenate([[0], np.cumsum(counts)])
+        cell_indices = keys % num_cells if num_cells else keys
+        return cls(reach_ids, cell_indices, zone_starts)
+
+    @classmethod
+    def load(cls, coverage_file):
+        """
+        Reads a coverage saved with save
+        :param coverage_file: Path to the .npz file
+        :return: BufferCoverage
+        """
+        arrays = np.load(coverage_file)
+        return cls(arrays['reach_ids'], arrays['cell_indices'], arrays['zone_starts'])
+
+    def save(self, coverage_file):
+        """
+        Saves the coverage so later runs can reuse it
+        :param coverage_file: Path to the .npz file
+        :return:
+        """
+        np.savez(coverage_file, reach_ids=self.reach_ids, cell_indices=self.cell_indices, zone_starts=self.zone_starts)
+
+    def zone_numbers(self):
+        """
+        :return: Array giving the position in reach_ids of the buffer each covered cell belongs to
+        """
+        counts = np.diff(self.zone_starts)
+        return np.repeat(np.arange(len(counts)), counts)
+
+
+def polygons_hash(reach_ids, polygons):
+    """
+    Identifies a set of buffer polygons by their ReachIDs and vertices, so a coverage is reused only for the same buffers
+    :param reach_ids: The ReachID of each buffer
+    :param polygons: List with the rings of each buffer
+    :return: Hex digest string
+    """
+    digest = hashlib.sha1(np.asarray(reach_ids, np.int64).tobytes())
+    for rings in polygons:
+        digest.update(str(len(rings)).encode('utf-8'))
+        for ring in rings:
+            ring = np.ascontiguousarray(ring, np.float64)
+            digest.update(str(len(ring)).encode('utf-8'))
+            digest.update(ring.tobytes())
+    return digest.hexdigest()
+
+
+def load_coverage(reach_ids, polygons, grid, cache_folder=DEFAULT_CACHE_FOLDER):
+    """
+    Gets the coverage of the buffers on a grid, rasterizing them only if the same buffers haven't been rasterized onto
+    the same grid before. Every raster on that grid can then be summarized with just a gather and reduce
+    :param reach_ids: The ReachID of each buffer
+    :param polygons: List with the rings of each buffer, as taken by RasterGrid.polygon_cells
+    :param grid: The RasterGrid of the raster the statistics will be found for
+    :param cache_folder: Where to look for and save coverages. If None, the coverage isn't cached
+    :return: BufferCoverage
+    """
+    if cache_folder is None:
+        return BufferCoverage.from_polygons(reach_ids, polygons, grid)
+
+    key = hashlib.sha1((polygons_hash(reach_ids, polygons) + repr(grid.key())).encode('utf-8')).hexdigest()
+    cache_file = os.path.join(cache_folder, "Coverage_" + key + ".npz")
+    if os.path.exists(cache_file):
+        return BufferCoverage.load(cache_file)
+
+    coverage = BufferCoverage.from_polygons(reach_ids, polygons, grid)
+    if not os.path.exists(cache_folder):
+        try:
+            os.makedirs(cache_folder)
+        except OSError:
+            # another process made it first
+            pass
+    # save under a name of this process's own first, so a process running at the same time never reads half a file
+    partial_file = os.path.join(cache_folder, "Partial_" + str(os.getpid()) + "_" + os.path.basename(cache_file))
+    coverage.save(partial_file)
+    try:
+        os.rename(partial_file, cache_file)
+    except OSError:
+        # another process saved the same coverage first
+        os.remove(partial_file)
+    return coverage
+
+
+class ArrayRasterSource(object):
+    """
+    Raster values that are already in memory, read through the same interface as a Tiled_Raster.TiledRaster
+    """
+    def __init__(self, values, nodata=None):
+        """
+        :param values: 2D array of raster values
+        :param nodata: The NoData value of the raster
+        """
+        self.values = np.asarray(values)
+        self.nodata = nodata
+        self.shape = self.values.shape
+
+    def read_window(self, first_row, first_col, num_rows, num_cols):
+        """
+        :param first_row: The first row of the window
+        :param first_col: The first column of the window
+        :param num_rows: The number of rows in the window
+        :param num_cols: The number of columns in the window
+        :return: 2D array of the window
+        """
+        return self.values[first_row:first_row + num_rows, first_col:first_col + num_cols]
+
+
+def coverage_blocks(coverage, shape, block_size=Tiled_Raster.DEFAULT_BLOCK_SIZE):
+    """
+    Goes through the blocks of a raster that have covered cells in them
+    :param coverage: BufferCoverage of the buffers
+    :param shape: (rows, cols) shape of the raster
+    :param block_size: Number of rows and columns in each block
+    :return: Generator of (first row, first column, number of rows, number of columns, window cells, window zones)
+    tuples. The window cells are flat indices into the block of each covered cell in it, and the window zones are the
+    position in reach_ids of the buffer each one belongs to. Each buffer's cells in the block are together
+    """
+    rows, cols = shape
+    # put the covered cells in block order. The sort is stable, so cells stay grouped by buffer within each block
+    block_size = max(int(block_size), 1)
+    num_block_cols = (cols + block_size - 1) // block_size
+    num_blocks = ((rows + block_size - 1) // block_size) * num_block_cols
+    zones = coverage.zone_numbers()
+    cell_indices = coverage.cell_indices
+    blocks = (cell_indices // cols // block_size) * num_block_cols + (cell_indices % cols) // block_size
+    if num_blocks > 1:
+        order = np.argsort(blocks, kind='mergesort')
+        cell_indices = cell_indices[order]
+        zones = zones[order]
+        blocks = blocks[order]
+    block_bounds = np.searchsorted(blocks, np.arange(num_blocks + 1))
+
+    for block in range(num_blocks):
+        low, high = block_bounds[block], block_bounds[block + 1]
+        if low == high:
+            continue
+        first_row = (block // num_block_cols) * block_size
+        first_col = (block % num_block_cols) * block_size
+        num_rows = min(block_size, rows - first_row)
+        num_cols = min(block_size, cols - first_col)
+        window_cells = (cell_indices[low:high] // cols - first_row) * num_cols + cell_indices[low:high] % cols - first_col
+        yield first_row, first_col, num_rows, num_cols, window_cells, zones[low:high]
+
+
+def fused_zonal_statistics(coverage, jobs, block_size=Tiled_Raster.DEFAULT_BLOCK_SIZE):
+    """
+    Finds any number of statistics of any number of rasters within the same buffers in one pass. The rasters are read
+    together a block at a time, and each block's covered cells update every job before the next block is read. Blocks
+    without any covered cells are never read. Like ZonalStatisticsAsTable with the 'DATA' option, NoData cells are
+    left out
+    :param coverage: BufferCoverage of the buffers, built on the grid all of the rasters share
+    :param jobs: List of (source, statistic) tuples. A source has a nodata attribute, a (rows, cols) shape and a
+    read_window(first_row, first_col, num_rows, num_cols) method, like Tiled_Raster.TiledRaster. Jobs that share a
+    source only read it once
+    :param block_size: Number of rows and columns read at once
+    :return: List with an array of values for each job, one per buffer. Buffers without any cells with data are NaN
+    """
+    if not jobs:
+        return []
+    for source, stat_type in jobs:
+        if stat_type not in STATISTIC_FIELDS:
+            raise Exception("Unknown zonal statistic " + str(stat_type) + ", expected one of " +
+                            ", ".join(sorted(STATISTIC_FIELDS)))
+    rows, cols = jobs[0][0].shape
+    for source, stat_type in jobs:
+        if tuple(source.shape) != (rows, cols):
+            raise Exception("All rasters in a fused zonal statistics pass must be on the same grid")
+
+    # group the jobs by source, keeping the order the sources were first given in
+    sources = []
+    source_jobs = []
+    for job_number, (source, stat_type) in enumerate(jobs):
+        for i, known_source in enumerate(sources):
+            if known_source is source:
+                source_jobs[i].append(job_number)
+                break
+        else:
+            sources.append(source)
+            source_jobs.append([job_number])
+
+    num_zones = len(coverage.reach_ids)
+    counts = [np.zeros(num_zones, np.int64) for source in sources]
+    sums = [np.zeros(num_zones) for source in sources]
+    minimums = [np.full(num_zones, np.inf) for source in sources]
+    maximums = [np.full(num_zones, -np.inf) for source in sources]
+    for first_row, first_col, num_rows, num_cols, window_cells, window_zones in coverage_blocks(coverage, (rows, cols),
+                                                                                               block_size):
+        for i, source in enumerate(sources):
+            cell_values = np.asarray(source.read_window(first_row, first_col, num_rows, num_cols),
+                                     np.float64).ravel()[window_cells]
+            has_data = ~np.isnan(cell_values)
+            if source.nodata is not None:
+                has_data &= cell_values != float(source.nodata)
+            cell_values = cell_values[has_data]
+            cell_zones = window_zones[has_data]
+            if len(cell_values) == 0:
+                continue
+
+            counts[i] += np.bincount(cell_zones, minlength=num_zones)
+            stat_types = [jobs[job_number][1] for job_number in source_jobs[i]]
+            if 'MEAN' in stat_types:
+                sums[i] += np.bincount(cell_zones, weights=cell_values, minlength=num_zones)
+            if 'MINIMUM' in stat_types or 'MAXIMUM' in stat_types:
+                # each buffer's cells in the block are together, so each one is reduced in one go
+                group_starts = np.flatnonzero(np.concatenate([[True], cell_zones[1:] != cell_zones[:-1]]))
+                group_zones = cell_zones[group_starts]
+                if 'MINIMUM' in stat_types:
+                    minimums[i][group_zones] = np.minimum(minimums[i][group_zones],
+                                                          np.minimum.reduceat(cell_values, group_starts))
+                if 'MAXIMUM' in stat_types:
+                    maximums[i][group_zones] = np.maximum(maximums[i][group_zones],
+                                                          np.maximum.reduceat(cell_values, group_starts))
+
+    results = [None] * len(jobs)
+    for i in range(len(sources)):
+        occupied = counts[i] > 0
+        for job_number in source_jobs[i]:
+            stat_type = jobs[job_number][1]
+            stat = np.full(num_zones, np.nan)
+            if stat_type == 'MINIMUM':
+                stat[occupied] = minimums[i][occupied]
+            elif stat_type == 'MAXIMUM':
+                stat[occupied] = maximums[i][occupied]
+            else:
+                stat[occupied] = sums[i][occupied] / counts[i][occupied]
+            results[job_number] = stat
+    return results
+
+
+def zonal_histogram(coverage, source, class_values, block_size=Tiled_Raster.DEFAULT_BLOCK_SIZE):
+    """
+    Counts the cells of each value of a categorical raster within each buffer, in one pass over the raster. Cells
+    with values that aren't in class_values, including NoData, aren't counted
+    :param coverage: BufferCoverage of the buffers, built on the raster's grid
+    :param source: The raster, with a (rows, cols) shape and a read_window method, like Tiled_Raster.TiledRaster
+    :param class_values: The raster values to count
+    :param block_size: Number of rows and columns read at once
+    :return: (number of buffers, number of class values) array of cell counts
+    """
+    class_values = np.asarray(class_values, np.float64)
+    num_zones = len(coverage.reach_ids)
+    num_classes = len(class_values)
+    class_order = np.argsort(class_values)
+    sorted_values = class_values[class_order]
+    counts = np.zeros(num_zones * num_classes, np.int64)
+    if num_classes == 0:
+        return counts.reshape(num_zones, num_classes)
+
+    for first_row, first_col, num_rows, num_cols, window_cells, window_zones in coverage_blocks(coverage, source.shape,
+                                                                                               block_size):
+        cell_values = np.asarray(source.read_window(first_row, first_col, num_rows, num_cols),
+                                 np.float64).ravel()[window_cells]
+        positions = np.minimum(np.searchsorted(sorted_values, cell_values), num_classes - 1)
+        known = sorted_values[positions] == cell_values
+        # count every buffer and class pair at once
+        pairs = window_zones[known] * num_classes + class_order[positions[known]]
+        counts += np.bincount(pairs, minlength=num_zones * num_classes)
+    return counts.reshape(num_zones, num_classes)
+
+
+def zonal_statistics(values, coverage, stat_types, nodata=None):
+    """
+    Finds statistics of a raster that is already in memory within each buffer
+    :param values: 2D array of raster values on the grid the coverage was built for
+    :param coverage: BufferCoverage of the buffers
+    :param stat_types: List of statistics to find, from 'MINIMUM', 'MAXIMUM' and 'MEAN'
+    :param nodata: The NoData value of the raster. NaN cells are always treated as NoData
+    :return: Dictionary of statistic name to an array with the value for each buffer. Buffers without any cells with
+    data are NaN
+    """
+    source = ArrayRasterSource(values, nodata)
+    stats = fused_zonal_statistics(coverage, [(source, stat_type) for stat_type in stat_types], max(source.shape))
+    return dict(zip(stat_types, stats))
+
+
+def read_buffer_polygons(buffer_path, key_field='ReachID'):
+    """
+    Reads the rings of each buffer polygon with OGR
+    :param buffer_path: Path to the buffer polygons, as any vector file OGR can open
+    :param key_field: The field identifying the reach of each buffer
+    :return: Tuple of the reach ID array and a list with the rings of each buffer
+    """
+    from osgeo import ogr
+    data_source = ogr.Open(buffer_path)
+    if data_source is None:
+        raise Exception("Could not open buffer polygons " + str(buffer_path))
+    layer = data_source.GetLayer()
+    reach_ids = []
+    polygons = []
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        rings = []
+        if geometry is not None:
+            # split multipolygons into their polygons, and polygons into their rings
+            parts = [geometry.GetGeometryRef(i) for i in range(geometry.GetGeometryCount())]
+            if geometry.GetGeometryName() == 'POLYGON':
+                parts = [geometry]
+            for part in parts:
+                for i in range(part.GetGeometryCount()):
+                    rings.append(np.array(part.GetGeometryRef(i).GetPoints(), np.float64)[:, :2])
+        reach_ids.append(feature.GetField(key_field))
+        polygons.append(rings)
+    data_source = None
+    return np.array(reach_ids, np.int64), polygons
+
+
+def zonal_statistics_from_files(buffer_path, jobs, key_field='ReachID', cache_folder=DEFAULT_CACHE_FOLDER,
+                                block_size=Tiled_Raster.DEFAULT_BLOCK_SIZE):
+    """
+    Finds raster statistics within each buffer straight from files, without ArcGIS. Rasters on the same grid are
+    streamed together in one pass, a block at a time, so they never have to fit in memory
+    :param buffer_path: Path to the buffer polygons
+    :param jobs: List of (raster path, statistic) tuples, with statistics from 'MINIMUM', 'MAXIMUM' and 'MEAN'
+    :param key_field: The field identifying the reach of each buffer
+    :param cache_folder: Where to look for and save buffer coverages. If None, the coverage isn't cached
+    :param block_size: Number of rows and columns read at once
+    :return: Tuple of the reach ID array and a list with an array of values for each job
+    """
+    reach_ids, polygons = read_buffer_polygons(buffer_path, key_field)
+    sources = {}
+    grids = {}
+    for raster_path, stat_type in jobs:
+        if raster_path not in sources:
+            sources[raster_path] = Tiled_Raster.TiledRaster(raster_path, block_size, cache_blocks=1)
+            grids[raster_path] = RasterGrid.from_geotransform(sources[raster_path].geotransform,
+                                                              sources[raster_path].rows, sources[raster_path].cols)
+
+    # one pass for each grid the rasters are on
+    results = [None] * len(jobs)
+    grid_keys = []
+    for raster_path, stat_type in jobs:
+        if grids[raster_path].key() not in grid_keys:
+            grid_keys.append(grids[raster_path].key())
+    for grid_key in grid_keys:
+        job_numbers = [i for i, job in enumerate(jobs) if grids[job[0]].key() == grid_key]
+        coverage = load_coverage(reach_ids, polygons, grids[jobs[job_numbers[0]][0]], cache_folder)
+        stats = fused_zonal_statistics(coverage, [(sources[jobs[i][0]], jobs[i][1]) for i in job_numbers], block_size)
+        for i, stat in zip(job_numbers, stats):
+            results[i] = stat
+    for source in sources.values():
+        source.close()
+    return reach_ids, results
@@ -2,6 +2,7 @@ from osgeo import gdal, ogr
 import numpy as np
 import os
 import math
+from Tiled_Raster import TiledRaster
 
 class BDLoG:
     def __init__(self, brat, dem , fac, outDir, bratCap, stat = None):
@@ -35,13 +36,12 @@ class BDLoG:
         self.bratDS = ogr.Open(self.bratPath, 1)
         self.bratLyr = self.bratDS.GetLayer()
         self.nFeat = self.bratLyr.GetFeatureCount()
-        self.demDS = gdal.Open(self.demPath)
-        self.dem = self.demDS.GetRasterBand(1).ReadAsArray()
-        self.facDS = gdal.Open(self.facPath)
-        self.fac = self.facDS.GetRasterBand(1).ReadAsArray()
-        self.idOut = np.full(self.dem.shape, -9999.0, dtype=np.float32)
-        self.geot = self.demDS.GetGeoTransform()
-        self.prj = self.demDS.GetProjection()
+        #rasters are read and written a block at a time, so they don't have to fit in memory
+        self.dem = TiledRaster(self.demPath)
+        self.fac = TiledRaster(self.facPath)
+        self.idOut = TiledRaster.create(self.outDir + "/damID.tif", self.dem, fill_value=-9999.0, nodata=-9999.0)
+        self.geot = self.dem.geotransform
+        self.prj = self.dem.projection
         self.outDS = self.driverShp.CreateDataSource(self.outDir + "/ModeledDamPoints.shp")
         self.outLyr = self.outDS.CreateLayer("ModeledDamPoints",  self.bratLyr.GetSpatialRef(), geom_type=ogr.wkbPoint)
         self.capRank = np.empty([self.nFeat,3])
@@ -303,9 +303,13 @@ class BDLoG:
 
         :return: Numpy array (2, n) with stream cell addresses (array[[row, col],[row, col],...]).
         """
-        fac = self.facDS.GetRasterBand(1).ReadAsArray()
-        streamcells = np.swapaxes(np.where(fac > 0), 0, 1)
-        return streamcells
+        streamcells = [np.zeros((0, 2), dtype=np.int64)]
+        for firstRow, firstCol, nRows, nCols, fac in self.fac.blocks():
+            rows, cols = np.where(fac > 0)
+            streamcells.append(np.column_stack((rows + firstRow, cols + firstCol)))
+        streamcells = np.concatenate(streamcells)
+        #put the cells in row order, as a search of the whole raster would find them, so ties are broken the same way
+        return streamcells[np.lexsort((streamcells[:, 1], streamcells[:, 0]))]
 
     def moveDamsToFAC(self):
         """
@@ -327,7 +331,7 @@ class BDLoG:
             index = np.where(dist == min(dist)) #index of closest stream cell
             damAddress = streamcells[index[0][0]] #change cell address of dam to closest stream cell
             streamcells = np.delete(streamcells, index, axis = 0) #delete stream cell so each dam is located in a different cell
-            self.idOut[damAddress[0]][damAddress[1]] = float(i*1.0)
+            self.idOut[damAddress[0], damAddress[1]] = float(i*1.0)
             damCoords = self.getCoordinatesOfCellAddress(damAddress[0], damAddress[1])
             ptwkt = "POINT(%f %f)" %  (damCoords[0], damCoords[1])
             damPt = ogr.CreateGeometryFromWkt(ptwkt)
@@ -386,14 +390,8 @@ class BDLoG:
 
         :return: None
         """
-        ds = self.driverTiff.Create(self.outDir + "/damID.tif", xsize=self.demDS.RasterXSize, ysize=self.demDS.RasterYSize, bands=1,
-                                    eType=gdal.GDT_Float32)
-        ds.SetGeoTransform(self.geot)
-        ds.SetProjection(self.prj)
-        ds.GetRasterBand(1).WriteArray(self.idOut)
-        ds.GetRasterBand(1).FlushCache()
-        ds.GetRasterBand(1).SetNoDataValue(-9999.0)
-        ds = None
+        #the raster was created when the inputs were loaded, so only the blocks still in the cache need writing
+        self.idOut.flush()
 
     def run(self):
         """
@@ -412,8 +410,9 @@ class BDLoG:
         """
         self.bratDS = None
         self.bratLyr = None
-        self.demDS = None
-        self.facDS = None
+        self.dem.close()
+        self.fac.close()
+        self.idOut.close()
         self.outDS = None
         self.outLyr = None
         del self.dem
@@ -459,6 +458,7 @@ class BDSWEA:
         self.COL_OFFSET = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
         self.MAX_POND_AREA = 100000 #in square meters
         self.MAX_HEIGHT = 5.0 #in meters
+        self.MAX_MEMORY_CELLS = 25000000 #largest raster the ponds are traced on in memory, in cells
 
     def setVars(self, dem, fdir, fac, id, shp):
         """
@@ -473,22 +473,19 @@ class BDSWEA:
         :return: None
         """
         self.count = 0
-        self.demDS = gdal.Open(dem)
-        self.dem = self.demDS.GetRasterBand(1).ReadAsArray()
-        self.fdirDS = gdal.Open(fdir)
-        self.fdir = self.fdirDS.GetRasterBand(1).ReadAsArray()
-        self.facDS = gdal.Open(fac)
-        self.fac = self.facDS.GetRasterBand(1).ReadAsArray()
-        self.idDS = gdal.Open(id)
-        self.id = self.idDS.GetRasterBand(1).ReadAsArray()
+        #rasters are read and written a block at a time, so they don't have to fit in memory
+        self.dem = TiledRaster(dem)
+        self.fdir = TiledRaster(fdir)
+        self.fac = TiledRaster(fac)
+        self.id = TiledRaster(id)
         self.pointDS = ogr.Open(shp, 1)
         self.points = self.pointDS.GetLayer()
         self.nPoints = self.points.GetFeatureCount()
-        self.geot = self.demDS.GetGeoTransform()
-        self.prj = self.demDS.GetProjection()
+        self.geot = self.dem.geotransform
+        self.prj = self.dem.projection
         self.MAX_COUNT = math.ceil(self.MAX_POND_AREA / abs(self.geot[1] * self.geot[5]) / 1)
         self.driverTiff = gdal.GetDriverByName("GTiff")
-        max = np.max(self.fdir)
+        max = np.max([np.max(block) for firstRow, firstCol, nRows, nCols, block in self.fdir.blocks()])
         if max > 8:
             self.FLOW_DIR = self.FLOW_DIR_ESRI
         else:
@@ -496,52 +493,51 @@ class BDSWEA:
 
     def createOutputArrays(self):
         """
-        Create arrays which will be written to rasters.
+        Create the output rasters, concurrent with the input DEM.
 
         :return: None
         """
-        self.idOut = np.copy(self.id)
-        self.htOut = np.empty(shape=[self.dem.shape[0], self.dem.shape[1]])
-        self.htOut.fill(-9999.0)
-        self.depLo = np.empty(shape=[self.dem.shape[0], self.dem.shape[1]])
-        self.depLo.fill(-9999.0)
-        self.depMid = np.empty(shape=[self.dem.shape[0], self.dem.shape[1]])
-        self.depMid.fill(-9999.0)
-        self.depHi = np.empty(shape=[self.dem.shape[0], self.dem.shape[1]])
-        self.depHi.fill(-9999.0)
+        self.idOut = TiledRaster.create(self.outDir + "/pondID.tif", self.dem)
+        for firstRow, firstCol, nRows, nCols, block in self.id.blocks():
+            self.idOut.write_window(firstRow, firstCol, block)
+        #heights and depths are kept in double precision, as the whole arrays were, so ties between heights resolve the same way
+        self.htOut = TiledRaster.create(self.outDir + "/htAbove.tif", self.dem, data_type=gdal.GDT_Float64)
+        self.depLo = TiledRaster.create(self.outDir + "/depLo.tif", self.dem, data_type=gdal.GDT_Float64)
+        self.depMid = TiledRaster.create(self.outDir + "/depMid.tif", self.dem, data_type=gdal.GDT_Float64)
+        self.depHi = TiledRaster.create(self.outDir + "/depHi.tif", self.dem, data_type=gdal.GDT_Float64)
 
     def getDamId(self):
         """
 
-        :return: Numpy array of original dam ID raster.
+        :return: TiledRaster of original dam ID raster.
         """
         return self.id
 
     def getDEM(self):
         """
 
-        :return: Numpy array of DEM.
+        :return: TiledRaster of DEM.
         """
         return self.dem
 
     def getFlowDirection(self):
         """
 
-        :return: Numpy array of flow direction raster.
+        :return: TiledRaster of flow direction raster.
         """
         return self.fdir
 
     def getHeightAbove(self):
         """
 
-        :return: Numpy array of the height of cells above a beaver dam.
+        :return: TiledRaster of the height of cells above a beaver dam.
         """
         return self.htOut
 
     def getPondID(self):
         """
 
-        :return: Numpy array of the dam ID associated with each beaver pond.
+        :return: TiledRaster of the dam ID associated with each beaver pond.
         """
         return self.idOut
 
@@ -586,9 +582,13 @@ class BDSWEA:
 
         :return: None
         """
-        if startX > 0 and startY > 0 and startX < self.demDS.RasterXSize-1 and startY < self.demDS.RasterYSize-1:
-            demWin = self.dem[startY - 1:startY + 2, startX - 1:startX + 2].reshape(1, 9)
-            fdirWin = self.fdir[startY - 1:startY + 2, startX - 1:startX + 2].reshape(1, 9)
+        if startX > 0 and startY > 0 and startX < self.dem.cols-1 and startY < self.dem.rows-1:
+            if self.cellsInMemory:
+                demWin = self.demCells[startY - 1:startY + 2, startX - 1:startX + 2].reshape(1, 9)
+                fdirWin = self.fdirCells[startY - 1:startY + 2, startX - 1:startX + 2].reshape(1, 9)
+            else:
+                demWin = self.demCells.read_window(startY - 1, startX - 1, 3, 3).reshape(1, 9)
+                fdirWin = self.fdirCells.read_window(startY - 1, startX - 1, 3, 3).reshape(1, 9)
             for i in range(0,9):
                 newX = startX
                 newY = startY
@@ -597,11 +597,11 @@ class BDSWEA:
                 if (self.drainsToMe(i, fdirWin[0,i]) and htAbove < self.MAX_HEIGHT and htAbove > -10.0) and self.count < self.MAX_COUNT:
                     newX += self.COL_OFFSET[i]
                     newY += self.ROW_OFFSET[i]
-                    htOld = self.htOut[newY, newX]
+                    htOld = self.htCells[newY, newX]
 
                     if (htOld >= htAbove or htOld == -9999.0):
-                        self.idOut[newY, newX] = pondID
-                        self.htOut[newY, newX] = htAbove
+                        self.idCells[newY, newX] = pondID
+                        self.htCells[newY, newX] = htAbove
                         self.count += 1
 
                         self.backwardHAND(newX, newY, startE, pondID)
@@ -612,14 +612,40 @@ class BDSWEA:
 
         :return: None
         """
-        for i in range(1, self.fdir.shape[0]):
-            for j in range(1, self.fdir.shape[1]):
-                idVal = self.id[i,j]
-
-                if idVal >= 0:
-                    demVal = self.dem[i,j]
-                    self.count = 0
-                    self.backwardHAND(j, i, demVal, idVal)
+        #find the dam cells a block at a time, then visit them in the same row by row order as a scan of the whole raster
+        dams = []
+        for firstRow, firstCol, nRows, nCols, block in self.id.blocks():
+            rows, cols = np.where(block >= 0)
+            for row, col in zip(rows, cols):
+                dams.append((row + firstRow, col + firstCol, block[row, col]))
+        dams.sort()
+
+        #the recursion visits single cells, so trace the ponds on whole arrays when they fit in memory
+        self.cellsInMemory = self.dem.rows * self.dem.cols <= self.MAX_MEMORY_CELLS
+        if self.cellsInMemory:
+            self.demCells = self.dem.read_window(0, 0, self.dem.rows, self.dem.cols)
+            self.fdirCells = self.fdir.read_window(0, 0, self.dem.rows, self.dem.cols)
+            self.htCells = self.htOut.read_window(0, 0, self.dem.rows, self.dem.cols)
+            self.idCells = self.idOut.read_window(0, 0, self.dem.rows, self.dem.cols)
+        else:
+            self.demCells = self.dem
+            self.fdirCells = self.fdir
+            self.htCells = self.htOut
+            self.idCells = self.idOut
+
+        for i, j, idVal in dams:
+            if i >= 1 and j >= 1:
+                demVal = self.demCells[i,j]
+                self.count = 0
+                self.backwardHAND(j, i, demVal, idVal)
+
+        if self.cellsInMemory:
+            self.htOut.write_window(0, 0, self.htCells)
+            self.idOut.write_window(0, 0, self.idCells)
+        del self.demCells
+        del self.fdirCells
+        del self.htCells
+        del self.idCells
 
     def calculateWaterDepth(self):
         """
@@ -627,44 +653,51 @@ class BDSWEA:
 
         :return: None
         """
-        self.dem[self.dem == -9999.0] = np.nan
-        self.htOut[self.htOut == -9999.0] = np.nan
+        #modeled dam heights of each dam, looked up by the pond ID of each cell
+        heights = np.zeros((self.points.GetFeatureCount(), 3))
         for i in range(0, self.points.GetFeatureCount()):
             feature = self.points.GetFeature(i)
-            self.depLo[self.idOut == i] = feature.GetFieldAsDouble("ht_lo_mod") - self.htOut[self.idOut == i]
-            self.depMid[self.idOut == i] = feature.GetFieldAsDouble("ht_mid_mod") - self.htOut[self.idOut == i]
-            self.depHi[self.idOut == i] = feature.GetFieldAsDouble("ht_hi_mod") - self.htOut[self.idOut == i]
+            heights[i] = [feature.GetFieldAsDouble("ht_lo_mod"), feature.GetFieldAsDouble("ht_mid_mod"),
+                          feature.GetFieldAsDouble("ht_hi_mod")]
 
-        self.dem[self.dem == np.nan] = -9999.0
-        self.htOut[self.htOut == np.nan] = -9999.0
-        self.depLo[self.depLo == np.nan] = -9999.0
-        self.depMid[self.depLo == np.nan] = -9999.0
-        self.depHi[self.depLo == np.nan] = -9999.0
+        for firstRow, firstCol, nRows, nCols, idOut in self.idOut.blocks():
+            htOut = self.htOut.read_window(firstRow, firstCol, nRows, nCols).astype(np.float64)
+            htOut[htOut == -9999.0] = np.nan
+            pond = (idOut >= 0) & (idOut < len(heights)) & (idOut == np.floor(idOut))
+            pondIds = idOut[pond].astype(np.int64)
+            for k, depth in enumerate([self.depLo, self.depMid, self.depHi]):
+                dep = depth.read_window(firstRow, firstCol, nRows, nCols)
+                dep[pond] = heights[pondIds, k] - htOut[pond]
+                depth.write_window(firstRow, firstCol, dep)
 
-    def writeArrayToRaster(self, file, array, lowernd, uppernd):
+    def clampArray(self, array, lowernd, uppernd):
         """
-        Save numpy array as a GeoTiff raster concurrent with the input DEM.
+        Set values outside of the valid range of an output to no data.
 
-        :param file: Path to save file.
-        :param array: Numpy array of data.
+        :param array: Numpy array of data, which is changed in place.
+        :param lowernd: Lowest data value.
+        :param uppernd: Highest data value.
+
+        :return: The array.
+        """
+        array[np.isnan(array)] = -9999.0
+        array[array < lowernd] = -9999.0
+        array[array > uppernd] = -9999.0
+        return array
+
+    def clampRaster(self, raster, lowernd, uppernd):
+        """
+        Set values outside of the valid range of an output raster to no data, a block at a time, and write the raster to disk.
+
+        :param raster: TiledRaster of data.
         :param lowernd: Lowest data value.
         :param uppernd: Highest data value.
 
         :return: None
         """
-        if array.shape == self.dem.shape:
-            ds = self.driverTiff.Create(file, xsize=self.demDS.RasterXSize, ysize=self.demDS.RasterYSize, bands=1, eType=gdal.GDT_Float32)
-            ds.SetGeoTransform(self.geot)
-            ds.SetProjection(self.prj)
-            array[np.isnan(array)] = -9999.0
-            array[array < lowernd] = -9999.0
-            array[array > uppernd] = -9999.0
-            ds.GetRasterBand(1).WriteArray(array)
-            ds.GetRasterBand(1).FlushCache()
-            ds.GetRasterBand(1).SetNoDataValue(-9999.0)
-            ds = None
-        else:
-            print "output shape different from input DEM"
+        for firstRow, firstCol, nRows, nCols, block in raster.blocks():
+            raster.write_window(firstRow, firstCol, self.clampArray(block, lowernd, uppernd))
+        raster.flush()
 
     def saveOutputs(self):
         """
@@ -672,11 +705,11 @@ class BDSWEA:
 
         :return: None
         """
-        self.writeArrayToRaster(self.outDir + "/pondID.tif", self.idOut, 0.0, 50000.0)
-        self.writeArrayToRaster(self.outDir + "/htAbove.tif", self.htOut, -500.0, 5000.0)
-        self.writeArrayToRaster(self.outDir + "/depLo.tif", self.depLo, 0.0000001, 20.0)
-        self.writeArrayToRaster(self.outDir + "/depMid.tif", self.depMid, 0.0000001, 20.0)
-        self.writeArrayToRaster(self.outDir + "/depHi.tif", self.depHi, 0.0000001, 20.0)
+        self.clampRaster(self.idOut, 0.0, 50000.0)
+        self.clampRaster(self.htOut, -500.0, 5000.0)
+        self.clampRaster(self.depLo, 0.0000001, 20.0)
+        self.clampRaster(self.depMid, 0.0000001, 20.0)
+        self.clampRaster(self.depHi, 0.0000001, 20.0)
 
     def run(self):
         """
@@ -699,24 +732,27 @@ class BDSWEA:
         :return: None
         """
 
+        #sum the depth and count the inundated cells of every pond a block at a time
+        volumes = np.zeros((3, self.nPoints))
+        areas = np.zeros((3, self.nPoints))
+        for firstRow, firstCol, nRows, nCols, idOut in self.idOut.blocks():
+            pond = (idOut >= 0) & (idOut < self.nPoints) & (idOut == np.floor(idOut))
+            pondIds = idOut[pond].astype(np.int64)
+            for k, depth in enumerate([self.depLo, self.depMid, self.depHi]):
+                dep = depth.read_window(firstRow, firstCol, nRows, nCols)[pond].astype(np.float64)
+                dep[dep < 0.0] = 0.0 #any pond depths less than 0 (including no data) get changed to 0.0
+                volumes[k] += np.bincount(pondIds, weights=dep, minlength=self.nPoints)
+                areas[k] += np.bincount(pondIds, weights=(dep != 0.0), minlength=self.nPoints)
+
         for i in range(0, self.nPoints):
             feature = self.points.GetFeature(i)
             fid = feature.GetFID()
-            lo = np.where(self.idOut == fid, self.depLo, 0.0) #identify cells inundated by dam of FID and get pond depth
-            lo[lo == -9999.0] = 0.0
-            lo[lo < 0.0] = 0.0 #any pond depths less than 0 get changed to 0.0
-            mid = np.where(self.idOut == fid, self.depMid, 0.0)
-            mid[mid == -9999.0] = 0.0
-            mid[mid < 0.0] = 0.0
-            hi = np.where(self.idOut == fid, self.depHi, 0.0)
-            hi[hi == -9999.0] = 0.0
-            hi[hi <=0.0] = 0.0
-            feature.SetField("vol_lo", math.fabs(np.nansum(lo)*self.geot[1]*self.geot[5])) #volume of pond is sum of depths multiplied by cell width and cell height
-            feature.SetField("vol_mid", math.fabs(np.nansum(mid) * self.geot[1] * self.geot[5]))
-            feature.SetField("vol_hi", math.fabs(np.nansum(hi) * self.geot[1] * self.geot[5]))
-            feature.SetField("area_lo", math.fabs(len(np.where(lo != 0.0)[0]) * self.geot[1] * self.geot[5]))
-            feature.SetField("area_mid", math.fabs(len(np.where(mid != 0.0)[0]) * self.geot[1] * self.geot[5]))
-            feature.SetField("area_hi", math.fabs(len(np.where(hi != 0.0)[0]) * self.geot[1] * self.geot[5]))
+            feature.SetField("vol_lo", math.fabs(volumes[0, fid]*self.geot[1]*self.geot[5])) #volume of pond is sum of depths multiplied by cell width and cell height
+            feature.SetField("vol_mid", math.fabs(volumes[1, fid] * self.geot[1] * self.geot[5]))
+            feature.SetField("vol_hi", math.fabs(volumes[2, fid] * self.geot[1] * self.geot[5]))
+            feature.SetField("area_lo", math.fabs(areas[0, fid] * self.geot[1] * self.geot[5]))
+            feature.SetField("area_mid", math.fabs(areas[1, fid] * self.geot[1] * self.geot[5]))
+            feature.SetField("area_hi", math.fabs(areas[2, fid] * self.geot[1] * self.geot[5]))
             self.points.SetFeature(feature)
             self.points.SyncToDisk()
 
@@ -727,15 +763,18 @@ class BDSWEA:
 
         :return: None
         """
-        self.depLo[self.depLo < 0.0] = 0.0
-        self.depMid[self.depMid < 0.0] = 0.0
-        self.depHi[self.depHi < 0.0] = 0.0
-        self.wseLo = self.depLo + self.dem
-        self.wseMid = self.depMid + self.dem
-        self.wseHi = self.depHi + self.dem
-        self.writeArrayToRaster(self.outDir + "/WSESurf_lo.tif", self.wseLo, 0.0, 5000.0)
-        self.writeArrayToRaster(self.outDir + "/WSESurf_mid.tif", self.wseMid, 0.0, 5000.0)
-        self.writeArrayToRaster(self.outDir + "/WSESurf_hi.tif", self.wseHi, 0.0, 5000.0)
+        self.wseLo = TiledRaster.create(self.outDir + "/WSESurf_lo.tif", self.dem)
+        self.wseMid = TiledRaster.create(self.outDir + "/WSESurf_mid.tif", self.dem)
+        self.wseHi = TiledRaster.create(self.outDir + "/WSESurf_hi.tif", self.dem)
+        for firstRow, firstCol, nRows, nCols, dem in self.dem.blocks():
+            dem = dem.astype(np.float64)
+            dem[dem == -9999.0] = np.nan
+            for depth, wse in zip([self.depLo, self.depMid, self.depHi], [self.wseLo, self.wseMid, self.wseHi]):
+                dep = depth.read_window(firstRow, firstCol, nRows, nCols).astype(np.float64)
+                dep[dep < 0.0] = 0.0
+                wse.write_window(firstRow, firstCol, self.clampArray(dep + dem, 0.0, 5000.0))
+        for wse in [self.wseLo, self.wseMid, self.wseHi]:
+            wse.flush()
 
     def writeHead(self):
         """
@@ -743,28 +782,25 @@ class BDSWEA:
 
         :return: None
         """
-        stream = self.fac
-        stream[stream < 1.0] = 0.0
-        stream[stream > 0.0] = 1.0
-        pondlo = self.depLo
-        pondlo[pondlo > 0.0] = 1.0
-        pondlo[pondlo < 0.0] = 0.0
-        pondlo = pondlo + stream
-        pondlo[pondlo > 0.0] = 1.0
-        pondmid = self.depMid
-        pondmid[pondmid > 0.0] = 1.0
-        pondmid[pondmid < 0.0] = 0.0
-        pondmid = pondmid +stream
-        pondmid[pondmid > 0.0] = 1.0
-        pondhi = self.depHi
-        pondhi[pondhi > 0.0] = 1.0
-        pondhi[pondhi < 0.0] = 0.0
-        pondhi = pondhi + stream
-        pondhi[pondhi > 0.0] = 1.0
-        self.writeArrayToRaster(self.outDir + "/head_start.tif", self.dem*stream, 1.0, 5000.0)
-        self.writeArrayToRaster(self.outDir + "/head_lo.tif", self.wseLo*pondlo, 1.0, 5000.0)
-        self.writeArrayToRaster(self.outDir + "/head_mid.tif", self.wseMid*pondmid, 1.0, 5000.0)
-        self.writeArrayToRaster(self.outDir + "/head_hi.tif", self.wseHi*pondhi, 1.0, 5000.0)
+        headStart = TiledRaster.create(self.outDir + "/head_start.tif", self.dem)
+        heads = [TiledRaster.create(self.outDir + "/head_" + name + ".tif", self.dem) for name in ["lo", "mid", "hi"]]
+        for firstRow, firstCol, nRows, nCols, dem in self.dem.blocks():
+            dem = dem.astype(np.float64)
+            dem[dem == -9999.0] = np.nan
+            stream = self.fac.read_window(firstRow, firstCol, nRows, nCols).astype(np.float64)
+            stream[stream < 1.0] = 0.0
+            stream[stream > 0.0] = 1.0
+            headStart.write_window(firstRow, firstCol, self.clampArray(dem*stream, 1.0, 5000.0))
+            for depth, wse, head in zip([self.depLo, self.depMid, self.depHi], [self.wseLo, self.wseMid, self.wseHi], heads):
+                pond = depth.read_window(firstRow, firstCol, nRows, nCols).astype(np.float64)
+                pond[pond > 0.0] = 1.0
+                pond[pond < 0.0] = 0.0
+                pond = pond + stream
+                pond[pond > 0.0] = 1.0
+                wseBlock = wse.read_window(firstRow, firstCol, nRows, nCols).astype(np.float64)
+                head.write_window(firstRow, firstCol, self.clampArray(wseBlock*pond, 1.0, 5000.0))
+        for raster in [headStart] + heads:
+            raster.close()
 
     def writeModflowFiles(self):
         """
@@ -774,6 +810,9 @@ class BDSWEA:
         """
         self.writeSurfaceWSE()
         self.writeHead()
+        self.wseLo.close()
+        self.wseMid.close()
+        self.wseHi.close()
         del self.wseLo
         del self.wseMid
         del self.wseHi
@@ -785,9 +824,8 @@ class BDSWEA:
         :return: None
         """
         # sys.setrecursionlimit(self.origrecursion)
-        self.demDS = None
-        self.fdirDS = None
-        self.idDS = None
+        for raster in [self.dem, self.fdir, self.fac, self.id, self.idOut, self.htOut, self.depLo, self.depMid, self.depHi]:
+            raster.close()
         self.pointDS = None
         self.points = None
         del self.dem
@@ -13,7 +13,7 @@ import arcpy
 import numpy as np
 import os
 import sys
-from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, find_relative_path
+from SupportingFunctions import make_layer, make_folder, find_available_num_prefix, find_relative_path, write_arrays_to_fields
 import XMLBuilder
 reload(XMLBuilder)
 XMLBuilder = XMLBuilder.XMLBuilder
@@ -24,8 +24,6 @@ def main(
     Qlow_eqtn,
     Q2_eqtn):
 
-    scratch = 'in_memory'
-
     arcpy.env.overwriteOutput = True
 
     # create segid array for joining output to input network
@@ -68,36 +66,8 @@ def main(
         Qlow = (DAsqm ** 0.2098) + 1
         Q2 = 14.7 * (DAsqm ** 0.815)
 
-    # save segid, Qlow, Q2 as single table
-    columns = np.column_stack((segid, Qlow, Q2))
-    tmp_table = os.path.dirname(in_network) + "/ihyd_Q_Table.txt"
-    np.savetxt(tmp_table, columns, delimiter = ",", header = "ReachID, iHyd_QLow, iHyd_Q2", comments = "")
-    ihyd_table = scratch + "/ihyd_table"
-    arcpy.CopyRows_management(tmp_table, ihyd_table)
-
     # join Qlow and Q2 output to the flowline network
-    # create empty dictionary to hold input table field values
-    tblDict = {}
-    # add values to dictionary
-    with arcpy.da.SearchCursor(ihyd_table, ['ReachID', "iHyd_QLow", "iHyd_Q2"]) as cursor:
-        for row in cursor:
-            tblDict[row[0]] = [row[1], row[2]]
-    # populate flowline network out field
-    arcpy.AddField_management(in_network, "iHyd_QLow", 'DOUBLE')
-    arcpy.AddField_management(in_network, "iHyd_Q2", 'DOUBLE')
-    with arcpy.da.UpdateCursor(in_network, ['ReachID', "iHyd_QLow", "iHyd_Q2"]) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = tblDict[aKey][0]
-                row[2] = tblDict[aKey][1]
-                cursor.updateRow(row)
-            except:
-                pass
-    tblDict.clear()
-
-    # delete temporary table
-    arcpy.Delete_management(tmp_table)
+    write_arrays_to_fields(in_network, segid, [("iHyd_QLow", Qlow), ("iHyd_Q2", Q2)])
 
     # check that Q2 is greater than Qlow
     # if not, re-calculate Q2 as Qlow + 0.001
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import Batch_FIS
+
+
+def random_inputs(model, num_reaches, seed):
+    random = np.random.RandomState(seed)
+    return [random.uniform(low, high, num_reaches) for low, high in model.input_ranges]
+
+
+@pytest.mark.parametrize("definition, num_reaches", [(Batch_FIS.VEG_MODEL, 200), (Batch_FIS.COMB_MODEL, 25)])
+def test_batch_evaluate_matches_skfuzzy(definition, num_reaches):
+    pytest.importorskip("skfuzzy")
+    model = Batch_FIS.FISModel(definition)
+    inputs = random_inputs(model, num_reaches, 1)
+    # the ends of each input range, where the membership functions are clipped
+    for values, (low, high) in zip(inputs, model.input_ranges):
+        values[:2] = [low, high]
+
+    batch_out = model.evaluate(inputs)
+
+    simulation = Batch_FIS.build_simulation(definition)
+    assert Batch_FIS.compare_with_simulation(model, simulation, inputs, batch_out, tolerance=2e-3) <= 2e-3
+
+
+def test_compare_with_simulation_fails_beyond_tolerance():
+    pytest.importorskip("skfuzzy")
+    model = Batch_FIS.FISModel(Batch_FIS.VEG_MODEL)
+    inputs = random_inputs(model, 5, 2)
+    batch_out = model.evaluate(inputs) + 0.5
+
+    with pytest.raises(Batch_FIS.FISValidationError):
+        Batch_FIS.compare_with_simulation(model, Batch_FIS.build_simulation(Batch_FIS.VEG_MODEL), inputs, batch_out,
+                                          tolerance=0.1)
+
+
+def test_lookup_table_error_bounds():
+    model = Batch_FIS.FISModel(Batch_FIS.VEG_MODEL)
+    lut = Batch_FIS.FISLookupTable(model, cache_folder=None)
+
+    # the grid points themselves are exact
+    grid_x, grid_y = np.meshgrid(lut.axes[0][::40], lut.axes[1][::40], indexing='ij')
+    grid_inputs = [grid_x.ravel(), grid_y.ravel()]
+    np.testing.assert_allclose(lut.evaluate(grid_inputs), model.evaluate(grid_inputs), rtol=0, atol=1e-9)
+
+    # between them, the output stays between the grid values around it and close to the exact output
+    inputs = random_inputs(model, 2000, 3)
+    lut_out = lut.evaluate(inputs)
+    cells = [np.clip(np.floor((values - axis[0]) / (axis[1] - axis[0])).astype(np.int64), 0, lut.grid_size - 2)
+             for values, axis in zip(inputs, lut.axes)]
+    corners = np.stack([lut.surface[cells[0] + i, cells[1] + j] for i in (0, 1) for j in (0, 1)])
+    assert np.all(lut_out >= corners.min(axis=0) - 1e-9)
+    assert np.all(lut_out <= corners.max(axis=0) + 1e-9)
+    report = lut.error_report(inputs, lut_out)
+    assert report['checked'] == 2000
+    assert report['max_error'] < 0.05
+    assert report['mean_error'] < 0.005
+
+
+def test_lookup_table_only_takes_two_inputs():
+    with pytest.raises(Exception):
+        Batch_FIS.FISLookupTable(Batch_FIS.FISModel(Batch_FIS.COMB_MODEL), cache_folder=None)
+
+
+def test_check_engine():
+    assert Batch_FIS.check_engine(None, ['skfuzzy', 'batch']) == 'skfuzzy'
+    assert Batch_FIS.check_engine('', ['skfuzzy', 'batch']) == 'skfuzzy'
+    assert Batch_FIS.check_engine('batch', ['skfuzzy', 'batch']) == 'batch'
+    with pytest.raises(Exception):
+        Batch_FIS.check_engine('lut', ['skfuzzy', 'batch'])
@@ -0,0 +1,137 @@
+import sys
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+ogr = pytest.importorskip("osgeo.ogr")
+osr = pytest.importorskip("osgeo.osr")
+
+if sys.version_info[0] >= 3:
+    pytest.skip("bdws is written for Python 2", allow_module_level=True)
+
+import bdws
+
+
+ESRI_DIRECTIONS = [(0, 1, 1), (1, 1, 2), (1, 0, 4), (1, -1, 8), (0, -1, 16), (-1, -1, 32), (-1, 0, 64), (-1, 1, 128)]
+
+
+def make_dem(rows=24, cols=20):
+    """
+    A valley running down the rows, with a terraced floor so that many cells share a height
+    """
+    row_index, col_index = np.indices((rows, cols))
+    dem = 100.0 + np.round(np.abs(col_index - cols // 2) * 0.75, 1) + np.floor(row_index / 3.0) * 0.5
+    dem = dem[::-1].copy()
+    return dem.astype(np.float32)
+
+
+def make_fdir(dem):
+    """
+    ESRI D8 flow direction to the steepest lower neighbour
+    """
+    rows, cols = dem.shape
+    fdir = np.zeros(dem.shape, np.float32)
+    for row in range(rows):
+        for col in range(cols):
+            best = 0.0
+            for row_step, col_step, code in ESRI_DIRECTIONS:
+                new_row = row + row_step
+                new_col = col + col_step
+                if 0 <= new_row < rows and 0 <= new_col < cols:
+                    drop = (dem[row, col] - dem[new_row, new_col]) / np.hypot(row_step, col_step)
+                    if drop > best:
+                        best = drop
+                        fdir[row, col] = code
+            if fdir[row, col] == 0:
+                fdir[row, col] = 4
+    return fdir
+
+
+def write_raster(path, values):
+    data_set = gdal.GetDriverByName("GTiff").Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    data_set.SetGeoTransform([0.0, 1.0, 0.0, float(values.shape[0]), 0.0, -1.0])
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromEPSG(26912)
+    data_set.SetProjection(spatial_reference.ExportToWkt())
+    band = data_set.GetRasterBand(1)
+    band.SetNoDataValue(-9999.0)
+    band.WriteArray(values)
+    band.FlushCache()
+    data_set = None
+
+
+def write_points(path):
+    data_source = ogr.GetDriverByName("ESRI Shapefile").CreateDataSource(path)
+    layer = data_source.CreateLayer("dams", None, ogr.wkbPoint)
+    layer.CreateField(ogr.FieldDefn("ht_lo_mod", ogr.OFTReal))
+    data_source = None
+
+
+def baseline_heights(dem, fdir, dam_ids, max_count):
+    """
+    The pond search as it ran on whole float64 arrays before the rasters were tiled
+    """
+    sweas = bdws.BDSWEA.__new__(bdws.BDSWEA)
+    sweas.setConstants()
+    sweas.FLOW_DIR = sweas.FLOW_DIR_ESRI
+    id_out = np.copy(dam_ids)
+    ht_out = np.empty(dem.shape)
+    ht_out.fill(-9999.0)
+    rows, cols = dem.shape
+
+    def backward_hand(start_x, start_y, start_e, pond_id):
+        if start_x > 0 and start_y > 0 and start_x < cols - 1 and start_y < rows - 1:
+            dem_window = dem[start_y - 1:start_y + 2, start_x - 1:start_x + 2].reshape(1, 9)
+            fdir_window = fdir[start_y - 1:start_y + 2, start_x - 1:start_x + 2].reshape(1, 9)
+            for i in range(0, 9):
+                ht_above = dem_window[0, i] - start_e
+                if sweas.drainsToMe(i, fdir_window[0, i]) and sweas.MAX_HEIGHT > ht_above > -10.0 and \
+                        state["count"] < max_count:
+                    new_x = start_x + sweas.COL_OFFSET[i]
+                    new_y = start_y + sweas.ROW_OFFSET[i]
+                    ht_old = ht_out[new_y, new_x]
+                    if ht_old >= ht_above or ht_old == -9999.0:
+                        id_out[new_y, new_x] = pond_id
+                        ht_out[new_y, new_x] = ht_above
+                        state["count"] += 1
+                        backward_hand(new_x, new_y, start_e, pond_id)
+
+    state = {"count": 0}
+    for i in range(1, rows):
+        for j in range(1, cols):
+            if dam_ids[i, j] >= 0:
+                state["count"] = 0
+                backward_hand(j, i, dem[i, j], dam_ids[i, j])
+    return id_out, ht_out
+
+
+@pytest.mark.parametrize("max_memory_cells", [25000000, 0])
+def test_pond_heights_match_whole_array_search(tmpdir, max_memory_cells):
+    dem = make_dem()
+    fdir = make_fdir(dem)
+    dam_ids = np.full(dem.shape, -9999.0, np.float32)
+    dam_ids[6, 10] = 0
+    dam_ids[12, 10] = 1
+    dam_ids[18, 10] = 2
+    fac = np.zeros(dem.shape, np.float32)
+    fac[:, 10] = 1
+
+    paths = {}
+    for name, values in [("dem", dem), ("fdir", fdir), ("fac", fac), ("id", dam_ids)]:
+        paths[name] = str(tmpdir.join(name + ".tif"))
+        write_raster(paths[name], values)
+    points = str(tmpdir.join("dams.shp"))
+    write_points(points)
+
+    sweas = bdws.BDSWEA(paths["dem"], paths["fdir"], paths["fac"], paths["id"], str(tmpdir.join("out")), points)
+    sweas.MAX_MEMORY_CELLS = max_memory_cells
+    sweas.heightAboveDams()
+    id_out = sweas.idOut.read_window(0, 0, dem.shape[0], dem.shape[1])
+    ht_out = sweas.htOut.read_window(0, 0, dem.shape[0], dem.shape[1])
+    expected_ids, expected_heights = baseline_heights(dem, fdir, dam_ids, sweas.MAX_COUNT)
+    sweas.close()
+
+    assert (expected_ids >= 0).sum() > 3
+    np.testing.assert_array_equal(id_out, expected_ids)
+    np.testing.assert_array_equal(ht_out, expected_heights)
@@ -0,0 +1,46 @@
+import numpy as np
+
+import Crossing_Index
+
+# reach 0 is crossed in its middle and touched at its end, reach 1 is crossed on a shared vertex, a road runs along
+# reach 2 without crossing it, and reach 3 has two parts with the crossing on the second
+REACHES = [[[(0.0, 0.0), (10.0, 0.0)]],
+           [[(0.0, 10.0), (4.0, 10.0), (10.0, 10.0)]],
+           [[(0.0, 20.0), (10.0, 20.0)]],
+           [[(0.0, 30.0), (4.0, 30.0)], [(20.0, 30.0), (20.0, 40.0)]]]
+ROADS = [[[(5.0, -5.0), (5.0, 5.0)]],
+         [[(4.0, 5.0), (4.0, 15.0)]],
+         [[(2.0, 20.0), (6.0, 20.0)]],
+         [[(15.0, 35.0), (25.0, 35.0)]],
+         [[(10.0, -1.0), (10.0, 1.0)]]]
+
+
+def test_road_crossing_points():
+    crossing_index = Crossing_Index.CrossingIndex(REACHES, ROADS)
+
+    np.testing.assert_array_equal(crossing_index.reach_numbers, [0, 0, 1, 3])
+    np.testing.assert_array_equal(crossing_index.road_numbers, [0, 4, 1, 3])
+    np.testing.assert_allclose(crossing_index.points, [(5.0, 0.0), (10.0, 0.0), (4.0, 10.0), (20.0, 35.0)])
+    np.testing.assert_allclose(crossing_index.distances, [5.0, 10.0, 4.0, 9.0])
+
+
+def test_split_distances():
+    crossing_index = Crossing_Index.CrossingIndex(REACHES, ROADS)
+
+    np.testing.assert_allclose(crossing_index.reach_lengths, [10.0, 10.0, 10.0, 14.0])
+    assert crossing_index.split_distances() == [[5.0], [4.0], [], [9.0]]
+
+
+def test_rtree_finds_the_same_crossings_as_checking_every_segment():
+    random = np.random.RandomState(22)
+    reaches = [[random.uniform(0.0, 100.0, (5, 2)).tolist()] for reach in range(30)]
+    roads = [[random.uniform(0.0, 100.0, (3, 2)).tolist()] for road in range(20)]
+
+    # a single node holds every road segment, so every pair of segments is checked
+    expected = Crossing_Index.CrossingIndex(reaches, roads, node_capacity=1000)
+    crossing_index = Crossing_Index.CrossingIndex(reaches, roads, node_capacity=2, query_chunk=7)
+
+    assert len(expected.points) > 0
+    np.testing.assert_array_equal(crossing_index.reach_numbers, expected.reach_numbers)
+    np.testing.assert_array_equal(crossing_index.road_numbers, expected.road_numbers)
+    np.testing.assert_allclose(crossing_index.points, expected.points)
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+import Focal_Stats
+import Zonal_Stats
+
+NODATA = -9999.0
+
+
+def brute_force_focal_mean(values, nodata):
+    """
+    The 3x3 mean of each cell's neighbours that have data, with NoData cells staying NoData (NaN)
+    """
+    rows, cols = values.shape
+    smoothed = np.full(values.shape, np.nan)
+    for row in range(rows):
+        for col in range(cols):
+            if values[row, col] == nodata:
+                continue
+            neighbours = []
+            for row_offset in (-1, 0, 1):
+                for col_offset in (-1, 0, 1):
+                    new_row = row + row_offset
+                    new_col = col + col_offset
+                    if 0 <= new_row < rows and 0 <= new_col < cols and values[new_row, new_col] != nodata:
+                        neighbours.append(float(values[new_row, new_col]))
+            smoothed[row, col] = sum(neighbours) / len(neighbours)
+    return smoothed
+
+
+def make_dem():
+    random = np.random.RandomState(19)
+    values = random.uniform(1200.0, 1300.0, (9, 11)).astype(np.float32)
+    values[0, :] = NODATA
+    values[:, -1] = NODATA
+    values[4, 5] = NODATA
+    values[8, 0] = NODATA
+    return values
+
+
+def test_focal_mean_matches_brute_force_with_nodata_edges():
+    values = make_dem()
+    window = np.full((values.shape[0] + 2, values.shape[1] + 2), np.nan)
+    window[1:-1, 1:-1] = values
+
+    smoothed = Focal_Stats.focal_mean(window, NODATA)
+
+    np.testing.assert_allclose(smoothed, brute_force_focal_mean(values, NODATA), rtol=0, atol=1e-9)
+
+
+def test_focal_mean_source_windows_match_brute_force():
+    values = make_dem()
+    expected = brute_force_focal_mean(values, NODATA)
+    source = Focal_Stats.FocalMeanSource(Zonal_Stats.ArrayRasterSource(values, NODATA))
+
+    for first_row, first_col, num_rows, num_cols in [(0, 0, 9, 11), (0, 0, 3, 4), (6, 7, 3, 4), (3, 4, 3, 3)]:
+        window = source.read_window(first_row, first_col, num_rows, num_cols)
+        np.testing.assert_allclose(window, expected[first_row:first_row + num_rows, first_col:first_col + num_cols],
+                                   rtol=0, atol=1e-9)
+
+
+def test_raster_signature_only_covers_plain_files(tmpdir):
+    dem = tmpdir.join("dem.tif")
+    dem.write("dem")
+    signature = Focal_Stats.raster_signature(str(dem))
+
+    tmpdir.join("dem.tfw").write("1.0")
+    assert Focal_Stats.raster_signature(str(dem)) != signature
+    assert str(tmpdir.join("dem.tfw")) in Focal_Stats.raster_files(str(dem))
+
+    geodatabase = tmpdir.mkdir("rasters.gdb")
+    assert Focal_Stats.raster_signature(os.path.join(str(geodatabase), "dem")) is None
+    assert Focal_Stats.cached_focal_mean(os.path.join(str(geodatabase), "dem"), str(tmpdir)) is None
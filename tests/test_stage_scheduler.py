@@ -0,0 +1,38 @@
+import numpy as np
+
+import Stage_Scheduler
+
+
+def test_stage_field_arrays_keep_values_and_types():
+    stage_fields = [('ReachID', [4, 2, 9], 'LONG'),
+                    ('iGeo_Slope', [0.01, None, 0.25], 'DOUBLE'),
+                    ('iPC_RoadX', [12, 0, None], 'LONG'),
+                    ('iGeo_Note', ['a', None, 'c'], 'TEXT')]
+
+    reach_ids, field_arrays = Stage_Scheduler.stage_field_arrays(stage_fields)
+
+    assert reach_ids.dtype == np.int64
+    assert reach_ids.tolist() == [4, 2, 9]
+    assert [(field, field_type) for field, values, field_type in field_arrays] == \
+        [('iGeo_Slope', 'DOUBLE'), ('iPC_RoadX', 'LONG'), ('iGeo_Note', 'TEXT')]
+    # empty values stay empty rather than becoming NaN or 0
+    assert [values.tolist() for field, values, field_type in field_arrays] == \
+        [[0.01, None, 0.25], [12, 0, None], ['a', None, 'c']]
+    assert all(values.dtype == object for field, values, field_type in field_arrays)
+
+
+def test_merge_stage_fields_lines_up_reach_ids():
+    results = {
+        'geo': [('ReachID', [1, 2, 3], 'LONG'), ('iGeo_Len', [10.0, 20.0, 30.0], 'DOUBLE')],
+        'veg': [('ReachID', [3, 1, 2], 'LONG'), ('iVeg_30EX', [3.3, 1.1, None], 'DOUBLE'),
+                ('iVeg_Class', ['c', 'a', 'b'], 'TEXT')],
+        'empty': [('ReachID', [2, 3, 1], 'LONG')],
+    }
+
+    reach_ids, field_arrays = Stage_Scheduler.merge_stage_fields(['geo', 'veg', 'empty'], results)
+
+    assert reach_ids.tolist() == [1, 2, 3]
+    assert [(field, values.tolist(), field_type) for field, values, field_type in field_arrays] == \
+        [('iGeo_Len', [10.0, 20.0, 30.0], 'DOUBLE'),
+         ('iVeg_30EX', [1.1, None, 3.3], 'DOUBLE'),
+         ('iVeg_Class', ['a', 'b', 'c'], 'TEXT')]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+
+import Tiled_Raster
+
+
+def write_raster(path, values, nodata=-9999.0):
+    data_set = gdal.GetDriverByName("GTiff").Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    data_set.SetGeoTransform([500.0, 2.0, 0.0, 900.0, 0.0, -2.0])
+    band = data_set.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+    band.WriteArray(values)
+    band.FlushCache()
+    data_set = None
+
+
+def read_raster(path):
+    data_set = gdal.Open(path)
+    values = data_set.GetRasterBand(1).ReadAsArray()
+    data_set = None
+    return values
+
+
+def test_windows_across_block_edges(tmpdir):
+    values = np.arange(23 * 17, dtype=np.float32).reshape(23, 17)
+    path = str(tmpdir.join("values.tif"))
+    write_raster(path, values)
+
+    # blocks of 5 cells and a cache of 2 blocks, so windows span blocks and blocks are dropped and read again
+    raster = Tiled_Raster.TiledRaster(path, block_size=5, cache_blocks=2)
+    assert raster.shape == (23, 17)
+    np.testing.assert_array_equal(raster.read_window(3, 4, 9, 8), values[3:12, 4:12])
+    np.testing.assert_array_equal(raster.read_window(20, 15, 3, 2), values[20:23, 15:17])
+    assert raster[12, 9] == values[12, 9]
+
+    # cells outside of the raster get the fill value
+    window = raster.read_window(-2, -1, 4, 3)
+    np.testing.assert_array_equal(window[2:, 1:], values[:2, :2])
+    assert np.all(window[:2] == raster.fill_value)
+    assert np.all(window[:, 0] == raster.fill_value)
+
+    assert sum(block.size for first_row, first_col, num_rows, num_cols, block in raster.blocks()) == values.size
+    raster.close()
+
+
+def test_write_round_trip_across_block_edges(tmpdir):
+    like_path = str(tmpdir.join("like.tif"))
+    write_raster(like_path, np.zeros((19, 13), np.float32))
+    like = Tiled_Raster.TiledRaster(like_path)
+    out_path = str(tmpdir.join("out.tif"))
+    raster = Tiled_Raster.TiledRaster.create(out_path, like, data_type=gdal.GDT_Float64, block_size=4,
+                                             cache_blocks=2)
+
+    expected = np.full((19, 13), -9999.0)
+    patch = np.random.RandomState(5).uniform(0.0, 1.0, (9, 7))
+    raster.write_window(3, 2, patch)
+    expected[3:12, 2:9] = patch
+    # the parts of a window outside of the raster are ignored
+    raster.write_window(17, 11, np.ones((4, 4)))
+    expected[17:, 11:] = 1.0
+    raster[0, 12] = 0.1234567890123
+    expected[0, 12] = 0.1234567890123
+
+    np.testing.assert_array_equal(raster.read_window(0, 0, 19, 13), expected)
+    raster.close()
+    like.close()
+
+    np.testing.assert_array_equal(read_raster(out_path), expected)
+    reopened = Tiled_Raster.TiledRaster(out_path, block_size=6)
+    np.testing.assert_array_equal(reopened.read_window(0, 0, 19, 13), expected)
+    reopened.close()
@@ -0,0 +1,92 @@
+import numpy as np
+
+import Zonal_Stats
+
+NODATA = -9999.0
+
+# a 12 row by 14 column grid of 10 m cells, with its top left corner at (1000, 2000)
+GRID = Zonal_Stats.RasterGrid(1000.0, 2000.0, 10.0, 10.0, 12, 14)
+
+# overlapping buffers, one with a hole and one covering only NoData, with no vertices on a cell center
+REACH_IDS = [7, 3, 11, 5, 9]
+POLYGONS = [[[(1003.0, 1997.0), (1083.0, 1997.0), (1083.0, 1913.0), (1003.0, 1913.0)]],
+            [[(1041.0, 1962.0), (1127.0, 1951.0), (1103.0, 1887.0), (1033.0, 1902.0)]],
+            [[(1012.0, 1938.0), (1138.0, 1938.0), (1138.0, 1882.0), (1012.0, 1882.0)],
+             [(1052.0, 1927.0), (1098.0, 1927.0), (1098.0, 1893.0), (1052.0, 1893.0)]],
+            [[(1101.0, 1993.0), (1136.0, 1993.0), (1136.0, 1968.0), (1101.0, 1968.0)]],
+            [[(1061.0, 1909.0), (1079.0, 1909.0), (1079.0, 1901.0), (1061.0, 1901.0)]]]
+
+
+def inside(x, y, rings):
+    """
+    Even-odd point in polygon test, for checking the rasterized buffers
+    """
+    count = 0
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            if (y0 <= y < y1) or (y1 <= y < y0):
+                if x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                    count += 1
+    return count % 2 == 1
+
+
+def brute_force_statistics(values, nodata):
+    expected = {'MINIMUM': [], 'MAXIMUM': [], 'MEAN': []}
+    for rings in POLYGONS:
+        cells = []
+        for row in range(GRID.rows):
+            for col in range(GRID.cols):
+                x = GRID.x_min + (col + 0.5) * GRID.cell_width
+                y = GRID.y_max - (row + 0.5) * GRID.cell_height
+                value = values[row, col]
+                if inside(x, y, rings) and value != nodata and not np.isnan(value):
+                    cells.append(float(value))
+        expected['MINIMUM'].append(min(cells) if cells else np.nan)
+        expected['MAXIMUM'].append(max(cells) if cells else np.nan)
+        expected['MEAN'].append(sum(cells) / len(cells) if cells else np.nan)
+    return expected
+
+
+def make_rasters():
+    random = np.random.RandomState(16)
+    first = random.uniform(-50.0, 150.0, (GRID.rows, GRID.cols))
+    first[::3, ::4] = NODATA
+    first[9, 6:8] = NODATA
+    second = random.randint(0, 100, (GRID.rows, GRID.cols)).astype(np.float32)
+    second[2:5, 3:6] = np.nan
+    second[9, 6:8] = np.nan
+    return first, second
+
+
+def test_fused_statistics_match_each_raster_on_its_own():
+    first, second = make_rasters()
+    coverage = Zonal_Stats.BufferCoverage.from_polygons(REACH_IDS, POLYGONS, GRID)
+    first_source = Zonal_Stats.ArrayRasterSource(first, NODATA)
+    second_source = Zonal_Stats.ArrayRasterSource(second)
+    stat_types = ['MINIMUM', 'MAXIMUM', 'MEAN']
+
+    # small blocks, so the buffers span several blocks
+    fused = Zonal_Stats.fused_zonal_statistics(coverage, [(source, stat_type)
+                                                          for source in [first_source, second_source]
+                                                          for stat_type in stat_types], block_size=4)
+
+    for source_number, (values, nodata) in enumerate([(first, NODATA), (second, None)]):
+        separate = Zonal_Stats.zonal_statistics(values, coverage, stat_types, nodata)
+        expected = brute_force_statistics(values, nodata)
+        for stat_number, stat_type in enumerate(stat_types):
+            fused_stat = fused[source_number * len(stat_types) + stat_number]
+            np.testing.assert_allclose(fused_stat, separate[stat_type], rtol=1e-12)
+            np.testing.assert_allclose(fused_stat, expected[stat_type], rtol=1e-12)
+
+
+def test_buffers_over_only_nodata_are_nan():
+    first, second = make_rasters()
+    coverage = Zonal_Stats.BufferCoverage.from_polygons(REACH_IDS, POLYGONS, GRID)
+
+    stats = Zonal_Stats.zonal_statistics(second, coverage, ['MINIMUM', 'MEAN'])
+
+    zone = REACH_IDS.index(9)
+    assert coverage.zone_starts[zone + 1] - coverage.zone_starts[zone] == 2
+    assert np.isnan(stats['MINIMUM'][REACH_IDS.index(9)])
+    assert np.isnan(stats['MEAN'][REACH_IDS.index(9)])
+    assert not np.isnan(stats['MEAN'][REACH_IDS.index(7)])